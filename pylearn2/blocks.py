@@ -17,6 +17,9 @@ except ImportError:
     warnings.warn("Could not import theano.sparse.SparseType")
 from theano.compile.mode import get_default_mode
 
+# Local imports
+from pylearn2.utils.compile import profile_stats
+
 theano.config.warn.sum_div_dimshuffle_bug = False
 
 use_slow_rng = 0
@@ -66,9 +69,11 @@ class Block(object):
         inputs = tensor.matrix()
         if self.cpu_only:
             return theano.function([inputs], self(inputs), name=name,
-                                   mode=get_default_mode().excluding('gpu'))
+                                   mode=get_default_mode().excluding('gpu'),
+                                   profile=profile_stats(name))
         else:
-            return theano.function([inputs], self(inputs), name=name)
+            return theano.function([inputs], self(inputs), name=name,
+                                   profile=profile_stats(name))
 
     def perform(self, X):
         """
@@ -212,7 +217,8 @@ class StackedBlocks(Block):
         return theano.function(
             [inputs],
             outputs=self(inputs)[repr_index],
-            name=name)
+            name=name,
+            profile=profile_stats(name))
 
     def concat(self, name=None, start_index=-1, end_index=None):
         """
@@ -238,7 +244,8 @@ class StackedBlocks(Block):
             [inputs],
             outputs=tensor.concatenate(
                 self(inputs)[start_index:end_index]),
-            name=name)
+            name=name,
+            profile=profile_stats(name))
 
     def append(self, layer):
         """
@@ -15,33 +15,125 @@ Whenever a folder or a dataset copy is created locally, it is granted
 the same access as it has under ${PYLEARN2_LOCAL_DATA_PATH}. This is
 gauranteed by default copy.
 
+Files are copied chunk by chunk into a `.part` file that is verified
+against a checksum of the data read from the server before being renamed.
+An interrupted copy is resumed where it stopped by the next process that
+needs the file.
+
+If ${PYLEARN2_LOCAL_DATA_QUOTA} is defined (a number of bytes, optionally
+followed by one of the suffixes K, M, G or T), the least recently used
+files that no process is using are removed from the local cache to keep
+it under this size.
+
+All the files under ${PYLEARN2_DATA_PATH} that a YAML file refers to can
+be cached at once, concurrently, with `LocalDatasetCache.prefetch_yaml`
+or the `prefetch_local_cache.py` script of `pylearn2/scripts/datasets`.
 """
 
 import atexit
+import errno
+import hashlib
 import logging
 import os
+import re
+import shutil
+import socket
 import stat
+import threading
 import time
 
-import theano.gof.compilelock as compilelock
+from theano.compat.six import string_types
+from theano.compat.six.moves import queue
 
 from pylearn2.utils import string_utils
 
 
 log = logging.getLogger(__name__)
 
+_SIZE_SUFFIXES = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+
+def parse_size(size):
+    """
+    Converts a size like '500M' or '20G' to a number of bytes.
+
+    Parameters
+    ----------
+    size : int or str
+        A number of bytes, or a string holding a number optionally
+        followed by one of the suffixes K, M, G or T (powers of 1024).
+
+    Returns
+    -------
+    size : int
+        The size in bytes.
+    """
+    if not isinstance(size, string_types):
+        return int(size)
+    size = size.strip().upper()
+    if size.endswith('B'):
+        size = size[:-1]
+    multiplier = 1
+    if size and size[-1] in _SIZE_SUFFIXES:
+        multiplier = _SIZE_SUFFIXES[size[-1]]
+        size = size[:-1]
+    try:
+        return int(float(size) * multiplier)
+    except ValueError:
+        raise ValueError("Could not interpret %s as a size in bytes" % size)
+
+
+def _pid_is_running(pid):
+    """
+    Returns whether a process with this pid exists on this machine.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
 
 class LocalDatasetCache:
 
     """
     A local cache for remote files for faster access and reducing
     network stress.
+
+    Parameters
+    ----------
+    quota : int or str, optional
+        Maximal size of the local cache, in bytes or as a string like
+        '20G'. Defaults to ${PYLEARN2_LOCAL_DATA_QUOTA} if it is defined,
+        and no quota otherwise, or if it is not a valid size.
+    copy_chunk_size : int, optional
+        Number of bytes copied at a time from the server.
+    lock_poll_interval : float, optional
+        Number of seconds to wait between attempts to obtain the writelock
+        of a file that another process is caching.
     """
 
-    def __init__(self):
+    def __init__(self, quota=None, copy_chunk_size=16 * 2 ** 20,
+                 lock_poll_interval=1.):
         default_path = '${PYLEARN2_DATA_PATH}'
         local_path = '${PYLEARN2_LOCAL_DATA_PATH}'
         self.pid = os.getpid()
+        self.hostname = socket.gethostname()
+        self.copy_chunk_size = copy_chunk_size
+        self.lock_poll_interval = lock_poll_interval
+
+        if quota is None:
+            # The module makes a cache when imported, so a malformed
+            # variable must not make the import fail
+            quota = os.environ.get('PYLEARN2_LOCAL_DATA_QUOTA')
+            try:
+                self.quota = parse_size(quota) if quota else None
+            except ValueError as e:
+                log.warning("Ignoring PYLEARN2_LOCAL_DATA_QUOTA, the local "
+                            "dataset cache has no quota: %s" % e)
+                self.quota = None
+        else:
+            self.quota = None if quota == '' else parse_size(quota)
 
         try:
             self.dataset_remote_dir = string_utils.preprocess(default_path)
@@ -143,16 +235,31 @@ class LocalDatasetCache:
         # If the file does not exist locally, consider creating it
         if not os.path.exists(local_name):
 
+            # Make room for the file under the quota, if any
+            if not self.make_room(os.path.getsize(remote_name)):
+                log.warning(common_msg +
+                            "File %s not cached: The local cache would "
+                            "exceed its quota of %d bytes" %
+                            (remote_name, self.quota))
+                self.release_writelock(local_name)
+                return filename
+
             # Check that there is enough space to cache the file
             if not self.check_enough_space(remote_name, local_name):
                 log.warning(common_msg +
                             "File %s not cached: Not enough free space" %
                             remote_name)
-                self.release_writelock()
+                self.release_writelock(local_name)
                 return filename
 
             # There is enough space; make a local copy of the file
-            self.copy_from_server_to_local(remote_name, local_name)
+            try:
+                self.copy_from_server_to_local(remote_name, local_name)
+            except (IOError, OSError) as e:
+                log.warning(common_msg + "File %s not cached: %s" %
+                            (remote_name, e))
+                self.release_writelock(local_name)
+                return filename
             log.info(common_msg + "File %s has been locally cached to %s" %
                      (remote_name, local_name))
         elif os.path.getmtime(remote_name) > os.path.getmtime(local_name):
@@ -170,7 +277,7 @@ class LocalDatasetCache:
                                '%Y-%m-%d %H:%M:%S',
                                time.localtime(os.path.getmtime(local_name))
                            )))
-            self.release_writelock()
+            self.release_writelock(local_name)
             return filename
         elif os.path.getsize(local_name) != os.path.getsize(remote_name):
             log.warning(common_msg +
@@ -179,14 +286,14 @@ class LocalDatasetCache:
                         "(%d bytes). The local cache might be corrupt."
                         % (remote_name, os.path.getsize(remote_name),
                            local_name, os.path.getsize(local_name)))
-            self.release_writelock()
+            self.release_writelock(local_name)
             return filename
         elif not os.access(local_name, os.R_OK):
             log.warning(common_msg +
                         "File %s in cache isn't readable. We will use the"
                         " remote version. Manually fix the permission."
                         % (local_name))
-            self.release_writelock()
+            self.release_writelock(local_name)
             return filename
         else:
             log.debug("File %s has previously been locally cached to %s" %
@@ -197,10 +304,107 @@ class LocalDatasetCache:
         # lock on this file which could give the impression that it is
         # unused and therefore safe to delete.
         self.get_readlock(local_name)
-        self.release_writelock()
+        self.mark_used(local_name)
+        self.release_writelock(local_name)
 
         return local_name
 
+    def prefetch(self, filenames, num_threads=4):
+        """
+        Caches several files locally, copying up to `num_threads` of them
+        at the same time.
+
+        Parameters
+        ----------
+        filenames : list of str
+            Remote files to cache locally.
+        num_threads : int, optional
+            Number of files copied concurrently.
+
+        Returns
+        -------
+        output : list of str
+            The paths to use to access the files, as returned by
+            `cache_file`, in the same order as `filenames`.
+        """
+        results = [None] * len(filenames)
+        todo = queue.Queue()
+        for i, filename in enumerate(filenames):
+            todo.put((i, filename))
+
+        def work():
+            while True:
+                try:
+                    i, filename = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[i] = self.cache_file(filename)
+                except Exception:
+                    log.exception("Error while caching %s" % filename)
+                    results[i] = filename
+
+        threads = [threading.Thread(target=work)
+                   for _ in range(min(num_threads, len(filenames)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def yaml_data_files(self, yaml_path):
+        """
+        Lists the files under ${PYLEARN2_DATA_PATH} that a YAML file
+        refers to explicitly.
+
+        Files whose path is computed by a dataset class from its
+        arguments (like the MNIST files from `which_set`) are not found.
+
+        Parameters
+        ----------
+        yaml_path : str
+            Path to a YAML file.
+
+        Returns
+        -------
+        output : list of str
+            The paths of the existing files, with environment variables
+            expanded.
+        """
+        with open(yaml_path) as f:
+            content = f.read()
+        rval = []
+        for match in re.findall(r'\$\{PYLEARN2_DATA_PATH\}[^\s\'",\]\}]*',
+                                content):
+            try:
+                path = string_utils.preprocess(match)
+            except (ValueError, string_utils.NoDataPathError,
+                    string_utils.EnvironmentVariableError):
+                continue
+            if os.path.isfile(path) and path not in rval:
+                rval.append(path)
+        return rval
+
+    def prefetch_yaml(self, yaml_path, num_threads=4):
+        """
+        Caches locally all the files under ${PYLEARN2_DATA_PATH} that a
+        YAML file refers to, concurrently.
+
+        Parameters
+        ----------
+        yaml_path : str
+            Path to a YAML file.
+        num_threads : int, optional
+            Number of files copied concurrently.
+
+        Returns
+        -------
+        output : list of str
+            The paths to use to access the files.
+        """
+        return self.prefetch(self.yaml_data_files(yaml_path), num_threads)
+
     def copy_from_server_to_local(self, remote_fname, local_fname):
         """
         Copies a remote file locally
@@ -219,8 +423,7 @@ class LocalDatasetCache:
         if not os.path.exists(head):
             os.makedirs(os.path.dirname(head))
 
-        command = 'cp ' + remote_fname + ' ' + local_fname
-        os.system(command)
+        self.copy_chunks(remote_fname, local_fname)
         # Copy the original group id and file permission
         st = os.stat(remote_fname)
         os.chmod(local_fname, st.st_mode)
@@ -253,6 +456,185 @@ class LocalDatasetCache:
                 except OSError:
                     pass
 
+    def copy_chunks(self, remote_fname, local_fname):
+        """
+        Copies a remote file chunk by chunk, resuming an interrupted copy
+        if possible, and verifies the copy against a checksum of the data
+        read from the server.
+
+        The copy is made into `local_fname + '.part'`, which is renamed
+        to `local_fname` once verified. The caller must hold the
+        writelock of `local_fname`.
+
+        Parameters
+        ----------
+        remote_fname : string
+            Remote file to copy
+        local_fname : string
+            Path and name of the local copy to be made of the remote
+            file.
+        """
+        part_fname = local_fname + '.part'
+        remote_size = os.path.getsize(remote_fname)
+        digest = hashlib.sha1()
+        offset = 0
+
+        # Resume a previous copy, unless the remote file changed since
+        if os.path.exists(part_fname):
+            if (os.path.getsize(part_fname) <= remote_size and
+                    os.path.getmtime(part_fname) >=
+                    os.path.getmtime(remote_fname)):
+                offset = os.path.getsize(part_fname)
+                with open(part_fname, 'rb') as f:
+                    self._update_digest(digest, f)
+                log.info("Resuming the copy of %s at byte %d" %
+                         (remote_fname, offset))
+            else:
+                os.remove(part_fname)
+
+        with open(remote_fname, 'rb') as src:
+            src.seek(offset)
+            with open(part_fname, 'ab') as dst:
+                while True:
+                    chunk = src.read(self.copy_chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    digest.update(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+
+        local_digest = hashlib.sha1()
+        with open(part_fname, 'rb') as f:
+            self._update_digest(local_digest, f)
+        if (os.path.getsize(part_fname) != remote_size or
+                local_digest.hexdigest() != digest.hexdigest()):
+            os.remove(part_fname)
+            raise IOError("The local copy %s of %s does not match the "
+                          "data read from the server" %
+                          (local_fname, remote_fname))
+        os.rename(part_fname, local_fname)
+
+    def _update_digest(self, digest, f):
+        """
+        Updates a hash with the rest of the contents of a file.
+        """
+        while True:
+            chunk = f.read(self.copy_chunk_size)
+            if not chunk:
+                return
+            digest.update(chunk)
+
+    def mark_used(self, local_fname):
+        """
+        Records that a cached file was just used, for the least recently
+        used eviction. The access time of the file is used for that
+        purpose, since its modification time is compared to the one of the
+        remote file.
+
+        Parameters
+        ----------
+        local_fname : string
+            Path to the cached file
+        """
+        try:
+            os.utime(local_fname,
+                     (time.time(), os.path.getmtime(local_fname)))
+        except OSError:
+            # Only the owner of the file can set its times; the access
+            # time is then only updated by the reads, if at all.
+            pass
+
+    def cached_files(self):
+        """
+        Lists the files in the local cache.
+
+        Returns
+        -------
+        output : list
+            A list of (last use time, size in bytes, path) tuples, least
+            recently used first. Partial copies are not listed.
+        """
+        rval = []
+        for dirpath, dirnames, filenames in os.walk(self.dataset_local_dir):
+            # Do not descend into the lock directories
+            dirnames[:] = [d for d in dirnames
+                           if '.readlock.' not in d and
+                           not d.endswith('.writelock')]
+            for name in filenames:
+                if name.endswith('.part'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                rval.append((st.st_atime, st.st_size, path))
+        rval.sort()
+        return rval
+
+    def in_use(self, local_fname):
+        """
+        Returns whether a process holds a readlock on a cached file.
+        Readlocks left by processes that no longer run are removed.
+
+        Parameters
+        ----------
+        local_fname : string
+            Path to the cached file
+        """
+        folder, name = os.path.split(local_fname)
+        prefix = name + '.readlock.'
+        rval = False
+        for lock in os.listdir(folder):
+            if not lock.startswith(prefix):
+                continue
+            try:
+                pid = int(lock[len(prefix):].split('.')[0])
+            except ValueError:
+                rval = True
+                continue
+            if _pid_is_running(pid):
+                rval = True
+            else:
+                log.debug("Removing stale readlock %s" % lock)
+                self.release_readlock(os.path.join(folder, lock))
+        return rval
+
+    def make_room(self, size):
+        """
+        Removes the least recently used files that are not in use from the
+        local cache, until a file of `size` bytes fits in the quota.
+
+        Parameters
+        ----------
+        size : int
+            Size in bytes of the file to be cached
+
+        Returns
+        -------
+        output : boolean
+            True if the file fits in the quota, or if there is no quota.
+        """
+        if self.quota is None:
+            return True
+        files = self.cached_files()
+        used = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in files:
+            if used + size <= self.quota:
+                break
+            if not self.try_writelock(path):
+                continue
+            try:
+                if not self.in_use(path) and os.path.exists(path):
+                    log.info("Evicting %s (%d bytes) from the local "
+                             "dataset cache" % (path, file_size))
+                    os.remove(path)
+                    used -= file_size
+            finally:
+                self.release_writelock(path)
+        return used + size <= self.quota
+
     def disk_usage(self, path):
         """
         Return free usage about the given path, in bytes
@@ -335,7 +717,13 @@ class LocalDatasetCache:
 
             if os.path.exists(folderToCreate):
                 continue
-            os.mkdir(folderToCreate)
+            try:
+                os.mkdir(folderToCreate)
+            except OSError as e:
+                # Another process or thread may have created it meanwhile
+                if e.errno != errno.EEXIST:
+                    raise
+                continue
             if force_perm:
                 os.chmod(folderToCreate, force_perm)
 
@@ -370,28 +758,87 @@ class LocalDatasetCache:
         if (os.path.exists(lockdirName) and os.path.isdir(lockdirName)):
             os.rmdir(lockdirName)
 
-    def get_writelock(self, filename):
+    def try_writelock(self, filename):
         """
-        Obtain a writelock on a file.
-        Only one write lock may be held at any given time.
+        Try to obtain a writelock on a file, without waiting.
+
+        The writelock is a folder named after the file, holding the host
+        name and pid of its owner, so that writelocks on different files
+        can be held at the same time, and the writelock of a process that
+        died can be taken over.
 
         Parameters
         ----------
         filename : string
             Name of the file on which to obtain a writelock
+
+        Returns
+        -------
+        output : boolean
+            True if the writelock was obtained.
+        """
+        lockdirName = filename + ".writelock"
+        try:
+            os.mkdir(lockdirName)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            if self.writelock_is_stale(lockdirName):
+                log.debug("Removing stale writelock %s" % lockdirName)
+                shutil.rmtree(lockdirName, ignore_errors=True)
+            return False
+        with open(os.path.join(lockdirName, 'owner'), 'w') as f:
+            f.write('%s %d' % (self.hostname, self.pid))
+        return True
+
+    def writelock_is_stale(self, lockdirName, grace_period=60):
+        """
+        Returns whether the owner of a writelock is a process of this
+        machine that no longer runs.
+
+        Parameters
+        ----------
+        lockdirName : string
+            Name of the writelock folder
+        grace_period : float
+            Number of seconds during which a writelock without an owner
+            is considered as being created.
         """
+        try:
+            with open(os.path.join(lockdirName, 'owner')) as f:
+                hostname, pid = f.read().split()
+            pid = int(pid)
+        except (IOError, OSError, ValueError):
+            try:
+                age = time.time() - os.path.getmtime(lockdirName)
+            except OSError:
+                return False
+            return age > grace_period
+        return hostname == self.hostname and not _pid_is_running(pid)
 
-        # compilelock expect locks to be on folder. Since we want a lock on a
-        # file, we will have to ask compilelock for a folder with a different
-        # name from the file we want a lock on or else compilelock will
-        # try to create a folder with the same name as the file
-        compilelock.get_lock(filename + ".writelock")
+    def get_writelock(self, filename):
+        """
+        Obtain a writelock on a file, waiting for other processes to
+        release it if needed.
 
-    def release_writelock(self):
+        Parameters
+        ----------
+        filename : string
+            Name of the file on which to obtain a writelock
+        """
+        while not self.try_writelock(filename):
+            time.sleep(self.lock_poll_interval)
+
+    def release_writelock(self, filename):
         """
-        Release the previously obtained writelock
+        Release a previously obtained writelock
+
+        Parameters
+        ----------
+        filename : string
+            Name of the file on which the writelock was obtained
         """
-        compilelock.release_lock()
+        shutil.rmtree(filename + ".writelock", ignore_errors=True)
 
 
 datasetCache = LocalDatasetCache()
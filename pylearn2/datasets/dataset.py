@@ -19,7 +19,8 @@ class Dataset(object):
         return self.iterator()
 
     def iterator(self, mode=None, batch_size=None, num_batches=None,
-                 rng=None, data_specs=None, return_tuple=False):
+                 rng=None, data_specs=None, return_tuple=False,
+                 prefetch=None, reuse_buffers=None):
         """
         Return an iterator for this dataset with the specified
         behaviour. Unspecified values are filled-in by the default.
@@ -77,6 +78,20 @@ class Dataset(object):
             at each iteration. If False, it will return the minibatch
             itself. This flag has no effect if data_specs is composite.
             Default: False.
+        prefetch : int, optional
+            If specified and positive, the iterator retrieves and formats
+            up to `prefetch` batches ahead on a background thread, so that
+            data loading overlaps with the consumer's computation. See
+            `pylearn2.utils.iteration.FiniteDatasetIterator`. Not all
+            datasets support this option.
+        reuse_buffers : int, optional
+            If specified and positive, batches of randomly selected
+            examples are gathered into a ring of `reuse_buffers`
+            preallocated arrays instead of newly allocated ones, so each
+            batch is only valid until `reuse_buffers` more batches have
+            been retrieved. See
+            `pylearn2.utils.iteration.FiniteDatasetIterator`. Not all
+            datasets support this option.
 
         Returns
         -------
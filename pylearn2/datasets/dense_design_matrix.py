@@ -17,6 +17,8 @@ __email__ = "pylearn-dev@googlegroups"
 import functools
 
 import logging
+import mmap
+import os
 import warnings
 
 import numpy as np
@@ -41,6 +43,7 @@ from pylearn2.utils import safe_zip
 from pylearn2.utils.exc import reraise_as
 from pylearn2.utils.rng import make_np_rng
 from pylearn2.utils import contains_nan
+from pylearn2.utils.string_utils import preprocess
 from theano import config
 
 
@@ -57,6 +60,54 @@ def ensure_tables():
         import tables
 
 
+def _is_mapped_from(array, path):
+    """
+    Returns whether `array` is the memory map of the whole `.npy` file
+    `path`, opened in mode 'r' or 'r+', so that the file already holds its
+    data.
+
+    Parameters
+    ----------
+    array : ndarray
+        The array.
+    path : str
+        The path of a `.npy` file.
+
+    Returns
+    -------
+    mapped : bool
+        False if `array` is not a memory map of `path`, is a slice or a
+        view of one, or was opened in mode 'c', in which case it may hold
+        modifications that are not in the file.
+    """
+    if not isinstance(array, np.memmap):
+        return False
+    filename = getattr(array, 'filename', None)
+    if (filename is None or
+            os.path.abspath(filename) != os.path.abspath(path)):
+        return False
+    # Slices and views of a memory map keep its filename and offset, but
+    # only the map itself is based directly on the mmap object
+    if not isinstance(array.base, mmap.mmap):
+        return False
+    if array.mode not in ('r', 'r+'):
+        return False
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(f)
+        else:
+            header = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    shape, fortran_order, dtype = header
+    if fortran_order:
+        contiguous = array.flags.f_contiguous
+    else:
+        contiguous = array.flags.c_contiguous
+    return (array.offset == offset and array.shape == shape and
+            array.dtype == dtype and contiguous)
+
+
 class DenseDesignMatrix(Dataset):
 
     """
@@ -240,6 +291,8 @@ class DenseDesignMatrix(Dataset):
 
         self.compress = False
         self.design_loc = None
+        self.sources_loc = None
+        self.mmap_mode = None
         self.rng = make_np_rng(rng, which_method="random_integers")
         # Defaults for iterators
         self._iter_mode = resolve_iterator_class('sequential')
@@ -267,7 +320,7 @@ class DenseDesignMatrix(Dataset):
     @functools.wraps(Dataset.iterator)
     def iterator(self, mode=None, batch_size=None, num_batches=None,
                  rng=None, data_specs=None,
-                 return_tuple=False):
+                 return_tuple=False, prefetch=None, reuse_buffers=None):
 
         [mode, batch_size, num_batches, rng, data_specs] = self._init_iterator(
             mode, batch_size, num_batches, rng, data_specs)
@@ -301,7 +354,9 @@ class DenseDesignMatrix(Dataset):
                                           rng),
                                      data_specs=data_specs,
                                      return_tuple=return_tuple,
-                                     convert=convert)
+                                     convert=convert,
+                                     prefetch=prefetch,
+                                     reuse_buffers=reuse_buffers)
 
     def get_data(self):
         """
@@ -344,6 +399,45 @@ class DenseDesignMatrix(Dataset):
 
         self.design_loc = path
 
+    def use_sources_loc(self, path, mmap_mode='r'):
+        """
+        Calling this function changes the serialization behavior of the object
+        permanently.
+
+        If this function has been called, when the object is serialized, the
+        design matrix and the targets are saved as `X.npy` and `y.npy` in the
+        directory `path`, and only the rest of the dataset object is
+        pickled. When the object is deserialized, these files are opened
+        with `numpy.load(..., mmap_mode=mmap_mode)`, so that loading is
+        almost instantaneous whatever the size of the dataset, and that the
+        processes of a host using the same dataset share its pages instead
+        of each holding a private copy.
+
+        The pickle can be saved in `path` too, but this is not required.
+        Re-serializing a dataset loaded this way does not rewrite the files
+        it maps, unless its data was replaced (e.g. by a subset of it) or
+        was mapped in mode 'c'.
+
+        Parameters
+        ----------
+        path : str
+            The directory to save the design matrix and targets to. It can
+            contain environment variables like ${PYLEARN2_DATA_PATH}.
+        mmap_mode : str or None, optional
+            The `mmap_mode` argument of `numpy.load`. The default, 'r',
+            makes the data read-only; use 'c' to allow in-place
+            modifications (e.g. by preprocessors) that are only written to
+            disk when the dataset is serialized again, or None to load the
+            data in memory.
+        """
+
+        if mmap_mode not in (None, 'r', 'r+', 'c'):
+            raise ValueError("mmap_mode should be None, 'r', 'r+' or 'c', "
+                             "got %s" % str(mmap_mode))
+
+        self.sources_loc = path
+        self.mmap_mode = mmap_mode
+
     def get_topo_batch_axis(self):
         """
         The index of the axis of the batches
@@ -390,7 +484,37 @@ class DenseDesignMatrix(Dataset):
             rval['X'] *= 255. / rval['compress_max']
             rval['X'] = np.cast['uint8'](rval['X'])
 
-        if self.design_loc is not None:
+        sources_loc = getattr(self, 'sources_loc', None)
+        if sources_loc is not None:
+            if self.compress:
+                raise ValueError("Compression can't be used together with "
+                                 "use_sources_loc.")
+            path = preprocess(sources_loc)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            saved = []
+            for name in ('X', 'y'):
+                if rval[name] is None:
+                    continue
+                fname = os.path.join(path, name + '.npy')
+                if _is_mapped_from(rval[name], fname):
+                    # The file already holds the data
+                    if rval[name].mode == 'r+':
+                        rval[name].flush()
+                else:
+                    # The data may be mapped from the file, e.g. if it is
+                    # a subset of it, so the file must not be truncated
+                    # while it is being written
+                    tmp_fname = fname + '.tmp'
+                    with open(tmp_fname, 'wb') as f:
+                        np.save(f, rval[name])
+                    if os.name == 'nt' and os.path.exists(fname):
+                        os.remove(fname)
+                    os.rename(tmp_fname, fname)
+                rval[name] = None
+                saved.append(name)
+            rval['saved_sources'] = tuple(saved)
+        elif self.design_loc is not None:
             # TODO: Get rid of this logic, use custom array-aware picklers
             # (joblib, custom pylearn2 serialization format).
             np.save(self.design_loc, rval['X'])
@@ -404,7 +528,20 @@ class DenseDesignMatrix(Dataset):
 
             WRITEME
         """
-        if d['design_loc'] is not None:
+        # To be able to unpickle data saved before use_sources_loc existed
+        d.setdefault('sources_loc', None)
+        d.setdefault('mmap_mode', None)
+
+        if d['sources_loc'] is not None:
+            path = preprocess(d['sources_loc'])
+            for name in d.pop('saved_sources'):
+                if control.get_load_data():
+                    fname = cache.datasetCache.cache_file(
+                        os.path.join(path, name + '.npy'))
+                    d[name] = np.load(fname, mmap_mode=d['mmap_mode'])
+                else:
+                    d[name] = None
+        elif d['design_loc'] is not None:
             if control.get_load_data():
                 fname = cache.datasetCache.cache_file(d['design_loc'])
                 d['X'] = np.load(fname)
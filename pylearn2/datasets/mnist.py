@@ -101,8 +101,10 @@ class MNIST(dense_design_matrix.DenseDesignMatrix):
                 raise ValueError(
                     'Unrecognized which_set value "%s".' % (which_set,) +
                     '". Valid values are ["train","test"].')
-            topo_view = np.random.rand(size, 28, 28)
-            y = np.random.randint(0, 10, (size, 1))
+            # Random data with the types of the real data, e.g. to run a
+            # model without downloading the dataset
+            topo_view = np.random.rand(size, 28, 28).astype('float32')
+            y = np.random.randint(0, 10, (size, 1)).astype('uint8')
 
         if binarize:
             topo_view = (topo_view > 0.5).astype('float32')
@@ -0,0 +1,362 @@
+"""
+A content-addressed on-disk cache for preprocessed datasets.
+
+Expensive preprocessing like global contrast normalization followed by ZCA
+whitening is deterministic given the data and the configuration of the
+preprocessor, so there is no need to pay for it at the start of every job.
+Wrapping a preprocessor in a :py:class:`CachedPreprocessor` stores the
+preprocessed design matrix as a `.npy` file under
+`${PYLEARN2_DATA_PATH}/preprocessed_cache`, keyed by a hash of the data
+and of the pickled preprocessor, and memory-maps it on later runs:
+
+.. code-block:: python
+
+    from pylearn2.datasets import preprocessing
+    from pylearn2.datasets.preprocessed_cache import CachedPreprocessor
+
+    pipeline = preprocessing.Pipeline(
+        items=[preprocessing.GlobalContrastNormalization(),
+               preprocessing.ZCA()])
+    cached = CachedPreprocessor(pipeline, max_bytes=20 * 10 ** 9)
+    dataset.apply_preprocessor(cached, can_fit=True)
+
+In a YAML file, the `CachedPreprocessor` is given as the `preprocessor`
+of the dataset in the same way.
+
+The cache is bounded in size by evicting the least recently used entries.
+It can be emptied or trimmed with the `clear_preprocessed_cache.py` script
+of `pylearn2/scripts/datasets`.
+"""
+__copyright__ = "Copyright 2010-2015, Universite de Montreal"
+__license__ = "3-clause BSD"
+__maintainer__ = "LISA Lab"
+__email__ = "pylearn-dev@googlegroups"
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+from theano.compat.six.moves import cPickle, xrange
+
+from pylearn2.datasets.preprocessing import Preprocessor
+from pylearn2.utils import serial
+from pylearn2.utils import string_utils
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = '${PYLEARN2_DATA_PATH}/preprocessed_cache'
+
+# The protocol used to pickle the preprocessors that are hashed. It is fixed
+# so that the keys do not change with the default protocol.
+_KEY_PICKLE_PROTOCOL = 2
+
+
+def _update_with_array(digest, arr, chunk_size=10000):
+    """
+    Updates a hash with the dtype, shape and contents of an array, without
+    copying the whole array at once.
+
+    Parameters
+    ----------
+    digest : hashlib hash object
+        The hash to update.
+    arr : ndarray
+        The array to hash.
+    chunk_size : int, optional
+        Number of rows hashed at a time.
+    """
+    digest.update(str(arr.dtype).encode('ascii'))
+    digest.update(str(arr.shape).encode('ascii'))
+    if arr.ndim == 0:
+        digest.update(arr.tobytes())
+        return
+    for start in xrange(0, arr.shape[0], chunk_size):
+        digest.update(np.ascontiguousarray(
+            arr[start:start + chunk_size]).tobytes())
+
+
+class PreprocessedCache(object):
+    """
+    A directory of preprocessed design matrices, with least recently used
+    eviction.
+
+    Each entry is made of a `<key>.npy` file holding the design matrix, and
+    of a `<key>.pkl` file holding the rest of the state of the dataset and
+    the preprocessor as they were after preprocessing (a fitted ZCA, for
+    instance, is needed later to preprocess the test set).
+
+    Parameters
+    ----------
+    path : str, optional
+        The directory of the cache. Environment variables are expanded.
+        Defaults to `${PYLEARN2_DATA_PATH}/preprocessed_cache`.
+    max_bytes : int, optional
+        If specified, the least recently used entries are removed after
+        storing a new one, until the cache takes at most this many bytes.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        if path is None:
+            path = DEFAULT_CACHE_DIR
+        self.path = string_utils.preprocess(path)
+        self.max_bytes = max_bytes
+
+    def key(self, dataset, preprocessor, can_fit):
+        """
+        Returns the key under which the result of applying a preprocessor
+        to a dataset is stored.
+
+        The key identifies the data by its content rather than by the
+        arguments used to build the dataset, since the data may already
+        have been modified by other preprocessors since then.
+
+        Parameters
+        ----------
+        dataset : DenseDesignMatrix
+            The dataset, before preprocessing.
+        preprocessor : Preprocessor
+            The preprocessor, before preprocessing.
+        can_fit : bool
+            The `can_fit` argument of the preprocessing.
+
+        Returns
+        -------
+        key : str
+            A hexadecimal digest.
+        """
+        digest = hashlib.sha1()
+        cls = dataset.__class__
+        digest.update(('%s.%s' % (cls.__module__, cls.__name__))
+                      .encode('ascii'))
+        _update_with_array(digest, dataset.X)
+        y = getattr(dataset, 'y', None)
+        if y is not None:
+            _update_with_array(digest, np.asarray(y))
+        digest.update(cPickle.dumps(preprocessor, _KEY_PICKLE_PROTOCOL))
+        digest.update(str(bool(can_fit)).encode('ascii'))
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        """
+        Returns the paths of the design matrix and state files of an entry.
+        """
+        base = os.path.join(self.path, key)
+        return base + '.npy', base + '.pkl'
+
+    def load(self, key):
+        """
+        Loads an entry of the cache, and marks it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry.
+
+        Returns
+        -------
+        entry : tuple or None
+            `None` if there is no such entry. Otherwise, a tuple
+            (X, state, preprocessor) where `X` is the design matrix,
+            memory-mapped copy-on-write, `state` is a dictionary holding
+            the other attributes of the dataset and `preprocessor` is the
+            preprocessor, after preprocessing.
+        """
+        X_path, state_path = self._paths(key)
+        # The design matrix is written last, so its presence means the
+        # entry is complete.
+        if not os.path.exists(X_path):
+            return None
+        try:
+            with open(state_path, 'rb') as f:
+                state, preprocessor = cPickle.load(f)
+            X = np.load(X_path, mmap_mode='c')
+        except (IOError, OSError, EOFError, ValueError,
+                cPickle.UnpicklingError) as e:
+            log.warning("Could not load entry %s of the preprocessed "
+                        "dataset cache (%s), ignoring it." % (key, e))
+            return None
+        for path in (X_path, state_path):
+            os.utime(path, None)
+        return X, state, preprocessor
+
+    def store(self, key, dataset, preprocessor):
+        """
+        Stores a preprocessed dataset, then evicts old entries if the
+        cache is too large.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry, computed before preprocessing.
+        dataset : DenseDesignMatrix
+            The dataset, after preprocessing.
+        preprocessor : Preprocessor
+            The preprocessor, after preprocessing.
+        """
+        serial.mkdir(self.path)
+        X_path, state_path = self._paths(key)
+        state = dict((name, value)
+                     for name, value in dataset.__dict__.items()
+                     if name != 'X')
+        # Write to temporary files renamed at the end, so that concurrent
+        # jobs never see a partially written entry.
+        suffix = '.%d.tmp' % os.getpid()
+        try:
+            with open(state_path + suffix, 'wb') as f:
+                cPickle.dump((state, preprocessor), f,
+                             serial.get_pickle_protocol())
+            with open(X_path + suffix, 'wb') as f:
+                np.save(f, dataset.X)
+        except (cPickle.PicklingError, TypeError, IOError, OSError) as e:
+            log.warning("Could not store the preprocessed dataset in the "
+                        "cache (%s)." % e)
+            for path in (state_path + suffix, X_path + suffix):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        os.rename(state_path + suffix, state_path)
+        os.rename(X_path + suffix, X_path)
+        if self.max_bytes is not None:
+            self.trim(self.max_bytes)
+
+    def entries(self):
+        """
+        Lists the entries of the cache.
+
+        Returns
+        -------
+        entries : list
+            A list of (last use time, size in bytes, key) tuples, least
+            recently used first.
+        """
+        if not os.path.isdir(self.path):
+            return []
+        rval = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.npy'):
+                continue
+            key = name[:-len('.npy')]
+            X_path, state_path = self._paths(key)
+            try:
+                size = os.path.getsize(X_path)
+                if os.path.exists(state_path):
+                    size += os.path.getsize(state_path)
+                last_use = os.path.getmtime(X_path)
+            except OSError:
+                # Removed by another process in the meantime
+                continue
+            rval.append((last_use, size, key))
+        rval.sort()
+        return rval
+
+    def invalidate(self, key):
+        """
+        Removes an entry from the cache.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry.
+        """
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def trim(self, max_bytes):
+        """
+        Removes the least recently used entries until the cache takes at
+        most `max_bytes` bytes.
+
+        Parameters
+        ----------
+        max_bytes : int
+            The maximal size of the cache, in bytes.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= max_bytes:
+                break
+            log.info("Evicting entry %s (%d bytes) from the preprocessed "
+                     "dataset cache." % (key, size))
+            self.invalidate(key)
+            total -= size
+
+    def clear(self):
+        """
+        Removes all the entries from the cache.
+        """
+        for _, _, key in self.entries():
+            self.invalidate(key)
+
+
+class CachedPreprocessor(Preprocessor):
+    """
+    Applies another preprocessor through a :py:class:`PreprocessedCache`.
+
+    If the same preprocessor was already applied to the same data, the
+    preprocessed design matrix is memory-mapped from the cache instead of
+    being computed again, and the preprocessor is replaced by its fitted
+    version. Otherwise, the preprocessor is applied and the result is
+    stored in the cache.
+
+    Only datasets storing their data in an `X` ndarray, like
+    DenseDesignMatrix, are cached; the preprocessor is simply applied to
+    the other ones.
+
+    Parameters
+    ----------
+    preprocessor : Preprocessor
+        The preprocessor to apply.
+    path : str, optional
+        The directory of the cache. Defaults to
+        `${PYLEARN2_DATA_PATH}/preprocessed_cache`.
+    max_bytes : int, optional
+        Maximal size of the cache, in bytes. See
+        :py:class:`PreprocessedCache`.
+    """
+
+    def __init__(self, preprocessor, path=None, max_bytes=None):
+        self.preprocessor = preprocessor
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def apply(self, dataset, can_fit=False):
+        """
+        .. todo::
+
+            WRITEME
+        """
+        if not isinstance(getattr(dataset, 'X', None), np.ndarray):
+            log.warning("%s can only cache datasets with an X ndarray, "
+                        "applying %s without the cache." %
+                        (self.__class__.__name__,
+                         self.preprocessor.__class__.__name__))
+            self.preprocessor.apply(dataset, can_fit)
+            return
+
+        cache = PreprocessedCache(self.path, self.max_bytes)
+        key = cache.key(dataset, self.preprocessor, can_fit)
+        entry = cache.load(key)
+        if entry is not None:
+            log.info("Loading preprocessed dataset %s from %s" %
+                     (key, cache.path))
+            X, state, self.preprocessor = entry
+            dataset.__dict__.update(state)
+            dataset.X = X
+            return
+
+        self.preprocessor.apply(dataset, can_fit)
+        cache.store(key, dataset, self.preprocessor)
+
+    def invert(self):
+        """
+        .. todo::
+
+            WRITEME
+        """
+        self.preprocessor.invert()
@@ -12,8 +12,10 @@ __maintainer__ = "LISA Lab"
 __email__ = "pylearn-dev@googlegroups"
 
 
+import collections
 import copy
 import logging
+import multiprocessing
 import time
 import warnings
 import os
@@ -135,12 +137,194 @@ class ExamplewisePreprocessor(Preprocessor):
 
     TODO: can these things fit themselves in their apply method?
     That seems like a difference from Block.
+
+    Subclasses that set `chunkable` to `True` can also be applied chunk
+    by chunk with `apply_chunked`, which does not need the design matrix
+    to fit in memory. They implement `_transform_chunk` and, if they
+    need to be fit, `_fit_chunk`, `_merge_fit_stats` and `_finish_fit`.
     """
 
+    # Whether this preprocessor supports apply_chunked
+    chunkable = False
+
     def as_block(self):
         raise NotImplementedError(str(type(self)) +
                                   " does not implement as_block.")
 
+    def apply_chunked(self, dataset, can_fit=False, chunk_size=10000,
+                      num_workers=0):
+        """
+        Applies the preprocessor to blocks of rows of the design matrix
+        of `dataset`, modifying it in place.
+
+        If `can_fit` is True, a first pass over the blocks accumulates the
+        statistics needed to fit the preprocessor. A second pass then
+        transforms each block and writes it back. Only one block per
+        worker is in memory at a time, so this works for datasets whose
+        design matrix is stored on disk, such as
+        `DenseDesignMatrixPyTables` or a `numpy.memmap` opened in 'r+'
+        mode.
+
+        Parameters
+        ----------
+        dataset : DenseDesignMatrix
+            The dataset to act on. Its design matrix must be writable.
+        can_fit : bool, optional
+            If True, the Preprocessor can adapt internal parameters
+            based on the contents of dataset.
+        chunk_size : int, optional
+            The number of rows in each block.
+        num_workers : int, optional
+            If positive, the blocks are processed by a pool of this many
+            worker processes, while the calling process reads and writes
+            them.
+        """
+        if not self.chunkable:
+            raise NotImplementedError(str(type(self)) +
+                                      " does not support apply_chunked.")
+        X = dataset.get_design_matrix()
+        pool = None
+        if num_workers > 0:
+            pool = multiprocessing.Pool(num_workers)
+        try:
+            if can_fit:
+                stats = None
+                for _, chunk_stats in _map_chunks(_fit_chunk, self, X,
+                                                  chunk_size, pool,
+                                                  num_workers):
+                    if stats is None:
+                        stats = chunk_stats
+                    else:
+                        stats = self._merge_fit_stats(stats, chunk_stats)
+                self._finish_fit(stats, X.dtype)
+            for start, chunk in _map_chunks(_transform_chunk, self, X,
+                                            chunk_size, pool, num_workers):
+                log.debug("%s processed rows %d to %d" %
+                          (self.__class__.__name__, start,
+                           start + chunk.shape[0]))
+                X[start:start + chunk.shape[0]] = chunk
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def _fit_chunk(self, X):
+        """
+        Returns the statistics of a block of rows needed to fit the
+        preprocessor. Preprocessors with nothing to fit return None.
+
+        Parameters
+        ----------
+        X : ndarray
+            A block of rows of the design matrix.
+        """
+        return None
+
+    def _merge_fit_stats(self, stats, other):
+        """
+        Combines the statistics returned by `_fit_chunk` for two disjoint
+        sets of rows.
+
+        Parameters
+        ----------
+        stats : object
+            Statistics of a first set of rows.
+        other : object
+            Statistics of a second set of rows.
+        """
+        return None
+
+    def _finish_fit(self, stats, dtype):
+        """
+        Sets the parameters of the preprocessor from the statistics of
+        the whole design matrix.
+
+        Parameters
+        ----------
+        stats : object
+            The merged statistics of all the rows.
+        dtype : str or dtype
+            The dtype of the design matrix.
+        """
+        pass
+
+    def _transform_chunk(self, X):
+        """
+        Returns the preprocessed version of a block of rows.
+
+        Parameters
+        ----------
+        X : ndarray
+            A block of rows of the design matrix.
+        """
+        raise NotImplementedError(str(type(self)) +
+                                  " does not implement _transform_chunk.")
+
+
+def _fit_chunk(preprocessor, X):
+    """
+    Calls `preprocessor._fit_chunk(X)`. Module-level function so that it
+    can be sent to worker processes.
+    """
+    return preprocessor._fit_chunk(X)
+
+
+def _transform_chunk(preprocessor, X):
+    """
+    Calls `preprocessor._transform_chunk(X)`. Module-level function so
+    that it can be sent to worker processes.
+    """
+    return preprocessor._transform_chunk(X)
+
+
+def _map_chunks(func, preprocessor, X, chunk_size, pool, max_pending):
+    """
+    Yields `(start, func(preprocessor, X[start:start + chunk_size]))` for
+    each block of rows of `X`, in order.
+
+    If `pool` is not None, the calls are made by the pool, with at most
+    `max_pending` blocks submitted but not yet yielded, so that only a
+    bounded number of blocks is held in memory.
+    """
+    pending = collections.deque()
+    for start in xrange(0, X.shape[0], chunk_size):
+        chunk = numpy.asarray(X[start:start + chunk_size])
+        if pool is None:
+            yield start, func(preprocessor, chunk)
+            continue
+        pending.append((start,
+                        pool.apply_async(func, (preprocessor, chunk))))
+        if len(pending) >= max_pending:
+            start, result = pending.popleft()
+            yield start, result.get()
+    while pending:
+        start, result = pending.popleft()
+        yield start, result.get()
+
+
+def _column_stats(X):
+    """
+    Returns the number of rows, the mean and the sum of squared
+    deviations from the mean of each column of `X`, in float64.
+    """
+    X = numpy.asarray(X, dtype='float64')
+    mean = X.mean(axis=0)
+    return X.shape[0], mean, ((X - mean) ** 2).sum(axis=0)
+
+
+def _merge_column_stats(stats, other):
+    """
+    Combines two results of `_column_stats`, using the pairwise update of
+    Chan et al. for numerical stability.
+    """
+    n_a, mean_a, m2_a = stats
+    n_b, mean_b, m2_b = other
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (float(n_b) / n)
+    m2 = m2_a + m2_b + delta ** 2 * (float(n_a) * n_b / n)
+    return n, mean, m2
+
 
 class BlockPreprocessor(ExamplewisePreprocessor):
 
@@ -174,10 +358,20 @@ class Pipeline(Preprocessor):
     Parameters
     ----------
     items : WRITEME
+    chunk_size : int, optional
+        If specified, the items that support it are applied with
+        `ExamplewisePreprocessor.apply_chunked`, on blocks of
+        `chunk_size` rows, so that the design matrix does not need to
+        fit in memory. The other items are applied normally.
+    num_workers : int, optional
+        Number of worker processes used by the items applied chunk by
+        chunk. See `ExamplewisePreprocessor.apply_chunked`.
     """
 
-    def __init__(self, items=None):
+    def __init__(self, items=None, chunk_size=None, num_workers=0):
         self.items = items if items is not None else []
+        self.chunk_size = chunk_size
+        self.num_workers = num_workers
 
     def apply(self, dataset, can_fit=False):
         """
@@ -185,8 +379,13 @@ class Pipeline(Preprocessor):
 
             WRITEME
         """
+        chunk_size = getattr(self, 'chunk_size', None)
         for item in self.items:
-            item.apply(dataset, can_fit)
+            if chunk_size is not None and getattr(item, 'chunkable', False):
+                item.apply_chunked(dataset, can_fit, chunk_size=chunk_size,
+                                   num_workers=self.num_workers)
+            else:
+                item.apply(dataset, can_fit)
 
 
 class ExtractGridPatches(Preprocessor):
@@ -652,8 +851,11 @@ class RemoveMean(ExamplewisePreprocessor):
     axis : int or None, optional
         Axis over which to take the mean, with the exact same
         semantics as the `axis` parameter of `numpy.mean`.
+        Only 0 and None are supported by `apply_chunked`.
     """
 
+    chunkable = True
+
     def __init__(self, axis=0):
         self._axis = axis
         self._mean = None
@@ -674,6 +876,29 @@ class RemoveMean(ExamplewisePreprocessor):
         X -= self._mean
         dataset.set_design_matrix(X)
 
+    def _fit_chunk(self, X):
+        if self._axis not in (0, None):
+            raise NotImplementedError("apply_chunked only supports axis=0 "
+                                      "or axis=None for RemoveMean")
+        return X.shape[0], numpy.asarray(X, dtype='float64').sum(axis=0)
+
+    def _merge_fit_stats(self, stats, other):
+        return stats[0] + other[0], stats[1] + other[1]
+
+    def _finish_fit(self, stats, dtype):
+        num_rows, total = stats
+        if self._axis is None:
+            mean = total.sum() / (num_rows * total.shape[0])
+        else:
+            mean = total / num_rows
+        self._mean = numpy.asarray(mean, dtype=dtype)
+
+    def _transform_chunk(self, X):
+        if self._mean is None:
+            raise ValueError("can_fit is False, but RemoveMean object "
+                             "has no stored mean or standard deviation")
+        return X - self._mean
+
     def as_block(self):
         """
         .. todo::
@@ -709,6 +934,8 @@ class Standardize(ExamplewisePreprocessor):
         Default is `1e-4`.
     """
 
+    chunkable = True
+
     def __init__(self, global_mean=False, global_std=False, std_eps=1e-4):
         self._global_mean = global_mean
         self._global_std = global_std
@@ -730,9 +957,36 @@ class Standardize(ExamplewisePreprocessor):
             if self._mean is None or self._std is None:
                 raise ValueError("can_fit is False, but Standardize object "
                                  "has no stored mean or standard deviation")
-        new = (X - self._mean) / (self._std_eps + self._std)
+        new = self._transform_chunk(X)
         dataset.set_design_matrix(new)
 
+    def _fit_chunk(self, X):
+        return _column_stats(X)
+
+    def _merge_fit_stats(self, stats, other):
+        return _merge_column_stats(stats, other)
+
+    def _finish_fit(self, stats, dtype):
+        num_rows, mean, m2 = stats
+        global_mean = mean.mean()
+        if self._global_mean:
+            self._mean = numpy.asarray(global_mean, dtype=dtype)
+        else:
+            self._mean = numpy.asarray(mean, dtype=dtype)
+        if self._global_std:
+            # Deviations are taken from the global mean, like X.std()
+            m2 = m2.sum() + num_rows * ((mean - global_mean) ** 2).sum()
+            std = numpy.sqrt(m2 / (num_rows * mean.shape[0]))
+        else:
+            std = numpy.sqrt(m2 / num_rows)
+        self._std = numpy.asarray(std, dtype=dtype)
+
+    def _transform_chunk(self, X):
+        if self._mean is None or self._std is None:
+            raise ValueError("can_fit is False, but Standardize object "
+                             "has no stored mean or standard deviation")
+        return (X - self._mean) / (self._std_eps + self._std)
+
     def as_block(self):
         """
         .. todo::
@@ -884,6 +1138,8 @@ class RemapInterval(ExamplewisePreprocessor):
     """
     # TODO: Implement as_block
 
+    chunkable = True
+
     def __init__(self, map_from, map_to):
         assert map_from[0] < map_from[1] and len(map_from) == 2
         assert map_to[0] < map_to[1] and len(map_to) == 2
@@ -896,11 +1152,13 @@ class RemapInterval(ExamplewisePreprocessor):
 
             WRITEME
         """
-        X = dataset.get_design_matrix()
-        X = (X - self.map_from[0]) / numpy.diff(self.map_from)
-        X = X * numpy.diff(self.map_to) + self.map_to[0]
+        X = self._transform_chunk(dataset.get_design_matrix())
         dataset.set_design_matrix(X)
 
+    def _transform_chunk(self, X):
+        X = (X - self.map_from[0]) / numpy.diff(self.map_from)
+        return X * numpy.diff(self.map_to) + self.map_to[0]
+
 
 class PCA_ViewConverter(object):
 
@@ -1101,7 +1359,7 @@ class Downsample(object):
         dataset.set_topological_view(X)
 
 
-class GlobalContrastNormalization(Preprocessor):
+class GlobalContrastNormalization(ExamplewisePreprocessor):
 
     """
     .. todo::
@@ -1122,6 +1380,8 @@ class GlobalContrastNormalization(Preprocessor):
         Defaults to False if nothing is specified
     """
 
+    chunkable = True
+
     def __init__(self, subtract_mean=True,
                  scale=1., sqrt_bias=0., use_std=False, min_divisor=1e-8,
                  batch_size=None):
@@ -1167,6 +1427,14 @@ class GlobalContrastNormalization(Preprocessor):
                     min_divisor=self._min_divisor)
                 dataset.set_design_matrix(X, start=i)
 
+    def _transform_chunk(self, X):
+        return global_contrast_normalize(X,
+                                         scale=self._scale,
+                                         subtract_mean=self._subtract_mean,
+                                         use_std=self._use_std,
+                                         sqrt_bias=self._sqrt_bias,
+                                         min_divisor=self._min_divisor)
+
 
 class ZCA(Preprocessor):
 
@@ -1195,10 +1463,29 @@ class ZCA(Preprocessor):
         When self.apply(dataset, can_fit=True) store not just the
         preprocessing matrix, but its inverse. This is necessary when
         using this preprocessor to instantiate a ZCA_Dataset.
+    chunk_size : int, optional
+        If specified, the mean and covariance are accumulated (in float64)
+        over blocks of `chunk_size` rows, and the whitening is applied in
+        place one block at a time, so that the design matrix never needs
+        to be copied or to fit in memory. This works with datasets stored
+        on disk, such as `DenseDesignMatrixPyTables`.
+    eigensolver : str, optional
+        'eigh' (default) computes all the eigenvalues of the covariance
+        matrix with `scipy.linalg.eigh`. 'randomized' only estimates the
+        `n_components` biggest ones with a randomized algorithm (Halko et
+        al., 2011), which is much faster when `n_components` is small
+        compared to the dimension.
+    n_power_iterations : int, optional
+        Number of power iterations of the randomized eigensolver. More
+        iterations give more accurate eigenvectors when the spectrum
+        decays slowly.
+    rng : numpy.random.RandomState object or seed, optional
+        Random number generator used by the randomized eigensolver.
     """
 
     def __init__(self, n_components=None, n_drop_components=None,
-                 filter_bias=0.1, store_inverse=True):
+                 filter_bias=0.1, store_inverse=True, chunk_size=None,
+                 eigensolver='eigh', n_power_iterations=4, rng=None):
         warnings.warn("This ZCA preprocessor class is known to yield very "
                       "different results on different platforms. If you plan "
                       "to conduct experiments with this preprocessing on "
@@ -1220,6 +1507,15 @@ class ZCA(Preprocessor):
         self.store_inverse = store_inverse
         self.P_ = None  # set by fit()
         self.inv_P_ = None  # set by fit(), if self.store_inverse is True
+        if eigensolver not in ('eigh', 'randomized'):
+            raise ValueError("eigensolver should be 'eigh' or 'randomized', "
+                             "got %s" % str(eigensolver))
+        if eigensolver == 'randomized' and not n_components:
+            raise ValueError("The randomized eigensolver needs n_components")
+        self.chunk_size = chunk_size
+        self.eigensolver = eigensolver
+        self.n_power_iterations = n_power_iterations
+        self.rng = make_np_rng(rng, which_method=['normal'])
 
         # Analogous to DenseDesignMatrix.design_loc. If not None, the
         # matrices P_ and inv_P_ will be saved together in <save_path>
@@ -1388,6 +1684,70 @@ class ZCA(Preprocessor):
         if not hasattr(self, "inv_P_"):
             self.inv_P_ = None
 
+    def _chunked_covariance(self, X):
+        """
+        Returns the mean and covariance of the rows of `X`, accumulated in
+        float64 over blocks of `self.chunk_size` rows.
+
+        The rows are shifted by the mean of the first block before being
+        accumulated, which avoids most of the cancellation error of the
+        E[xx^T] - E[x]E[x]^T formula when the data is not centered.
+
+        Parameters
+        ----------
+        X : ndarray or on-disk array
+            A matrix where each row is a datum.
+        """
+        n_samples, dim = X.shape
+        shift = None
+        total = numpy.zeros(dim, dtype='float64')
+        second_moment = numpy.zeros((dim, dim), dtype='float64')
+        for start in xrange(0, n_samples, self.chunk_size):
+            chunk = numpy.array(X[start:start + self.chunk_size],
+                                dtype='float64')
+            assert not contains_nan(chunk)
+            if shift is None:
+                shift = chunk.mean(axis=0)
+            chunk -= shift
+            total += chunk.sum(axis=0)
+            second_moment += numpy.dot(chunk.T, chunk)
+        shifted_mean = total / n_samples
+        covariance = (second_moment / n_samples -
+                      numpy.outer(shifted_mean, shifted_mean))
+        return shift + shifted_mean, covariance
+
+    def _randomized_eigh(self, covariance, n_components):
+        """
+        Estimates the `n_components` biggest eigenvalues and corresponding
+        eigenvectors of a symmetric positive semi-definite matrix, with a
+        randomized range finder followed by power iterations.
+
+        Parameters
+        ----------
+        covariance : ndarray
+            A symmetric positive semi-definite matrix.
+        n_components : int
+            The number of eigenpairs to estimate.
+
+        Returns
+        -------
+        eigs : ndarray
+            The eigenvalues, in ascending order like `linalg.eigh`.
+        eigv : ndarray
+            The corresponding eigenvectors, as columns.
+        """
+        dim = covariance.shape[0]
+        n_samples = min(dim, n_components + 10)
+        basis = self.rng.normal(size=(dim, n_samples))
+        basis = linalg.qr(numpy.dot(covariance, basis), mode='economic')[0]
+        for i in xrange(self.n_power_iterations):
+            basis = linalg.qr(numpy.dot(covariance, basis),
+                              mode='economic')[0]
+        projected = numpy.dot(basis.T, numpy.dot(covariance, basis))
+        eigs, small_eigv = linalg.eigh(projected)
+        eigv = numpy.dot(basis, small_eigv)
+        return eigs[-n_components:], eigv[:, -n_components:]
+
     def fit(self, X):
         """
         Fits this `ZCA` instance to a design matrix `X`.
@@ -1405,14 +1765,9 @@ class ZCA(Preprocessor):
         """
 
         assert X.dtype in ['float32', 'float64']
-        assert not contains_nan(X)
         assert len(X.shape) == 2
-        n_samples = X.shape[0]
-        if self.copy:
-            X = X.copy()
-        # Center data
-        self.mean_ = numpy.mean(X, axis=0)
-        X -= self.mean_
+        chunk_size = getattr(self, 'chunk_size', None)
+        eigensolver = getattr(self, 'eigensolver', 'eigh')
 
         log.info('computing zca of a {0} matrix'.format(X.shape))
         t1 = time.time()
@@ -1420,23 +1775,39 @@ class ZCA(Preprocessor):
         bias = self.filter_bias * scipy.sparse.identity(X.shape[1],
                                                         theano.config.floatX)
 
-        covariance = ZCA._gpu_matrix_dot(X.T, X) / X.shape[0] + bias
+        if chunk_size is not None:
+            self.mean_, covariance = self._chunked_covariance(X)
+            self.mean_ = self.mean_.astype(X.dtype)
+            covariance = covariance + bias
+        else:
+            assert not contains_nan(X)
+            if self.copy:
+                X = X.copy()
+            # Center data
+            self.mean_ = numpy.mean(X, axis=0)
+            X -= self.mean_
+            covariance = ZCA._gpu_matrix_dot(X.T, X) / X.shape[0] + bias
         t2 = time.time()
         log.info("cov estimate took {0} seconds".format(t2 - t1))
 
-        t1 = time.time()
-        eigs, eigv = linalg.eigh(covariance)
-        t2 = time.time()
+        if self.n_components and self.n_drop_components:
+            raise ValueError('Either n_components or n_drop_components'
+                             'should be specified')
 
-        log.info("eigh() took {0} seconds".format(t2 - t1))
+        t1 = time.time()
+        if eigensolver == 'randomized':
+            eigs, eigv = self._randomized_eigh(numpy.asarray(covariance),
+                                               self.n_components)
+            t2 = time.time()
+            log.info("randomized eigh() took {0} seconds".format(t2 - t1))
+        else:
+            eigs, eigv = linalg.eigh(covariance)
+            t2 = time.time()
+            log.info("eigh() took {0} seconds".format(t2 - t1))
         assert not contains_nan(eigs)
         assert not contains_nan(eigv)
         assert eigs.min() > 0
 
-        if self.n_components and self.n_drop_components:
-            raise ValueError('Either n_components or n_drop_components'
-                             'should be specified')
-
         if self.n_components:
             eigs = eigs[-self.n_components:]
             eigv = eigv[:, -self.n_components:]
@@ -1487,6 +1858,15 @@ class ZCA(Preprocessor):
             assert can_fit
             self.fit(X)
 
+        chunk_size = getattr(self, 'chunk_size', None)
+        if chunk_size is not None:
+            # Whiten in place, so that no copy of X is ever made
+            for start in xrange(0, X.shape[0], chunk_size):
+                chunk = numpy.asarray(X[start:start + chunk_size])
+                X[start:start + chunk.shape[0]] = ZCA._gpu_matrix_dot(
+                    chunk - self.mean_, self.P_)
+            return
+
         new_X = ZCA._gpu_matrix_dot(X - self.mean_, self.P_)
         dataset.set_design_matrix(new_X)
 
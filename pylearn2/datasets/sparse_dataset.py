@@ -105,7 +105,7 @@ class SparseDataset(Dataset):
     @wraps(Dataset.iterator)
     def iterator(self, mode=None, batch_size=None, num_batches=None,
                  rng=None, data_specs=None,
-                 return_tuple=False):
+                 return_tuple=False, prefetch=None):
 
         if data_specs is None:
             data_specs = self._iter_data_specs
@@ -156,7 +156,8 @@ class SparseDataset(Dataset):
                                           rng),
                                      data_specs=data_specs,
                                      return_tuple=return_tuple,
-                                     convert=convert)
+                                     convert=convert,
+                                     prefetch=prefetch)
 
     def __iter__(self):
         """
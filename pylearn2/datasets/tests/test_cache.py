@@ -0,0 +1,121 @@
+"""
+Unit tests for ../cache.py
+"""
+
+import os
+import shutil
+import tempfile
+
+from pylearn2.datasets.cache import LocalDatasetCache, parse_size
+
+
+def test_parse_size():
+    """
+    Tests the parsing of the quota.
+    """
+    assert parse_size(10) == 10
+    assert parse_size('10') == 10
+    assert parse_size('1.5K') == 1536
+    assert parse_size('20G') == 20 * 2 ** 30
+
+
+class TestLocalDatasetCache(object):
+    """
+    Tests the copies, resumes and evictions of the local cache.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.remote = os.path.join(self.tmpdir, 'remote')
+        self.local = os.path.join(self.tmpdir, 'local')
+        os.makedirs(os.path.join(self.remote, 'data'))
+        self.environ = dict((name, os.environ.get(name))
+                            for name in ('PYLEARN2_DATA_PATH',
+                                         'PYLEARN2_LOCAL_DATA_PATH',
+                                         'PYLEARN2_LOCAL_DATA_QUOTA'))
+        os.environ['PYLEARN2_DATA_PATH'] = self.remote
+        os.environ['PYLEARN2_LOCAL_DATA_PATH'] = self.local
+        self.files = []
+        for i in range(4):
+            path = os.path.join(self.remote, 'data', 'file%d' % i)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(1000 * (i + 1)))
+            self.files.append(path)
+
+    def tearDown(self):
+        for name, value in self.environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(self.tmpdir)
+
+    def assert_same(self, remote, local):
+        """
+        Checks that a file was cached locally with the same contents.
+        """
+        assert local.startswith(self.local)
+        with open(remote, 'rb') as f:
+            expected = f.read()
+        with open(local, 'rb') as f:
+            assert f.read() == expected
+
+    def test_resume(self):
+        """
+        Tests that an interrupted copy is resumed.
+        """
+        cache = LocalDatasetCache(copy_chunk_size=300)
+        local_folder = os.path.join(self.local, 'data')
+        os.makedirs(local_folder)
+        with open(self.files[1], 'rb') as f:
+            head = f.read(700)
+        with open(os.path.join(local_folder, 'file1.part'), 'wb') as f:
+            f.write(head)
+        local = cache.cache_file(self.files[1])
+        self.assert_same(self.files[1], local)
+        assert not os.path.exists(local + '.part')
+
+    def test_prefetch_yaml(self):
+        """
+        Tests the concurrent caching of the files of a YAML file.
+        """
+        yaml_path = os.path.join(self.tmpdir, 'train.yaml')
+        with open(yaml_path, 'w') as f:
+            f.write("a: '${PYLEARN2_DATA_PATH}/data/file0'\n"
+                    "b: [${PYLEARN2_DATA_PATH}/data/file2, "
+                    "${PYLEARN2_DATA_PATH}/data/missing]\n")
+        cache = LocalDatasetCache()
+        local = cache.prefetch_yaml(yaml_path)
+        assert len(local) == 2
+        self.assert_same(self.files[0], local[0])
+        self.assert_same(self.files[2], local[1])
+
+    def test_quota_environment(self):
+        """
+        Tests that the quota is read from the environment, and that a
+        malformed one is ignored.
+        """
+        os.environ['PYLEARN2_LOCAL_DATA_QUOTA'] = '7K'
+        assert LocalDatasetCache().quota == 7 * 2 ** 10
+        os.environ['PYLEARN2_LOCAL_DATA_QUOTA'] = 'lots'
+        assert LocalDatasetCache().quota is None
+
+    def test_quota(self):
+        """
+        Tests that the least recently used files that are not in use are
+        evicted to respect the quota.
+        """
+        cache = LocalDatasetCache(quota=7000)
+        local = cache.prefetch(self.files[:3], num_threads=1)
+        # Files locked by this process are in use and are not evicted
+        assert cache.cache_file(self.files[3]) == self.files[3]
+        for path in local:
+            for name in os.listdir(os.path.dirname(path)):
+                if '.readlock.' in name:
+                    cache.release_readlock(
+                        os.path.join(os.path.dirname(path), name))
+        for i, path in enumerate(local):
+            os.utime(path, (i, os.path.getmtime(path)))
+        self.assert_same(self.files[3], cache.cache_file(self.files[3]))
+        assert [os.path.exists(path) for path in local] == \
+            [False, False, True]
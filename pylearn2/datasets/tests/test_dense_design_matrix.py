@@ -1,3 +1,7 @@
+import os
+import shutil
+import tempfile
+
 import numpy as np
 
 from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
@@ -63,6 +67,55 @@ def test_split_nfold_datasets():
     assert folds[0].shape[0] == np.ceil(ddm.get_num_examples() / 10)
 
 
+def test_sources_loc():
+    # Tests that the sources are saved as .npy files and memory-mapped back
+    rng = np.random.RandomState([1, 2, 3])
+    ddm = DenseDesignMatrix(X=rng.randn(10, 4), y=rng.randn(10, 2))
+    path = tempfile.mkdtemp()
+    try:
+        ddm.use_sources_loc(path)
+        pkl_path = os.path.join(path, 'dataset.pkl')
+        serial.save(pkl_path, ddm)
+        assert os.path.exists(os.path.join(path, 'X.npy'))
+        assert os.path.exists(os.path.join(path, 'y.npy'))
+        loaded = serial.load(pkl_path)
+        assert isinstance(loaded.X, np.memmap)
+        assert not loaded.X.flags.writeable
+        np.testing.assert_equal(loaded.X, ddm.X)
+        np.testing.assert_equal(loaded.y, ddm.y)
+        # Saving again does not rewrite the mapped files
+        mtime = os.path.getmtime(os.path.join(path, 'X.npy'))
+        serial.save(pkl_path, loaded)
+        assert os.path.getmtime(os.path.join(path, 'X.npy')) == mtime
+        np.testing.assert_equal(serial.load(pkl_path).X, ddm.X)
+        # But it saves a subset of them
+        loaded.X = loaded.X[:3]
+        loaded.y = loaded.y[:3]
+        serial.save(pkl_path, loaded)
+        subset = serial.load(pkl_path)
+        np.testing.assert_equal(subset.X, ddm.X[:3])
+        np.testing.assert_equal(subset.y, ddm.y[:3])
+    finally:
+        shutil.rmtree(path)
+
+
+def test_sources_loc_copy_on_write():
+    # Tests that modifications of data mapped in mode 'c' are saved
+    rng = np.random.RandomState([1, 2, 3])
+    ddm = DenseDesignMatrix(X=rng.randn(10, 4), y=rng.randn(10, 2))
+    path = tempfile.mkdtemp()
+    try:
+        ddm.use_sources_loc(path, mmap_mode='c')
+        pkl_path = os.path.join(path, 'dataset.pkl')
+        serial.save(pkl_path, ddm)
+        loaded = serial.load(pkl_path)
+        loaded.X *= 2.
+        serial.save(pkl_path, loaded)
+        np.testing.assert_equal(serial.load(pkl_path).X, 2. * ddm.X)
+    finally:
+        shutil.rmtree(path)
+
+
 def test_pytables():
     """
     tests wether DenseDesignMatrixPyTables can be loaded and
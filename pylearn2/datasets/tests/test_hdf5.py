@@ -6,6 +6,8 @@ import os
 import tempfile
 
 from pylearn2.config import yaml_parse
+from pylearn2.datasets.hdf5 import HDF5Dataset
+from pylearn2.space import IndexSpace, VectorSpace
 from pylearn2.testing.datasets import (
     random_dense_design_matrix,
     random_one_hot_dense_design_matrix,
@@ -99,6 +101,33 @@ def test_hdf5_load_all():
     # cleanup
     os.remove(filename)
 
+
+def test_hdf5_get_indexes():
+    """Check that reading a list of indexes returns the requested rows."""
+    skip_if_no_h5py()
+    import h5py
+
+    handle, filename = tempfile.mkstemp()
+    rng = np.random.RandomState(1)
+    X = rng.uniform(size=(20, 5)).astype('float32')
+    y = rng.randint(3, size=(20, 1))
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('X', data=X)
+        f.create_dataset('y', data=y)
+
+    dataset = HDF5Dataset(filename, sources=['X', 'y'],
+                          spaces=[VectorSpace(5), IndexSpace(3, 1)],
+                          use_h5py=True)
+    for indexes in ([3, 1, 2, 15, 16, 3], list(range(4, 9)),
+                    rng.permutation(20)[:7]):
+        batch_X, batch_y = dataset.get(('X', 'y'), indexes)
+        assert isinstance(batch_X, np.ndarray)
+        assert np.all(batch_X == X[indexes])
+        assert np.all(batch_y == y[indexes])
+
+    # cleanup
+    os.remove(filename)
+
 design_matrix_yaml = """
 !obj:pylearn2.train.Train {
     dataset: &train !obj:pylearn2.datasets.hdf5.HDF5Dataset {
@@ -0,0 +1,103 @@
+"""
+Unit tests for ../preprocessed_cache.py
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
+from pylearn2.datasets.preprocessed_cache import (CachedPreprocessor,
+                                                  PreprocessedCache)
+from pylearn2.datasets.preprocessing import Standardize
+
+
+class CountingStandardize(Standardize):
+    """
+    A Standardize preprocessor that counts how many times it was applied.
+    """
+    applied = 0
+
+    def apply(self, dataset, can_fit=False):
+        CountingStandardize.applied += 1
+        super(CountingStandardize, self).apply(dataset, can_fit)
+
+
+def make_dataset(seed=0):
+    """
+    Makes a small random dataset.
+
+    Parameters
+    ----------
+    seed : int, optional
+        Seed of the random data.
+
+    Returns
+    -------
+    dataset : DenseDesignMatrix
+        50 examples with 7 features and a binary label.
+    """
+    rng = np.random.RandomState(seed)
+    return DenseDesignMatrix(X=rng.normal(3., 2., size=(50, 7)),
+                             y=rng.randint(2, size=(50, 1)))
+
+
+def test_cached_preprocessor():
+    """
+    Tests that a second application of the same preprocessor to the same
+    data is loaded from the cache, fitted preprocessor included.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        CountingStandardize.applied = 0
+        expected = make_dataset()
+        CountingStandardize().apply(expected, can_fit=True)
+
+        first = make_dataset()
+        cached = CachedPreprocessor(CountingStandardize(), path=path)
+        cached.apply(first, can_fit=True)
+        assert CountingStandardize.applied == 2
+        assert len(PreprocessedCache(path).entries()) == 1
+
+        second = make_dataset()
+        cached = CachedPreprocessor(CountingStandardize(), path=path)
+        cached.apply(second, can_fit=True)
+        assert CountingStandardize.applied == 2
+        np.testing.assert_allclose(second.X, expected.X)
+        np.testing.assert_allclose(cached.preprocessor._mean,
+                                   make_dataset().X.mean(axis=0))
+
+        # Different data is a different entry
+        third = make_dataset(seed=1)
+        cached.apply(third, can_fit=False)
+        assert CountingStandardize.applied == 3
+        assert len(PreprocessedCache(path).entries()) == 2
+    finally:
+        shutil.rmtree(path)
+
+
+def test_trim_and_clear():
+    """
+    Tests the LRU eviction and the invalidation of the cache.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        cache = PreprocessedCache(path)
+        for seed in range(3):
+            CachedPreprocessor(Standardize(), path=path).apply(
+                make_dataset(seed), can_fit=True)
+        # Make the order of last use unambiguous
+        for i, (_, _, key) in enumerate(cache.entries()):
+            os.utime(os.path.join(path, key + '.npy'), (i, i))
+        entries = cache.entries()
+        assert len(entries) == 3
+        sizes = [size for _, size, _ in entries]
+        cache.trim(sum(sizes) - 1)
+        assert [key for _, _, key in cache.entries()] == \
+            [key for _, _, key in entries[1:]]
+        cache.clear()
+        assert cache.entries() == []
+    finally:
+        shutil.rmtree(path)
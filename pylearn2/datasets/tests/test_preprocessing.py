@@ -19,7 +19,11 @@ from pylearn2.datasets.preprocessing import (GlobalContrastNormalization,
                                              LeCunLCN,
                                              RGB_YUV,
                                              ZCA,
-                                             PCA)
+                                             PCA,
+                                             Pipeline,
+                                             RemapInterval,
+                                             RemoveMean,
+                                             Standardize)
 
 
 class testGlobalContrastNormalization:
@@ -254,6 +258,29 @@ class testZCA:
         )
         assert_allclose(preprocessed_X, zca_transformed_X, rtol=1e-3)
 
+    def test_chunked(self):
+        """
+        Confirm that the chunked ZCA gives the same result as the regular
+        one, without copying the design matrix.
+        """
+        expected = self.get_preprocessed_data(ZCA(filter_bias=0.0))
+
+        X = as_floatX(self.X)
+        dataset = DenseDesignMatrix(X=X)
+        ZCA(filter_bias=0.0, chunk_size=3).apply(dataset, can_fit=True)
+        assert dataset.get_design_matrix() is X
+        assert_allclose(X, expected, rtol=1e-3, atol=1e-4)
+
+    def test_randomized_eigensolver(self):
+        """
+        Confirm that the randomized eigensolver gives the same result as
+        the exact one when keeping a few components.
+        """
+        expected = self.get_preprocessed_data(ZCA(n_components=2))
+        actual = self.get_preprocessed_data(
+            ZCA(n_components=2, eigensolver='randomized'))
+        assert_allclose(actual, expected, rtol=1e-3, atol=1e-4)
+
     def test_num_components(self):
         # Keep 3 components
         preprocessor = ZCA(filter_bias=0.0, n_components=3)
@@ -367,3 +394,48 @@ class testPCA:
 
         assert self.dataset.get_design_matrix().shape[1] ==\
             self.num_components - 1
+
+
+def test_apply_chunked():
+    """
+    Checks that applying the chunkable preprocessors chunk by chunk gives
+    the same result as applying them to the whole design matrix.
+    """
+    rng = np.random.RandomState([2015, 3, 4])
+    X = as_floatX(rng.randn(30, 6) * 3. + 2.)
+
+    def make_preprocessors():
+        return [Standardize(),
+                Standardize(global_mean=True, global_std=True),
+                Standardize(global_mean=True),
+                RemoveMean(),
+                RemoveMean(axis=None),
+                RemapInterval([-10., 10.], [0., 1.]),
+                GlobalContrastNormalization(use_std=True, sqrt_bias=1.)]
+
+    for num_workers in [0, 2]:
+        for whole, chunked in zip(make_preprocessors(), make_preprocessors()):
+            expected = DenseDesignMatrix(X=X.copy())
+            whole.apply(expected, can_fit=True)
+            actual = DenseDesignMatrix(X=X.copy())
+            chunked.apply_chunked(actual, can_fit=True, chunk_size=7,
+                                  num_workers=num_workers)
+            assert_allclose(expected.get_design_matrix(),
+                            actual.get_design_matrix(), rtol=1e-4, atol=1e-5)
+
+
+def test_pipeline_chunk_size():
+    """
+    Checks that a Pipeline with a chunk_size gives the same result as
+    a regular one.
+    """
+    rng = np.random.RandomState([2015, 3, 5])
+    X = as_floatX(rng.randn(20, 4))
+
+    expected = DenseDesignMatrix(X=X.copy())
+    Pipeline([RemoveMean(), Standardize()]).apply(expected, can_fit=True)
+    actual = DenseDesignMatrix(X=X.copy())
+    Pipeline([RemoveMean(), Standardize()], chunk_size=6).apply(actual,
+                                                                can_fit=True)
+    assert_allclose(expected.get_design_matrix(),
+                    actual.get_design_matrix(), rtol=1e-4, atol=1e-5)
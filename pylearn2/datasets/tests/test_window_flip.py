@@ -0,0 +1,88 @@
+"""
+Tests for pylearn2.datasets.window_flip
+"""
+import numpy
+
+from pylearn2.datasets.dense_design_matrix import (
+    DenseDesignMatrix,
+    DefaultViewConverter
+)
+from pylearn2.datasets.window_flip import WindowAndFlipDataset
+from pylearn2.space import Conv2DSpace
+from pylearn2.utils.testing import assert_equal
+
+
+def _dummy_dataset(axes):
+    vc = DefaultViewConverter((5, 5, 2), axes=axes)
+    rng = numpy.random.RandomState([2013, 3, 12])
+    X = rng.normal(size=(6, 50)).astype('float32')
+    return DenseDesignMatrix(X=X, view_converter=vc, axes=axes)
+
+
+def _all_windows(image, flip):
+    """All 3x3 windows of a (5, 5, channels) image."""
+    windows = []
+    for i in range(3):
+        for j in range(3):
+            window = image[i:i + 3, j:j + 3, :]
+            windows.append(window)
+            if flip:
+                windows.append(window[:, ::-1, :])
+    return windows
+
+
+def _batches(dataset, space):
+    return list(dataset.iterator(mode='sequential', batch_size=4,
+                                 data_specs=(space, 'features')))
+
+
+def test_window_flip_dataset():
+    """
+    Tests that each example is a window, possibly flipped, of the
+    corresponding raw image, for both axes orders.
+    """
+    for axes in [('c', 0, 1, 'b'), ('b', 0, 1, 'c')]:
+        raw = _dummy_dataset(axes)
+        topo = raw.get_topological_view()
+        if axes[0] == 'c':
+            topo = topo.transpose(3, 1, 2, 0)
+        dataset = WindowAndFlipDataset(raw, window_shape=(3, 3))
+        space = Conv2DSpace((3, 3), num_channels=2, axes=('b', 0, 1, 'c'))
+        batches = _batches(dataset, space)
+        assert_equal([4, 2], [b.shape[0] for b in batches])
+        windows = numpy.concatenate(batches)
+        for image, window in zip(topo, windows):
+            assert any(numpy.all(window == w)
+                       for w in _all_windows(image, flip=True))
+
+
+def test_window_flip_dataset_center():
+    """
+    Tests that `center` takes the central window of each image.
+    """
+    raw = _dummy_dataset(('b', 0, 1, 'c'))
+    topo = raw.get_topological_view()
+    dataset = WindowAndFlipDataset(raw, window_shape=(3, 3), center=True)
+    windows = numpy.concatenate(_batches(dataset, dataset.X_space))
+    assert numpy.all(windows == topo[:, 1:4, 1:4, :])
+
+
+def test_window_flip_dataset_workers():
+    """
+    Tests that the worker processes give the same batches as the main
+    process, and are stopped at the end of the epoch.
+    """
+    raw = _dummy_dataset(('b', 0, 1, 'c'))
+    space = Conv2DSpace((5, 5), num_channels=2, axes=('b', 0, 1, 'c'))
+    serial = WindowAndFlipDataset(raw, window_shape=(5, 5), pad=1, rng=1)
+    parallel = WindowAndFlipDataset(raw, window_shape=(5, 5), pad=1, rng=1,
+                                    num_workers=2)
+    for a, b in zip(_batches(serial, space), _batches(parallel, space)):
+        assert numpy.all(a == b)
+    iterator = parallel.iterator(mode='sequential', batch_size=4,
+                                 data_specs=(space, 'features'))
+    pool = iterator._pool
+    for batch in iterator:
+        pass
+    assert iterator._pool is None
+    assert all(not process.is_alive() for process in pool._pool)
@@ -0,0 +1,323 @@
+"""
+A dataset that takes random windows of the images of another dataset, and
+randomly flips them, on the fly as minibatches are requested.
+
+This is an alternative to the
+:py:class:`pylearn2.train_extensions.window_flip.WindowAndFlip` extension
+that does not need a padded copy of the whole dataset and spreads the cost
+of the augmentation over the epoch instead of paying it all at once after
+each epoch.
+"""
+__copyright__ = "Copyright 2010-2015, Universite de Montreal"
+__license__ = "3-clause BSD"
+__maintainer__ = "LISA Lab"
+__email__ = "pylearn-dev@googlegroups"
+
+import collections
+import multiprocessing
+
+import numpy
+from theano.compat.six import Iterator
+
+from pylearn2.datasets.dataset import Dataset
+from pylearn2.space import CompositeSpace, Conv2DSpace
+from pylearn2.train_extensions.window_flip import (
+    _zero_pad,
+    random_window_and_flip_b01c,
+    random_window_and_flip_c01b
+)
+from pylearn2.utils import py_integer_types, wraps
+from pylearn2.utils.data_specs import is_flat_specs
+from pylearn2.utils.rng import make_np_rng
+
+
+def _window_and_flip(batch, window_shape, axes, pad, flip, seed):
+    """
+    Takes a random window of each image of a batch and flips it with
+    probability 0.5, or takes the central window if `seed` is None.
+
+    This is a module-level function so that it can be sent to the
+    worker processes.
+
+    Parameters
+    ----------
+    batch : ndarray
+        A batch of images with axes ('c', 0, 1, 'b') or ('b', 0, 1, 'c').
+    window_shape : tuple
+        The (rows, cols) shape of the windows.
+    axes : tuple
+        The axes of `batch`.
+    pad : int
+        Amount of zero-padding to add to each side of the images before
+        taking the windows.
+    flip : bool
+        Whether to randomly flip the windows horizontally.
+    seed : int or None
+        Seed of the random windows and flips.
+
+    Returns
+    -------
+    rval : ndarray, dtype float32
+        The windows, with the same axes as `batch`.
+    """
+    batch = _zero_pad(numpy.asarray(batch, dtype='float32'), pad)
+    if seed is None:
+        row = (batch.shape[1] - window_shape[0]) // 2
+        col = (batch.shape[2] - window_shape[1]) // 2
+        return numpy.array(batch[:, row:row + window_shape[0],
+                                 col:col + window_shape[1], :])
+    if axes == ('c', 0, 1, 'b'):
+        wf_func = random_window_and_flip_c01b
+    else:
+        wf_func = random_window_and_flip_b01c
+    return wf_func(numpy.ascontiguousarray(batch), window_shape,
+                   rng=seed, flip=flip)
+
+
+class WindowAndFlipDataset(Dataset):
+    """
+    A dataset that takes random windows of the images of another dataset,
+    and randomly flips them horizontally, as minibatches are requested.
+
+    Parameters
+    ----------
+    raw : DenseDesignMatrix
+        The dataset providing the images, through its 'features' source.
+        It must have a `view_converter` describing the shape of the images.
+    window_shape : tuple
+        The (rows, cols) shape of the windows.
+    pad : int, optional
+        Amount of zero-padding to add to each side of the images before
+        taking the windows. Useful to take windows of the actual size of
+        the images. Default is 0.
+    flip : bool, optional
+        Reflect the windows on the horizontal axis with probability 0.5.
+        `True` by default.
+    center : bool, optional
+        If `True`, always take the central window and never flip it.
+        Useful for validation and test sets. Default is `False`.
+    num_workers : int, optional
+        If positive, the windows are computed by this many worker
+        processes, which work on the next batches while the current one
+        is being used. Each iterator starts its own processes, and stops
+        them when it is exhausted. Default is 0, i.e. compute the windows
+        in the iterating process.
+    rng : numpy.random.RandomState object or seed, optional
+        A random number generator or seed used to create one, used to draw
+        the seed of the windows and flips of each batch. Seeded
+        deterministically by default.
+    """
+
+    def __init__(self, raw, window_shape, pad=0, flip=True, center=False,
+                 num_workers=0, rng=(2013, 2, 20)):
+        self.raw = raw
+        self.window_shape = tuple(window_shape)
+        self.pad = pad
+        self.flip = flip
+        self.center = center
+        self.num_workers = num_workers
+        self.rng = make_np_rng(rng, which_method="randint")
+
+        assert isinstance(self.pad, py_integer_types), (
+            "The 'pad' parameter of WindowAndFlipDataset should be an int")
+        if getattr(raw, 'view_converter', None) is None:
+            raise ValueError("%s needs a dataset with a view_converter, so "
+                             "that it knows the shape of the images." %
+                             self.__class__.__name__)
+
+        rows, cols, channels = raw.view_converter.shape
+        self.image_shape = (rows, cols)
+        if (self.window_shape[0] > rows + 2 * pad or
+                self.window_shape[1] > cols + 2 * pad):
+            raise ValueError("window_shape %s greater than the padded "
+                             "image shape %s" % (str(self.window_shape),
+                                                 str((rows + 2 * pad,
+                                                      cols + 2 * pad))))
+        self.num_channels = channels
+        axes = tuple(raw.view_converter.axes)
+        if axes not in (('c', 0, 1, 'b'), ('b', 0, 1, 'c')):
+            axes = ('b', 0, 1, 'c')
+        self.axes = axes
+        self.X_space = Conv2DSpace(shape=self.window_shape,
+                                   num_channels=channels,
+                                   axes=axes,
+                                   dtype='float32')
+
+    def get_data_specs(self):
+        """
+        Returns the data_specs of the raw dataset, in which the space of
+        the 'features' source is replaced by the space of the windows.
+        """
+        space, source = self.raw.get_data_specs()
+        if not isinstance(source, tuple):
+            return (self.X_space, source)
+        spaces = tuple(self.X_space if src == 'features' else sp
+                       for sp, src in zip(space.components, source))
+        return (CompositeSpace(spaces), source)
+
+    @wraps(Dataset.iterator)
+    def iterator(self, mode=None, batch_size=None, num_batches=None,
+                 rng=None, data_specs=None, return_tuple=False, **kwargs):
+        if data_specs is None:
+            data_specs = self.get_data_specs()
+        assert is_flat_specs(data_specs)
+        space, source = data_specs
+        if not isinstance(source, tuple):
+            source = (source,)
+            space = (space,)
+        elif isinstance(space, CompositeSpace):
+            space = tuple(space.components)
+
+        # Ask the raw dataset for full images in the layout expected by the
+        # windowing kernels. The other sources are passed through.
+        raw_image_space = Conv2DSpace(
+            shape=self.image_shape,
+            num_channels=self.num_channels,
+            axes=self.axes,
+            dtype='float32')
+        raw_space = tuple(raw_image_space if src == 'features' else sp
+                          for sp, src in zip(space, source))
+        raw_data_specs = (CompositeSpace(raw_space), source)
+
+        raw_iterator = self.raw.iterator(
+            mode=mode, batch_size=batch_size,
+            num_batches=num_batches, rng=rng,
+            data_specs=raw_data_specs, return_tuple=True, **kwargs)
+        return WindowAndFlipIterator(raw_iterator, self, space, source,
+                                     return_tuple)
+
+    @wraps(Dataset.get_num_examples)
+    def get_num_examples(self):
+        return self.raw.get_num_examples()
+
+    @wraps(Dataset.has_targets)
+    def has_targets(self):
+        return self.raw.has_targets()
+
+    @wraps(Dataset.adjust_for_viewer)
+    def adjust_for_viewer(self, X):
+        return self.raw.adjust_for_viewer(X)
+
+
+class WindowAndFlipIterator(Iterator):
+    """
+    Iterator returned by :py:meth:`WindowAndFlipDataset.iterator`.
+
+    Parameters
+    ----------
+    raw_iterator : iterator
+        An iterator over the raw dataset, returning tuples of batches in
+        which the 'features' are full images.
+    dataset : WindowAndFlipDataset
+        The dataset being iterated over.
+    spaces : tuple
+        The requested space of each source.
+    sources : tuple
+        The requested sources.
+    return_tuple : bool
+        Always return a tuple, even if there is only one source.
+    """
+
+    def __init__(self, raw_iterator, dataset, spaces, sources, return_tuple):
+        self.raw_iterator = raw_iterator
+        self.dataset = dataset
+        self.spaces = spaces
+        self.sources = sources
+        self.return_tuple = return_tuple
+        self.stochastic = raw_iterator.stochastic or not dataset.center
+        self.uneven = raw_iterator.uneven
+        if dataset.num_workers > 0:
+            self._pool = multiprocessing.Pool(dataset.num_workers)
+        else:
+            self._pool = None
+        # Raw batches, with the pending result of their windowing
+        self._pending = collections.deque()
+        self._exhausted = False
+
+    def __iter__(self):
+        return self
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Stops the worker processes, if any. Called when the iterator is
+        exhausted or garbage-collected.
+        """
+        pool = getattr(self, '_pool', None)
+        if pool is not None:
+            self._pool = None
+            self._pending.clear()
+            pool.terminate()
+            pool.join()
+
+    def _submit(self):
+        """
+        Fetches the next raw batch, if any, and starts windowing it.
+        """
+        try:
+            raw_batch = self.raw_iterator.next()
+        except StopIteration:
+            self._exhausted = True
+            return
+        dataset = self.dataset
+        if dataset.center:
+            seed = None
+        else:
+            seed = dataset.rng.randint(2 ** 30)
+        windows = []
+        for batch, src in zip(raw_batch, self.sources):
+            if src != 'features':
+                windows.append(None)
+                continue
+            args = (batch, dataset.window_shape, dataset.axes, dataset.pad,
+                    dataset.flip, seed)
+            if self._pool is None:
+                windows.append(_window_and_flip(*args))
+            else:
+                windows.append(self._pool.apply_async(_window_and_flip, args))
+        self._pending.append((raw_batch, windows))
+
+    def __next__(self):
+        depth = max(self.dataset.num_workers, 1)
+        while len(self._pending) < depth and not self._exhausted:
+            self._submit()
+        if len(self._pending) == 0:
+            self.close()
+            raise StopIteration()
+
+        raw_batch, windows = self._pending.popleft()
+        rval = []
+        for batch, window, space in zip(raw_batch, windows, self.spaces):
+            if window is None:
+                rval.append(batch)
+                continue
+            if self._pool is not None:
+                window = window.get()
+            rval.append(self.dataset.X_space.np_format_as(window, space))
+
+        if not self.return_tuple and len(rval) == 1:
+            return rval[0]
+        return tuple(rval)
+
+    @property
+    def num_examples(self):
+        """
+        The number of examples the iterator will visit.
+        """
+        return self.raw_iterator.num_examples
+
+    @property
+    def batch_size(self):
+        """
+        The (maximum) number of examples per batch.
+        """
+        return self.raw_iterator.batch_size
+
+    @property
+    def num_batches(self):
+        """
+        The total number of batches the iterator will return.
+        """
+        return self.raw_iterator.num_batches
@@ -9,8 +9,10 @@ __license__ = "3-clause BSD"
 __maintainer__ = "LISA Lab"
 __email__ = "pylearn-dev@googlegroups"
 
+import collections
 import copy
 import time
+import traceback
 import warnings
 import logging
 import numpy as np
@@ -25,15 +27,22 @@ from theano.printing import var_descriptor
 from pylearn2.config import yaml_parse
 from pylearn2.datasets.dataset import Dataset
 from pylearn2.space import Space, CompositeSpace, NullSpace
-from pylearn2.utils import function, sharedX, safe_zip, safe_izip
+from pylearn2.utils import sharedX, safe_zip, safe_izip
+from pylearn2.utils import channel_history
+from pylearn2.utils.channel_history import ChannelRecord, as_record
+from pylearn2.utils.compile import cached_function
 from pylearn2.utils.exc import reraise_as
+from pylearn2.utils.general import fork_context
 from pylearn2.utils.iteration import is_stochastic
 from pylearn2.utils.data_specs import DataSpecsMapping
 from pylearn2.utils.string_utils import number_aware_alphabetical_key
-from pylearn2.utils.timing import log_timing
+from pylearn2.utils.timing import log_timing, NullPhaseTimer
 
 log = logging.getLogger(__name__)
 
+# Seed of the random subsets of the datasets monitored with subsampling
+_subsample_seed = [2015, 4, 13]
+
 
 class Monitor(object):
     """
@@ -74,6 +83,9 @@ class Monitor(object):
         self._num_batches = []
         self._dirty = True
         self._rng_seed = []
+        self._subsample = []
+        self._rotate_subsample = []
+        self._dataset_names = {}
         self.names_to_del = ['theano_function_mode']
         self.t0 = time.time()
         self.theano_function_mode = None
@@ -129,7 +141,8 @@ class Monitor(object):
             self.theano_function_mode = mode
 
     def add_dataset(self, dataset, mode='sequential', batch_size=None,
-                    num_batches=None, seed=None):
+                    num_batches=None, seed=None, subsample=None,
+                    rotate_subsample=False):
         """
         Determines the data used to calculate the values of each channel.
 
@@ -150,6 +163,15 @@ class Monitor(object):
             batches will be calculated based on full dataset size).
         seed : int, optional
             Optional. The seed to be used for random iteration modes.
+        subsample : int, optional
+            If specified, the channels are evaluated on a random subset of
+            (about) this many examples of the dataset instead of on the
+            whole dataset, and a standard error of each channel value is
+            recorded in its `std_err_record`. A full evaluation can still
+            be requested with `evaluate_full`.
+        rotate_subsample : bool, optional
+            If True, a different random subset is drawn at each epoch.
+            Otherwise, the same subset is used every time.
         """
         # The user can ommit using lists if only one dataset is set
         if not isinstance(dataset, list):
@@ -164,14 +186,23 @@ class Monitor(object):
             seed = [None] * len(dataset)
         if not isinstance(seed, list):
             seed = [seed]
+        if not isinstance(subsample, list):
+            subsample = [subsample] * len(dataset)
+        if not isinstance(rotate_subsample, list):
+            rotate_subsample = [rotate_subsample] * len(dataset)
+        if any(ss is not None and ss <= 0 for ss in subsample):
+            raise ValueError("subsample should be a positive number of "
+                             "examples, got " + str(subsample))
         if len(mode) != len(dataset):
             raise ValueError("Received " + str(len(dataset)) +
                              " dataset but " + str(len(mode)) + " modes.")
         if any([len(l) != len(dataset) for l in [batch_size, seed]]):
             raise ValueError("make sure each dataset has its iteration " +
                              "batch size and number of batches.")
-        for (d, m, b, n, sd) in safe_izip(dataset, mode, batch_size,
-                                          num_batches, seed):
+        for (d, m, b, n, sd, ss, rs) in safe_izip(dataset, mode, batch_size,
+                                                  num_batches, seed,
+                                                  subsample,
+                                                  rotate_subsample):
             try:
                 it = d.iterator(mode=m,
                                 batch_size=b,
@@ -205,6 +236,184 @@ class Monitor(object):
                 self._batch_size.append(b)
                 self._num_batches.append(n)
                 self._rng_seed.append(sd)
+                self._subsample.append(ss)
+                self._rotate_subsample.append(rs)
+
+    def is_subsampled(self, dataset):
+        """
+        Returns whether a monitoring dataset is evaluated on a subset of
+        its examples.
+
+        Parameters
+        ----------
+        dataset : Dataset
+            One of the monitoring datasets.
+        """
+        return self._subsample[self._datasets.index(dataset)] is not None
+
+    def _iterator(self, index, full=False):
+        """
+        Returns an iterator over the data used to compute the channels of
+        a monitoring dataset.
+
+        Parameters
+        ----------
+        index : int
+            The index of the dataset in `self._datasets`.
+        full : bool, optional
+            If True, iterate over the whole dataset even if it is
+            subsampled.
+        """
+        d = self._datasets[index]
+        subsample = self._subsample[index]
+        if subsample is None or full:
+            return d.iterator(mode=self._iteration_mode[index],
+                              batch_size=self._batch_size[index],
+                              num_batches=self._num_batches[index],
+                              data_specs=self._flat_data_specs,
+                              return_tuple=True,
+                              rng=self._rng_seed[index])
+
+        batch_size = self._batch_size[index]
+        if batch_size is None:
+            batch_size = self._iterator(index, full=True).batch_size
+        num_examples = d.get_num_examples()
+        num_batches = int(np.ceil(min(subsample, num_examples) /
+                                  float(batch_size)))
+        seed = list(_subsample_seed)
+        if self._rotate_subsample[index]:
+            seed.append(self._epochs_seen)
+        return d.iterator(mode='shuffled_sequential',
+                          batch_size=batch_size,
+                          num_batches=num_batches,
+                          data_specs=self._flat_data_specs,
+                          return_tuple=True,
+                          rng=seed)
+
+    def _accumulate(self, index, full=False):
+        """
+        Runs the accum function of a monitoring dataset over its data.
+
+        Parameters
+        ----------
+        index : int
+            The index of the dataset in `self._datasets`.
+        full : bool, optional
+            If True, iterate over the whole dataset even if it is
+            subsampled.
+        """
+        d = self._datasets[index]
+        a = self.accum[index]
+        if isinstance(d, six.string_types):
+            d = yaml_parse.load(d)
+            raise NotImplementedError()
+
+        # need to put d back into self._datasets
+        myiterator = self._iterator(index, full)
+        ne = myiterator.num_examples
+        self._num_examples_shared[index].set_value(np.cast['float64'](ne))
+        num_batches = 0
+
+        # If self._flat_data_specs is empty, no channel needs data,
+        # so we do not need to call the iterator in order to average
+        # the monitored values across different batches, we only
+        # have to call them once.
+        if len(self._flat_data_specs[1]) == 0:
+            X = ()
+            self.run_prereqs(X, d)
+            a(*X)
+
+        else:
+            actual_ne = 0
+            for X in myiterator:
+                # X is a flat (not nested) tuple
+                self.run_prereqs(X, d)
+                a(*X)
+                actual_ne += self._flat_data_specs[0].np_batch_size(X)
+                num_batches += 1
+            # end for X
+            if actual_ne != ne:
+                raise RuntimeError("At compile time, your iterator said "
+                                   "it had %d examples total, but at "
+                                   "runtime it gave us %d." %
+                                   (ne, actual_ne))
+
+        if (full or self._subsample[index] is None or
+                len(self._flat_data_specs[1]) == 0):
+            self._last_pass[index] = None
+        else:
+            self._last_pass[index] = (num_batches,
+                                      ne / float(d.get_num_examples()))
+
+    def _std_err(self, channel):
+        """
+        Returns the standard error of the current value of a channel.
+
+        It is estimated from the spread of the values of the channel on
+        the batches of the last evaluation, and is 0 if the last
+        evaluation used the whole dataset.
+
+        Parameters
+        ----------
+        channel : MonitorChannel
+            A channel of this monitor.
+        """
+        last_pass = self._last_pass[self._datasets.index(channel.dataset)]
+        if last_pass is None:
+            return 0.
+        num_batches, fraction = last_pass
+        if num_batches < 2:
+            return np.nan
+        mean = channel.val_shared.get_value()
+        var = max(channel.val_sq_shared.get_value() - mean ** 2, 0.)
+        # The finite population correction makes the error vanish as the
+        # subset grows to the whole dataset
+        return np.sqrt(var / num_batches * max(1. - fraction, 0.))
+
+    def evaluate_full(self, datasets=None):
+        """
+        Evaluates the channels of subsampled monitoring datasets on the
+        whole datasets.
+
+        This is meant for termination criteria and extensions that only
+        need an exact value from time to time, e.g. when the subsampled
+        estimate gets close to the best value so far. The records of the
+        channels are left as they are, since other extensions may already
+        have acted on the latest subsampled values.
+
+        Parameters
+        ----------
+        datasets : list, optional
+            The datasets to evaluate. Defaults to all the subsampled
+            datasets.
+
+        Returns
+        -------
+        values : OrderedDict
+            The value of each channel of these datasets on the whole
+            dataset, indexed by channel name.
+        """
+        if self._dirty:
+            self.redo_theano()
+
+        values = OrderedDict()
+        for index, d in enumerate(self._datasets):
+            if self._subsample[index] is None:
+                continue
+            if datasets is not None and d not in datasets:
+                continue
+            channels = [channel for channel in self.channels.values()
+                        if self._datasets.index(channel.dataset) == index]
+            for channel in channels:
+                channel.val_shared.set_value(np.cast[config.floatX](0.))
+                channel.val_sq_shared.set_value(np.cast[config.floatX](0.))
+            self._accumulate(index, full=True)
+            log.info("Full monitoring evaluation:")
+            for channel in channels:
+                val = channel.val_shared.get_value()
+                values[channel.name] = val
+                log.info("\t%s: %s" % (channel.name, str(val)))
+        return values
 
     def __call__(self):
         """
@@ -217,76 +426,300 @@ class Monitor(object):
         if self._dirty:
             self.redo_theano()
 
-        datasets = self._datasets
+        # Results of asynchronous evaluations must be recorded first
+        if getattr(self, '_worker', None) is not None:
+            self.synchronize()
 
+        values = self._compute_values()
+        self._record(values, self._counters(), time.time() - self.t0)
+
+    def _counters(self):
+        """
+        Returns the (epochs, batches, examples) seen so far.
+        """
+        return (self._epochs_seen, self._num_batches_seen,
+                self._examples_seen)
+
+    def _compute_values(self):
+        """
+        Runs the model on the monitoring datasets.
+
+        Returns
+        -------
+        values : dict
+            A dictionary mapping the names of the channels to (value,
+            standard error) pairs.
+        """
         # Set all channels' val_shared to 0
         self.begin_record_entry()
-        for d, i, b, n, a, sd, ne in safe_izip(datasets,
-                                               self._iteration_mode,
-                                               self._batch_size,
-                                               self._num_batches,
-                                               self.accum,
-                                               self._rng_seed,
-                                               self.num_examples):
-            if isinstance(d, six.string_types):
-                d = yaml_parse.load(d)
-                raise NotImplementedError()
-
-            # need to put d back into self._datasets
-            myiterator = d.iterator(mode=i,
-                                    batch_size=b,
-                                    num_batches=n,
-                                    data_specs=self._flat_data_specs,
-                                    return_tuple=True,
-                                    rng=sd)
-
-            # If self._flat_data_specs is empty, no channel needs data,
-            # so we do not need to call the iterator in order to average
-            # the monitored values across different batches, we only
-            # have to call them once.
-            if len(self._flat_data_specs[1]) == 0:
-                X = ()
-                self.run_prereqs(X, d)
-                a(*X)
-
-            else:
-                actual_ne = 0
-                for X in myiterator:
-                    # X is a flat (not nested) tuple
-                    self.run_prereqs(X, d)
-                    a(*X)
-                    actual_ne += self._flat_data_specs[0].np_batch_size(X)
-                # end for X
-                if actual_ne != ne:
-                    raise RuntimeError("At compile time, your iterator said "
-                                       "it had %d examples total, but at "
-                                       "runtime it gave us %d." %
-                                       (ne, actual_ne))
+        timer = getattr(self, 'phase_timer', None)
+        if timer is None:
+            timer = NullPhaseTimer()
+        for index in range(len(self._datasets)):
+            with timer.phase(self.dataset_phase_name(index)):
+                self._accumulate(index)
         # end for d
 
+        return dict((name, (channel.val_shared.get_value(),
+                            self._std_err(channel)))
+                    for name, channel in six.iteritems(self.channels))
+
+    def _record(self, values, counters, t):
+        """
+        Adds one data point to each of the channels.
+
+        Parameters
+        ----------
+        values : dict
+            A dictionary mapping the names of the channels to (value,
+            standard error) pairs.
+        counters : tuple
+            The (epochs, batches, examples) seen when the parameters were
+            the ones the values were computed with.
+        t : float
+            The time at which these parameters were used, in seconds since
+            the creation of the monitor.
+        """
+        epochs_seen, num_batches_seen, examples_seen = counters
         log.info("Monitoring step:")
-        log.info("\tEpochs seen: %d" % self._epochs_seen)
-        log.info("\tBatches seen: %d" % self._num_batches_seen)
-        log.info("\tExamples seen: %d" % self._examples_seen)
-        t = time.time() - self.t0
+        log.info("\tEpochs seen: %d" % epochs_seen)
+        log.info("\tBatches seen: %d" % num_batches_seen)
+        log.info("\tExamples seen: %d" % examples_seen)
         for channel_name in sorted(self.channels.keys(),
                                    key=number_aware_alphabetical_key):
             channel = self.channels[channel_name]
             channel.time_record.append(t)
-            channel.batch_record.append(self._num_batches_seen)
-            channel.example_record.append(self._examples_seen)
-            channel.epoch_record.append(self._epochs_seen)
-            val = channel.val_shared.get_value()
+            channel.batch_record.append(num_batches_seen)
+            channel.example_record.append(examples_seen)
+            channel.epoch_record.append(epochs_seen)
+            val, std_err = values[channel_name]
             channel.val_record.append(val)
+            channel.std_err_record.append(std_err)
             # TODO: use logging infrastructure so that user can configure
             # formatting
             if abs(val) < 1e4:
                 val_str = str(val)
             else:
                 val_str = '%.3e' % val
+            if std_err != 0.:
+                val_str += ' +/- %.3g' % std_err
 
             log.info("\t%s: %s" % (channel_name, val_str))
 
+        history_path = getattr(self, 'history_path', None)
+        if history_path is not None:
+            channel_history.append_step(history_path,
+                                        {'epochs': epochs_seen,
+                                         'batches': num_batches_seen,
+                                         'examples': examples_seen,
+                                         'time': t},
+                                        values)
+
+    def set_history_path(self, path):
+        """
+        Makes the monitor append its history to a log file, with one line
+        per monitoring step, so that it can be read without unpickling
+        the model (see `pylearn2.utils.channel_history.load_history`).
+
+        The log is first rewritten with the current records of the
+        channels, so that it matches the monitor when resuming from a
+        saved model.
+
+        Parameters
+        ----------
+        path : str or None
+            The path of the log. If None, the history is no longer logged.
+        """
+        self.history_path = path
+        # The log belongs to the job that writes it, not to the model
+        self.register_names_to_del(['history_path'])
+        if path is not None:
+            channel_history.write_history(path, self.channels)
+
+    def set_phase_timer(self, timer):
+        """
+        Makes the monitor time the evaluation of each monitoring dataset
+        as a phase of `timer` (see `dataset_phase_name`).
+
+        Parameters
+        ----------
+        timer : pylearn2.utils.timing.PhaseTimer or None
+            The timer. If None, the monitor no longer times anything.
+        """
+        self.phase_timer = timer
+        self.register_names_to_del(['phase_timer'])
+
+    def dataset_phase_name(self, index):
+        """
+        Returns the name of the phase timing the evaluation of a
+        monitoring dataset.
+
+        Parameters
+        ----------
+        index : int
+            The index of the dataset.
+
+        Returns
+        -------
+        name : str
+            The name the dataset was given in `setup`, if any, otherwise
+            'dataset' followed by its index.
+        """
+        name = getattr(self, '_dataset_names', {}).get(index)
+        if not name:
+            name = 'dataset%d' % index
+        return name
+
+    def start_worker(self):
+        """
+        Starts a worker process that computes the channels on snapshots of
+        the model, so that `call_async` can return immediately and let
+        training go on while the monitoring datasets are processed.
+
+        The worker is forked from the current process, whatever the
+        default start method of `multiprocessing` is, so it holds its own
+        copy of the monitoring datasets and of the compiled channel
+        functions. The channels must not change afterwards. This is not
+        supported on Windows, and since CUDA contexts do not survive a
+        fork, only supported on CPU.
+        """
+        if getattr(self, '_worker', None) is not None:
+            return
+        if self._dirty:
+            self.redo_theano()
+
+        # Everything the channels may depend on that training changes:
+        # the parameters, and the other shared variables of the channel
+        # graphs (learning rates, timers updated by Train, ...).
+        shared_vars = list(self.model.get_params())
+        trackers = set()
+        for channel in self.channels.values():
+            trackers.update([channel.val_shared, channel.val_sq_shared])
+        for var in theano.gof.graph.inputs([channel.val for channel in
+                                            self.channels.values()]):
+            if (isinstance(var, theano.compile.SharedVariable) and
+                    var not in trackers and var not in shared_vars):
+                shared_vars.append(var)
+        self._snapshot_vars = shared_vars
+
+        context = fork_context()
+        self._worker_conn, child_conn = context.Pipe()
+        self._worker = context.Process(target=_monitor_worker,
+                                       args=(self, child_conn))
+        self._worker.daemon = True
+        self._worker.start()
+        child_conn.close()
+        self._pending = collections.deque()
+        self.register_names_to_del(['_worker', '_worker_conn', '_pending',
+                                    '_snapshot_vars'])
+
+    def call_async(self):
+        """
+        Like `__call__`, but the channels are computed by the worker
+        process started by `start_worker` on a snapshot of the model, and
+        recorded by a later call to `synchronize` (or `__call__`), with
+        the counters and time of the snapshot.
+
+        If the channels changed since the worker was started, waits for
+        the pending results and computes the channels synchronously.
+        """
+        if getattr(self, '_worker', None) is None or self._dirty:
+            if getattr(self, '_worker', None) is not None:
+                log.warning("The monitoring channels changed since the "
+                            "monitoring worker started, monitoring "
+                            "synchronously.")
+            self()
+            return
+        snapshot = [var.get_value(borrow=False)
+                    for var in self._snapshot_vars]
+        counters = self._counters()
+        t = time.time() - self.t0
+        if not self._worker.is_alive():
+            raise self._worker_died()
+        try:
+            self._worker_conn.send((snapshot, counters))
+        except (IOError, OSError):
+            raise self._worker_died()
+        self._pending.append((counters, t))
+        # Record the results that are already available
+        self.synchronize(block=False)
+
+    def is_pending(self, counters=None):
+        """
+        Returns whether the results of an evaluation started by
+        `call_async` are not recorded yet.
+
+        Parameters
+        ----------
+        counters : tuple, optional
+            The (epochs, batches, examples) seen when the evaluation was
+            started. Defaults to the current counters.
+        """
+        if counters is None:
+            counters = self._counters()
+        pending = getattr(self, '_pending', None) or []
+        return any(c == tuple(counters) for c, t in pending)
+
+    def synchronize(self, block=True, max_pending=0):
+        """
+        Records the results of the evaluations started by `call_async`.
+
+        Parameters
+        ----------
+        block : bool, optional
+            If True (default), wait until at most `max_pending`
+            evaluations are pending. Otherwise, only record the results
+            that are already done.
+        max_pending : int, optional
+            The number of evaluations that may still be pending when
+            `block` is True, e.g. 1 to only wait for the evaluations
+            started before the latest one.
+        """
+        pending = getattr(self, '_pending', None)
+        while pending:
+            if ((not block or len(pending) <= max_pending) and
+                    not self._worker_conn.poll()):
+                return
+            try:
+                success, values = self._worker_conn.recv()
+            except (EOFError, IOError, OSError):
+                raise self._worker_died()
+            counters, t = pending.popleft()
+            if not success:
+                raise RuntimeError("Error in the monitoring worker:\n" +
+                                   values)
+            self._record(values, counters, t)
+
+    def _worker_died(self):
+        """
+        Returns the error raised when the monitoring worker is found dead.
+        """
+        self._worker.join(1.)
+        return RuntimeError("The monitoring worker died (exit code %s), "
+                            "its pending results are lost." %
+                            self._worker.exitcode)
+
+    def stop_worker(self):
+        """
+        Records the pending results of the worker process started by
+        `start_worker`, and stops it.
+        """
+        if getattr(self, '_worker', None) is None:
+            return
+        try:
+            self.synchronize()
+        finally:
+            if self._worker.is_alive():
+                try:
+                    self._worker_conn.send(None)
+                except (IOError, OSError):
+                    self._worker.terminate()
+            self._worker.join()
+            self._worker_conn.close()
+            self._worker = None
+            self._worker_conn = None
+            self._pending = None
+
     def run_prereqs(self, data, dataset):
         """
         Runs all "prerequistie functions" on a batch of data. Always
@@ -398,12 +831,14 @@ class Monitor(object):
         updates = OrderedDict()
         for channel in self.channels.values():
             updates[channel.val_shared] = np.cast[config.floatX](0.0)
+            updates[channel.val_sq_shared] = np.cast[config.floatX](0.0)
         with log_timing(log, "compiling begin_record_entry"):
-            self.begin_record_entry = function(
+            self.begin_record_entry = cached_function(
                 inputs=[],
                 updates=updates,
                 mode=self.theano_function_mode,
-                name='Monitor.begin_record_entry'
+                name='Monitor.begin_record_entry',
+                on_unused_input='ignore'
             )
         updates = OrderedDict()
         givens = OrderedDict()
@@ -432,20 +867,21 @@ class Monitor(object):
                 mode.record.handle_line('compiling monitor including ' +
                                         'channel ' + key + '\n')
             log.info('\t%s' % key)
-        it = []
-        for d, i, n, b in safe_izip(self._datasets, self._iteration_mode,
-                                    self._num_batches, self._batch_size):
-            it.append(d.iterator(mode=i, num_batches=n, batch_size=b,
-                                 data_specs=self._flat_data_specs,
-                                 return_tuple=True))
+        it = [self._iterator(index) for index in range(len(self._datasets))]
         self.num_examples = [i.num_examples for i in it]
+        # The number of examples is a shared variable, so that the same
+        # functions can average over a subset or over the whole dataset
+        self._num_examples_shared = [
+            theano.shared(np.cast['float64'](ne), name='monitor_num_examples')
+            for ne in self.num_examples]
+        self._last_pass = [None] * len(self._datasets)
         givens = [OrderedDict() for d in self._datasets]
         updates = [OrderedDict() for d in self._datasets]
         for i, channel in enumerate(self.channels.values()):
             index = self._datasets.index(channel.dataset)
             d = self._datasets[index]
             g = givens[index]
-            cur_num_examples = self.num_examples[index]
+            cur_num_examples = self._num_examples_shared[index]
             u = updates[index]
 
             # Flatten channel.graph_input and the appropriate part of
@@ -470,12 +906,19 @@ class Monitor(object):
                 assert len(self._flat_data_specs[1]) == 0
                 val = channel.val
             else:
-                if n == 0:
+                if self._num_batches[index] == 0:
                     raise ValueError("Iterating over 0 examples results in " +
                                      "divide by 0")
                 val = T.cast(channel.val * T.cast(batch_size, 'float64')
                              / cur_num_examples, config.floatX)
             u[channel.val_shared] = channel.val_shared + val
+            if self._subsample[index] is not None and batch_size != 0:
+                # Accumulate the squares of the batch values too, to
+                # estimate the standard error of the subsampled values
+                sq = T.cast(T.sqr(channel.val) *
+                            T.cast(batch_size, 'float64') /
+                            cur_num_examples, config.floatX)
+                u[channel.val_sq_shared] = channel.val_sq_shared + sq
 
         with log_timing(log, "Compiling accum"):
             # Check type of update expressions
@@ -509,11 +952,13 @@ class Monitor(object):
                 # monitor the model parameters, or some shared variable updated
                 # by the training algorithm, so we need to ignore the unused
                 # input error
-                self.accum.append(function(theano_args,
-                                           givens=g,
-                                           updates=u,
-                                           mode=self.theano_function_mode,
-                                           name=function_name))
+                self.accum.append(cached_function(
+                    theano_args,
+                    givens=g,
+                    updates=u,
+                    mode=self.theano_function_mode,
+                    name=function_name,
+                    on_unused_input='ignore'))
             for a in self.accum:
                 if mode is not None and hasattr(mode, 'record'):
                     for elem in a.maker.fgraph.outputs:
@@ -592,6 +1037,9 @@ class Monitor(object):
         if '_dataset' in d:
             d['_datasets'] = [d['_dataset']]
             del d['_dataset']
+        if '_subsample' not in d:
+            d['_subsample'] = [None] * len(d['_datasets'])
+            d['_rotate_subsample'] = [False] * len(d['_datasets'])
 
         self.__dict__.update(d)
 
@@ -925,6 +1373,10 @@ class Monitor(object):
                              batch_size=batch_size,
                              num_batches=num_batches,
                              seed=seed)
+            if not hasattr(self, '_dataset_names'):
+                self._dataset_names = {}
+            self._dataset_names[self._datasets.index(cur_dataset)] = \
+                dataset_name
             if dataset_name == '':
                 dprefix = ''
             else:
@@ -999,6 +1451,8 @@ class MonitorChannel(object):
             val = T.constant(np.cast[config.floatX](val))
         self.val = val
         self.val_shared = sharedX(0.0, name + "_tracker")
+        # Sum of the squared batch values, for subsampled datasets
+        self.val_sq_shared = sharedX(0.0, name + "_sq_tracker")
         assert self.val_shared.dtype == config.floatX, \
             "expected %s, got %s" % (config.floatX, self.val_shared.dtype)
         if not hasattr(val, 'dtype'):
@@ -1014,26 +1468,20 @@ class MonitorChannel(object):
                              str(val.ndim))
         # Dataset monitored by this channel
         self.dataset = dataset
-        if old_channel is not None:
-            # Value of the desired quantity at measurement time.
-            self.val_record = old_channel.val_record[:-1]
-            # Number of batches seen at measurement time.
-            self.batch_record = old_channel.batch_record[:-1]
-            # Number of examples seen at measurement time (batch sizes may
-            # fluctuate).
-            self.example_record = old_channel.example_record[:-1]
-            self.epoch_record = old_channel.epoch_record[:-1]
-            self.time_record = old_channel.time_record[:-1]
-        else:
-            # Value of the desired quantity at measurement time.
-            self.val_record = []
-            # Number of batches seen at measurement time.
-            self.batch_record = []
-            # Number of examples seen at measurement time (batch sizes may
-            # fluctuate).
-            self.example_record = []
-            self.epoch_record = []
-            self.time_record = []
+        # The records are ChannelRecord objects, growable typed arrays
+        # that pickle compactly.
+        # val_record: value of the desired quantity at measurement time.
+        # batch_record: number of batches seen at measurement time.
+        # example_record: number of examples seen at measurement time
+        # (batch sizes may fluctuate).
+        # std_err_record: standard error of the value, 0 if computed on
+        # the whole dataset.
+        for field in channel_history.RECORD_DTYPES:
+            if old_channel is not None:
+                record = as_record(getattr(old_channel, field)[:-1], field)
+            else:
+                record = ChannelRecord(channel_history.RECORD_DTYPES[field])
+            setattr(self, field, record)
 
     def __str__(self):
         """
@@ -1110,7 +1558,8 @@ class MonitorChannel(object):
             'batch_record': self.batch_record,
             'time_record': self.time_record,
             'epoch_record': self.epoch_record,
-            'val_record': self.val_record
+            'val_record': self.val_record,
+            'std_err_record': self.std_err_record
         }
 
     def __setstate__(self, d):
@@ -1133,6 +1582,47 @@ class MonitorChannel(object):
             self.epoch_record = range(len(self.val_record))
         if 'time_record' not in d:
             self.time_record = [None] * len(self.val_record)
+        # Channels pickled before subsampling existed were always computed
+        # on the whole dataset
+        if 'std_err_record' not in d:
+            self.std_err_record = [0.] * len(self.val_record)
+        # Channels pickled before the records were stored as arrays hold
+        # lists
+        for field in channel_history.RECORD_DTYPES:
+            setattr(self, field, as_record(getattr(self, field), field))
+
+
+def _monitor_worker(monitor, conn):
+    """
+    Main loop of the monitoring worker process started by
+    `Monitor.start_worker`.
+
+    Receives (snapshot, counters) pairs, loads the snapshot in the shared
+    variables of the model, and sends back the values of the channels.
+
+    Parameters
+    ----------
+    monitor : Monitor
+        The (forked copy of the) monitor.
+    conn : multiprocessing.Connection
+        The connection with the training process.
+    """
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+        snapshot, counters = msg
+        try:
+            for var, value in safe_izip(monitor._snapshot_vars, snapshot):
+                var.set_value(value, borrow=True)
+            (monitor._epochs_seen, monitor._num_batches_seen,
+             monitor._examples_seen) = counters
+            conn.send((True, monitor._compute_values()))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
 
 
 def push_monitor(model, name, transfer_experience=False,
@@ -0,0 +1,3 @@
+"""
+Benchmarks of pylearn2, see `run_benchmarks.py` and `run_configs.py`.
+"""
@@ -0,0 +1,620 @@
+#!/usr/bin/env python
+"""
+Usage: python run_benchmarks.py run [-o results.json] [-k REGEX]
+                                    [--repeat N] [--quick]
+       python run_benchmarks.py compare baseline.json results.json
+                                        [--threshold T]
+
+Times the hot paths of pylearn2 and writes the results as JSON:
+
+- a full epoch of every iteration scheme over a DenseDesignMatrix, and over
+  an HDF5Dataset if h5py is installed,
+- `Space.np_format_as` conversions between the common spaces,
+- the GlobalContrastNormalization, ZCA, LeCunLCN and ExtractPatches
+  preprocessors,
+- fprop and bprop of the Linear, ConvElemwise, Maxout and Softmax layers at
+  several batch sizes,
+- `serial.save` and `serial.load` of a large model, and the same with a
+  parameter checkpoint.
+
+Each benchmark is run `--repeat` times, and its minimum and median times
+are recorded. `--quick` uses smaller sizes, to check that the suite runs.
+
+The compare mode reports, for each benchmark of both files, the ratio of
+the minimum times, and exits with status 1 if any of them got slower by
+more than the threshold (a fraction, 0.1 by default).
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from timeit import default_timer
+
+import numpy as np
+import theano
+from theano import config
+from theano import tensor as T
+from theano.compat.six.moves import xrange
+
+from pylearn2.compat import OrderedDict
+from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
+from pylearn2.datasets import preprocessing
+from pylearn2.models.maxout import Maxout
+from pylearn2.models.mlp import (MLP, ConvElemwise, Linear, Softmax,
+                                 RectifierConvNonlinearity)
+from pylearn2.space import (CompositeSpace, Conv2DSpace, IndexSpace,
+                            VectorSpace)
+from pylearn2.utils import param_checkpoint
+from pylearn2.utils import serial
+from pylearn2.utils.iteration import _iteration_schemes, is_stochastic
+
+
+logger = logging.getLogger(__name__)
+
+# Version of the format of the results, stored in them
+FORMAT_VERSION = 1
+
+
+class Case(object):
+    """
+    One benchmark.
+
+    Parameters
+    ----------
+    name : str
+        The name of the benchmark, e.g. 'iteration/dense/sequential'.
+    run : callable
+        The code timed, called with the value returned by `setup`.
+    setup : callable, optional
+        Called before each repetition, outside of the timed region. Its
+        return value is given to `run`.
+    number : int, optional
+        The number of calls to `run` per repetition. The recorded times
+        are per call.
+    params : dict, optional
+        The parameters of the benchmark (sizes, ...), recorded with the
+        results.
+    """
+
+    def __init__(self, name, run, setup=None, number=1, params=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.number = number
+        self.params = params if params is not None else {}
+
+    def time(self, repeat):
+        """
+        Runs the benchmark.
+
+        Parameters
+        ----------
+        repeat : int
+            The number of repetitions.
+
+        Returns
+        -------
+        times : list
+            The time per call to `run` of each repetition, in seconds.
+        """
+        times = []
+        for i in xrange(repeat):
+            state = self.setup() if self.setup is not None else None
+            t0 = default_timer()
+            for j in xrange(self.number):
+                self.run(state)
+            times.append((default_timer() - t0) / self.number)
+        return times
+
+
+def _uniform(rng, shape):
+    """
+    Returns an array of floatX uniform numbers.
+    """
+    return rng.uniform(-1., 1., size=shape).astype(config.floatX)
+
+
+def _one_hot(rng, num_examples, num_classes):
+    """
+    Returns a floatX one-hot matrix of random labels.
+    """
+    y = np.zeros((num_examples, num_classes), dtype=config.floatX)
+    y[np.arange(num_examples), rng.randint(num_classes,
+                                           size=num_examples)] = 1
+    return y
+
+
+def _iteration_cases(dataset_name, dataset, num_examples, batch_size):
+    """
+    Yields a case per iteration scheme, consuming one epoch of `dataset`,
+    whose features have 784 dimensions and targets 10.
+    """
+    data_specs = (CompositeSpace([VectorSpace(784), VectorSpace(10)]),
+                  ('features', 'targets'))
+    num_batches = num_examples // batch_size
+    for mode in sorted(_iteration_schemes):
+        def setup(mode=mode):
+            rng = [2015, 5, 1] if is_stochastic(mode) else None
+            return dataset.iterator(mode=mode, batch_size=batch_size,
+                                    num_batches=num_batches,
+                                    data_specs=data_specs,
+                                    return_tuple=True, rng=rng)
+
+        def run(iterator):
+            for batch in iterator:
+                pass
+        yield Case('iteration/%s/%s' % (dataset_name, mode), run, setup,
+                   params={'num_examples': num_examples,
+                           'batch_size': batch_size})
+
+
+def _iteration_data(quick):
+    """
+    Returns the features and targets of the datasets iterated over.
+    """
+    rng = np.random.RandomState([2015, 5, 1])
+    num_examples = 2000 if quick else 50000
+    return (_uniform(rng, (num_examples, 784)),
+            _one_hot(rng, num_examples, 10))
+
+
+def dense_iteration_cases(quick, tmp_dir):
+    """
+    Benchmarks of the iteration schemes over a DenseDesignMatrix.
+
+    Parameters
+    ----------
+    quick : bool
+        If True, smaller sizes are used.
+    tmp_dir : str
+        A directory for the files of the benchmarks.
+    """
+    X, y = _iteration_data(quick)
+    dense = DenseDesignMatrix(X=X, y=y)
+    for case in _iteration_cases('dense', dense, len(X), 100):
+        yield case
+
+
+def hdf5_iteration_cases(quick, tmp_dir):
+    """
+    Benchmarks of the iteration schemes over an HDF5Dataset.
+
+    Parameters
+    ----------
+    quick : bool
+        If True, smaller sizes are used.
+    tmp_dir : str
+        A directory for the files of the benchmarks. The HDF5 file is
+        written there.
+    """
+    try:
+        import h5py
+    except ImportError:
+        logger.warning('h5py is not available, skipping the iteration '
+                       'benchmarks of HDF5Dataset.')
+        return
+    from pylearn2.datasets.hdf5 import HDF5Dataset
+    X, y = _iteration_data(quick)
+    path = os.path.join(tmp_dir, 'iteration.h5')
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('features', data=X)
+        f.create_dataset('targets', data=y)
+    hdf5 = HDF5Dataset(path, sources=['features', 'targets'],
+                       spaces=[VectorSpace(784), VectorSpace(10)],
+                       use_h5py=True)
+    for case in _iteration_cases('hdf5', hdf5, len(X), 100):
+        yield case
+
+
+def space_cases(quick, tmp_dir):
+    """
+    Benchmarks of `Space.np_format_as`.
+
+    Parameters
+    ----------
+    quick : bool
+        If True, smaller sizes are used.
+    tmp_dir : str
+        A directory for the files of the benchmarks.
+    """
+    rng = np.random.RandomState([2015, 5, 2])
+    batch_size = 128
+    number = 5 if quick else 50
+    b01c = Conv2DSpace(shape=(32, 32), num_channels=3,
+                       axes=('b', 0, 1, 'c'))
+    c01b = Conv2DSpace(shape=(32, 32), num_channels=3,
+                       axes=('c', 0, 1, 'b'))
+    conversions = [
+        ('vector_to_conv2d', VectorSpace(3072), b01c),
+        ('conv2d_b01c_to_c01b', b01c, c01b),
+        ('conv2d_c01b_to_vector', c01b, VectorSpace(3072)),
+        ('index_to_onehot', IndexSpace(max_labels=10, dim=1),
+         VectorSpace(10)),
+    ]
+    for name, space, to_space in conversions:
+        if isinstance(space, IndexSpace):
+            batch = rng.randint(10, size=(batch_size, 1))
+        else:
+            batch = _uniform(rng, space.get_origin_batch(batch_size).shape)
+
+        def run(state, space=space, to_space=to_space, batch=batch):
+            space.np_format_as(batch, to_space)
+        yield Case('space/' + name, run, number=number,
+                   params={'batch_size': batch_size})
+
+
+def preprocessing_cases(quick, tmp_dir):
+    """
+    Benchmarks of the preprocessors, applied to a fresh copy of an image
+    dataset each time.
+
+    Parameters
+    ----------
+    quick : bool
+        If True, smaller sizes are used.
+    tmp_dir : str
+        A directory for the files of the benchmarks.
+    """
+    rng = np.random.RandomState([2015, 5, 3])
+    num_images = 200 if quick else 5000
+    images = _uniform(rng, (num_images, 32, 32, 3))
+    patches = _uniform(rng, (num_images, 192))
+
+    def images_dataset():
+        return DenseDesignMatrix(topo_view=images.copy(),
+                                 axes=('b', 0, 1, 'c'))
+
+    def patches_dataset():
+        return DenseDesignMatrix(X=patches.copy())
+
+    preprocessors = [
+        ('gcn', lambda: preprocessing.GlobalContrastNormalization(scale=55.),
+         images_dataset),
+        ('zca', lambda: preprocessing.ZCA(), patches_dataset),
+        ('lcn', lambda: preprocessing.LeCunLCN(img_shape=(32, 32),
+                                               batch_size=num_images),
+         images_dataset),
+        ('extract_patches',
+         lambda: preprocessing.ExtractPatches(patch_shape=(8, 8),
+                                              num_patches=num_images * 4),
+         images_dataset),
+    ]
+    for name, make_preprocessor, make_dataset in preprocessors:
+        def setup(make_preprocessor=make_preprocessor,
+                  make_dataset=make_dataset):
+            return make_preprocessor(), make_dataset()
+
+        def run(state):
+            preprocessor, dataset = state
+            preprocessor.apply(dataset, can_fit=True)
+        yield Case('preprocessing/' + name, run, setup,
+                   params={'num_examples': num_images})
+
+
+def _layer_models():
+    """
+    Returns (name, model) pairs of one-layer MLPs.
+    """
+    return [
+        ('linear', MLP(layers=[Linear(dim=1024, layer_name='h0',
+                                      irange=.05)],
+                       nvis=784)),
+        ('maxout', MLP(layers=[Maxout(num_units=240, num_pieces=5,
+                                      layer_name='h0', irange=.005)],
+                       nvis=784)),
+        ('softmax', MLP(layers=[Softmax(n_classes=10, layer_name='y',
+                                        irange=.05)],
+                        nvis=1024)),
+        ('conv_elemwise',
+         MLP(layers=[ConvElemwise(output_channels=32, kernel_shape=(5, 5),
+                                  layer_name='h0',
+                                  nonlinearity=RectifierConvNonlinearity(),
+                                  irange=.05)],
+             input_space=Conv2DSpace(shape=(28, 28), num_channels=16))),
+    ]
+
+
+def layer_cases(quick, tmp_dir):
+    """
+    Benchmarks of the forward and backward propagation of the layers.
+
+    Parameters
+    ----------
+    quick : bool
+        If True, smaller sizes are used.
+    tmp_dir : str
+        A directory for the files of the benchmarks.
+    """
+    rng = np.random.RandomState([2015, 5, 4])
+    batch_sizes = [32] if quick else [32, 128, 512]
+    number = 2 if quick else 10
+    for name, model in _layer_models():
+        space = model.get_input_space()
+        X = space.make_theano_batch()
+        output = model.fprop(X)
+        fprop = theano.function([X], output, name=name + '_fprop')
+        bprop = theano.function([X], T.grad(output.sum(), model.get_params()),
+                                name=name + '_bprop')
+        for batch_size in batch_sizes:
+            batch = _uniform(rng, space.get_origin_batch(batch_size).shape)
+            for pass_name, f in [('fprop', fprop), ('bprop', bprop)]:
+                def run(state, f=f, batch=batch):
+                    f(batch)
+                yield Case('layer/%s/%s/%d' % (name, pass_name, batch_size),
+                           run, number=number,
+                           params={'batch_size': batch_size})
+
+
+def serialization_cases(quick, tmp_dir):
+    """
+    Benchmarks of saving and loading a large model.
+
+    Parameters
+    ----------
+    quick : bool
+        If True, smaller sizes are used.
+    tmp_dir : str
+        A directory for the files of the benchmarks.
+    """
+    dim = 256 if quick else 2048
+    model = MLP(layers=[Linear(dim=dim, layer_name='h0', irange=.05),
+                        Linear(dim=dim, layer_name='h1', irange=.05),
+                        Softmax(n_classes=10, layer_name='y', irange=.05)],
+                nvis=dim)
+    params = {'num_params': int(sum(value.size for value in
+                                    model.get_param_values()))}
+    pkl_path = os.path.join(tmp_dir, 'model.pkl')
+    npz_path = os.path.join(tmp_dir, 'model_params.npz')
+
+    yield Case('serial/save_pkl',
+               lambda state: serial.save(pkl_path, model), params=params)
+    yield Case('serial/load_pkl',
+               lambda state: serial.load(pkl_path), params=params)
+    yield Case('serial/save_params',
+               lambda state: param_checkpoint.save_params(npz_path, model),
+               params=params)
+
+    def load_params(state):
+        checkpoint = param_checkpoint.ParamCheckpoint(npz_path)
+        for i in xrange(len(checkpoint.layers)):
+            checkpoint.get_value(i, mmap=False)
+    yield Case('serial/load_params', load_params, params=params)
+
+
+# The groups of benchmarks, in the order they are run. The cases of each
+# group are built separately, so that one failing to set up (e.g. because
+# of a missing dependency) does not prevent the others from running.
+SUITES = OrderedDict([('iteration/dense', dense_iteration_cases),
+                      ('iteration/hdf5', hdf5_iteration_cases),
+                      ('space', space_cases),
+                      ('preprocessing', preprocessing_cases),
+                      ('layer', layer_cases),
+                      ('serial', serialization_cases)])
+
+# The first components of the names of the groups, which a pattern can
+# start with
+_SUITE_PREFIXES = set(name.split('/')[0] for name in SUITES)
+
+
+def metadata():
+    """
+    Describes the environment the benchmarks run in.
+    """
+    return OrderedDict([('format', FORMAT_VERSION),
+                        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                        ('host', socket.gethostname()),
+                        ('platform', platform.platform()),
+                        ('python', platform.python_version()),
+                        ('numpy', np.__version__),
+                        ('theano', theano.__version__),
+                        ('device', config.device),
+                        ('floatX', config.floatX),
+                        ('argv', sys.argv)])
+
+
+def run_benchmarks(pattern=None, repeat=5, quick=False):
+    """
+    Runs the benchmarks.
+
+    Parameters
+    ----------
+    pattern : str, optional
+        If specified, only the benchmarks whose names match this regular
+        expression are run.
+    repeat : int, optional
+        The number of repetitions of each benchmark.
+    quick : bool, optional
+        If True, smaller sizes are used.
+
+    Returns
+    -------
+    results : OrderedDict
+        'metadata' describes the environment, and 'results' maps the
+        names of the benchmarks to their times ('min', 'median' and all
+        the 'times', in seconds), parameters and number of calls per
+        repetition, or to an 'error' message if they failed.
+    """
+    regex = re.compile(pattern) if pattern is not None else None
+    results = OrderedDict()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for suite_name, make_cases in SUITES.items():
+            # Building the cases of a suite can be expensive, so a pattern
+            # starting with the name of another suite skips it entirely
+            prefix = pattern.split('/')[0] if pattern is not None else None
+            suite_prefix = suite_name.split('/')[0]
+            if prefix in _SUITE_PREFIXES and prefix != suite_prefix:
+                continue
+            try:
+                cases = list(make_cases(quick, tmp_dir))
+            except Exception as e:
+                logger.exception('Could not set up the %s benchmarks.' %
+                                 suite_name)
+                results[suite_name] = {'error': str(e)}
+                continue
+            for case in cases:
+                if regex is not None and not regex.search(case.name):
+                    continue
+                try:
+                    times = case.time(repeat)
+                except Exception as e:
+                    logger.warning('%s failed: %s' % (case.name, e))
+                    results[case.name] = {'error': str(e)}
+                    continue
+                results[case.name] = OrderedDict(
+                    [('min', min(times)),
+                     ('median', float(np.median(times))),
+                     ('times', times),
+                     ('number', case.number),
+                     ('params', case.params)])
+                logger.info('%-50s %12.6f s' % (case.name, min(times)))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return OrderedDict([('metadata', metadata()), ('results', results)])
+
+
+def compare_results(baseline, current, threshold=.1, key='min'):
+    """
+    Compares two sets of results of `run_benchmarks`.
+
+    Parameters
+    ----------
+    baseline : dict
+        The reference results.
+    current : dict
+        The new results.
+    threshold : float, optional
+        A benchmark is a regression if its time grew by more than this
+        fraction.
+    key : str, optional
+        The field of the results compared, a time (lower is better).
+
+    Returns
+    -------
+    rows : list
+        A (name, baseline time, current time, ratio, status) tuple for
+        each benchmark of both results, where status is 'regression',
+        'improvement', 'ok' or 'error'.
+    """
+    rows = []
+    for name, base in baseline['results'].items():
+        if name not in current['results']:
+            continue
+        cur = current['results'][name]
+        if 'error' in base or 'error' in cur:
+            rows.append((name, base.get(key), cur.get(key), None, 'error'))
+            continue
+        ratio = cur[key] / base[key] if base[key] > 0 else np.inf
+        if ratio > 1. + threshold:
+            status = 'regression'
+        elif ratio < 1. / (1. + threshold):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, base[key], cur[key], ratio, status))
+    return rows
+
+
+def print_comparison(rows, out=None):
+    """
+    Prints the table returned by `compare_results`.
+
+    Parameters
+    ----------
+    rows : list
+        The rows returned by `compare_results`.
+    out : file, optional
+        Where the table is printed. Defaults to the standard output.
+    """
+    if out is None:
+        out = sys.stdout
+    print('%-50s %12s %12s %8s  %s' % ('benchmark', 'baseline', 'current',
+                                       'ratio', 'status'), file=out)
+    for name, base, cur, ratio, status in rows:
+        def fmt(t):
+            return '%12.6f' % t if t is not None else '%12s' % '-'
+        ratio_str = '%8.3f' % ratio if ratio is not None else '%8s' % '-'
+        print('%-50s %s %s %s  %s' % (name, fmt(base), fmt(cur), ratio_str,
+                                      status), file=out)
+
+
+def make_argument_parser():
+    """
+    Creates an ArgumentParser to read the options for this script from
+    sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description="Run the pylearn2 benchmarks, or compare two runs.")
+    subparsers = parser.add_subparsers(dest='command')
+    run = subparsers.add_parser('run', help='Run the benchmarks')
+    run.add_argument('-o', '--output', default=None,
+                     help='Write the results to this JSON file (default: '
+                          'standard output)')
+    run.add_argument('-k', '--filter', default=None,
+                     help='Only run the benchmarks whose names match this '
+                          'regular expression')
+    run.add_argument('--repeat', type=int, default=5,
+                     help='Number of repetitions of each benchmark')
+    run.add_argument('--quick', action='store_true',
+                     help='Use small sizes, to check that the suite runs')
+    compare = subparsers.add_parser('compare',
+                                    help='Compare two sets of results')
+    compare.add_argument('baseline', help='JSON file of the reference run')
+    compare.add_argument('current', help='JSON file of the new run')
+    compare.add_argument('--threshold', type=float, default=.1,
+                         help='Relative slowdown above which a benchmark '
+                              'is reported as a regression')
+    return parser
+
+
+def main(args):
+    """
+    Runs or compares the benchmarks according to the command-line
+    arguments.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The arguments parsed by the parser of `make_argument_parser`.
+
+    Returns
+    -------
+    status : int
+        The exit status: 1 if the comparison found regressions, else 0.
+    """
+    if args.command == 'run':
+        results = run_benchmarks(args.filter, args.repeat, args.quick)
+        if args.output is None:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare_results(baseline, current, args.threshold)
+    print_comparison(rows)
+    regressions = [row for row in rows if row[-1] == 'regression']
+    if regressions:
+        print('%d regression(s) beyond %g%%.' %
+              (len(regressions), 100 * args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = make_argument_parser()
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+"""
+Usage: python run_configs.py run [-o results.json] [--batches N]
+                                 [-D name=value ...] [config.yaml ...]
+       python run_configs.py compare baseline.json results.json
+                                     [--threshold T]
+
+Measures the training throughput of whole YAML configurations, by default
+the tutorial and paper configurations listed in `CONFIGS`, so that changes
+of pylearn2 or of its dependencies can't silently slow them down.
+
+The datasets are built with `pylearn2.datasets.control.push_load_data`
+set to False, which makes the datasets supporting it (MNIST,
+BinarizedMNIST) generate random data of the shape and type of the real
+data instead of reading it, so no dataset needs to be downloaded.
+Configurations loading other datasets or pickled objects with `!pkl:`
+fail and are reported as errors.
+
+Each configuration runs in a new process, on the CPU, and is trained for
+`--batches` batches of its SGD algorithm, without monitoring. Its result
+records:
+
+- `load_seconds`: the time to parse the YAML and build the objects,
+- `compile_seconds`: the time of `Train.setup`, which compiles the training
+  function (it depends on the state of the Theano compilation cache),
+- `first_batch_seconds`: the time from the start to the end of the first
+  batch,
+- `examples_per_second` and `seconds_per_example`: the throughput of the
+  training loop after the first batch,
+- `peak_rss_kb`: the peak resident memory of the process.
+
+Templated configurations (the tutorials) are filled with the values of
+`CONFIGS` and of the `-D` options. `%(save_path)s` always points to a
+temporary directory, as does `${PYLEARN2_TRAIN_FILE_FULL_STEM}`, so the
+files saved by the configurations are discarded.
+
+The compare mode compares `seconds_per_example` in two results files like
+`run_benchmarks.py compare`, and exits with status 1 if a configuration got
+slower by more than the threshold.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+
+from pylearn2.compat import OrderedDict
+from pylearn2.datasets import control
+from pylearn2.scripts.benchmark.run_benchmarks import (compare_results,
+                                                       metadata,
+                                                       print_comparison)
+from pylearn2.utils import serial
+from pylearn2.utils.mem import get_peak_memory_usage
+
+
+logger = logging.getLogger(__name__)
+
+# The directory the paths of CONFIGS are relative to
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The configurations run by default, with the values of their templates.
+# The sizes are the ones of the tutorials, not the small ones of their tests.
+CONFIGS = OrderedDict([
+    ('tutorials/multilayer_perceptron/mlp_tutorial_part_3.yaml',
+     {'train_stop': 50000, 'valid_stop': 60000, 'dim_h0': 500,
+      'dim_h1': 1000, 'sparse_init_h1': 15, 'max_epochs': 10000}),
+    ('tutorials/multilayer_perceptron/mlp_tutorial_part_4.yaml',
+     {'train_stop': 50000, 'valid_stop': 60000, 'dim_h0': 500,
+      'dim_h1': 1000, 'sparse_init_h1': 15, 'max_epochs': 10000}),
+    ('tutorials/mlp_nested.yaml',
+     {'train_stop': 50000, 'valid_stop': 60000, 'dim_h0': 500,
+      'dim_h1': 1000, 'dim_h2': 1000, 'dim_h3': 1000,
+      'sparse_init_h1': 15, 'max_epochs': 10000}),
+    ('tutorials/convolutional_network/conv.yaml',
+     {'train_stop': 50000, 'valid_stop': 60000, 'test_stop': 10000,
+      'batch_size': 100, 'output_channels_h2': 64,
+      'output_channels_h3': 64, 'max_epochs': 500}),
+    ('tutorials/stacked_autoencoders/dae_l1.yaml',
+     {'train_stop': 50000, 'batch_size': 100, 'monitoring_batches': 5,
+      'nhid': 500, 'max_epochs': 10}),
+    ('tutorials/dbm_demo/rbm.yaml',
+     {'train_stop': 60000, 'detector_layer_dim': 500,
+      'monitoring_batches': 10, 'max_epochs': 300}),
+    ('tutorials/jobman_demo/mlp.yaml',
+     {'learning_rate': .1, 'init_momentum': .5}),
+    ('tutorials/variational_autoencoder/vae.yaml', {}),
+    ('papers/maxout/mnist_pi.yaml', {}),
+    ('papers/dropout/mnist.yaml', {}),
+    ('papers/dropout/mnist_fast.yaml', {}),
+])
+
+
+class BatchClock(object):
+    """
+    An SGD update callback recording when each batch ends and how many
+    examples were seen by then.
+    """
+
+    def __init__(self):
+        self.times = []
+        self.examples = []
+
+    def __call__(self, algorithm):
+        self.times.append(default_timer())
+        self.examples.append(algorithm.monitor.get_examples_seen())
+
+
+def measure(path, hyper_params, num_batches, tmp_dir):
+    """
+    Trains the model of a configuration for some batches and measures it.
+
+    Parameters
+    ----------
+    path : str
+        The path of the YAML file describing a Train object.
+    hyper_params : dict
+        The values of the templates of the YAML file. `save_path` is set
+        to `tmp_dir`.
+    num_batches : int
+        The number of batches to train on, at least 2.
+    tmp_dir : str
+        A directory for the files written by the configuration.
+
+    Returns
+    -------
+    result : OrderedDict
+        The measures, see the documentation of the module.
+    """
+    t0 = default_timer()
+    with open(path) as f:
+        yaml_src = f.read()
+    if '%(' in yaml_src:
+        yaml_src = yaml_src % dict(hyper_params, save_path=tmp_dir)
+    # The file is copied to publish environment variables pointing to
+    # tmp_dir
+    config_path = os.path.join(tmp_dir, os.path.basename(path))
+    with open(config_path, 'w') as f:
+        f.write(yaml_src)
+    control.push_load_data(False)
+    try:
+        train = serial.load_train_file(config_path)
+    finally:
+        control.pop_load_data()
+    t_loaded = default_timer()
+
+    algorithm = train.algorithm
+    if not hasattr(algorithm, 'update_callbacks'):
+        raise ValueError("Only the configurations using SGD can be "
+                         "measured, got %s." % type(algorithm).__name__)
+    clock = BatchClock()
+    algorithm.update_callbacks = list(algorithm.update_callbacks)
+    algorithm.update_callbacks.append(clock)
+    train.setup()
+    t_setup = default_timer()
+
+    # Whole epochs are run if the dataset is too small
+    batch_size = algorithm.batch_size
+    if (batch_size is not None and
+            num_batches * batch_size <= train.dataset.get_num_examples()):
+        algorithm.batches_per_iter = num_batches
+    while len(clock.times) < num_batches:
+        algorithm.train(dataset=train.dataset)
+
+    last = num_batches - 1
+    seconds = clock.times[last] - clock.times[0]
+    examples = clock.examples[last] - clock.examples[0]
+    return OrderedDict([
+        ('load_seconds', t_loaded - t0),
+        ('compile_seconds', t_setup - t_loaded),
+        ('first_batch_seconds', clock.times[0] - t0),
+        ('examples_per_second', examples / seconds),
+        ('seconds_per_example', seconds / examples),
+        ('num_batches', num_batches),
+        ('examples', examples),
+        ('peak_rss_kb', get_peak_memory_usage()),
+        ('hyper_params', hyper_params)])
+
+
+def config_name(path):
+    """
+    Returns the name of the results of a configuration: its path relative
+    to pylearn2/scripts if it is in it.
+
+    Parameters
+    ----------
+    path : str
+        The path of the YAML file.
+    """
+    path = os.path.abspath(path)
+    if path.startswith(SCRIPTS_DIR + os.sep):
+        return os.path.relpath(path, SCRIPTS_DIR)
+    return path
+
+
+def run_configs(paths, hyper_params, num_batches):
+    """
+    Measures configurations, each in a new process.
+
+    Parameters
+    ----------
+    paths : list
+        The paths of the YAML files.
+    hyper_params : dict
+        Values of the templates overriding the ones of `CONFIGS`.
+    num_batches : int
+        The number of batches to train each configuration on.
+
+    Returns
+    -------
+    results : OrderedDict
+        'metadata' describes the environment, and 'results' maps the names
+        of the configurations to their measures, or to an 'error' message
+        if they failed.
+    """
+    env = dict(os.environ)
+    env['THEANO_FLAGS'] = ','.join(
+        flag for flag in [os.environ.get('THEANO_FLAGS'), 'device=cpu']
+        if flag)
+    results = OrderedDict()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for path in paths:
+            name = config_name(path)
+            params = dict(CONFIGS.get(name, {}), **hyper_params)
+            output = os.path.join(tmp_dir, 'result.json')
+            logger.info('Running %s' % name)
+            status = subprocess.call(
+                [sys.executable, os.path.abspath(__file__), 'measure', path,
+                 '--batches', str(num_batches), '--output', output,
+                 '--hyper', json.dumps(params)], env=env)
+            if os.path.exists(output):
+                with open(output) as f:
+                    results[name] = json.load(f, object_pairs_hook=OrderedDict)
+                os.remove(output)
+            else:
+                results[name] = {'error': 'exited with status %d' % status}
+            if 'error' in results[name]:
+                logger.warning('%s failed: %s' % (name,
+                                                  results[name]['error']))
+            else:
+                logger.info('%s: %.1f examples/s' %
+                            (name, results[name]['examples_per_second']))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return OrderedDict([('metadata', metadata()), ('results', results)])
+
+
+def parse_hyper_param(string):
+    """
+    Parses a -D option, name=value, guessing the type of the value.
+
+    Parameters
+    ----------
+    string : str
+        The value of the option.
+
+    Returns
+    -------
+    name : str
+        The name of the template.
+    value : int, float or str
+        Its value, converted to an int or a float if it is a number.
+    """
+    name, _, value = string.partition('=')
+    if not name or not _:
+        raise argparse.ArgumentTypeError("Expected name=value, got %s" %
+                                         string)
+    for convert in [int, float]:
+        try:
+            return name, convert(value)
+        except ValueError:
+            pass
+    return name, value
+
+
+def make_argument_parser():
+    """
+    Creates an ArgumentParser to read the options for this script from
+    sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure the training throughput of YAML "
+                    "configurations on synthetic data, or compare two runs.")
+    subparsers = parser.add_subparsers(dest='command')
+    run = subparsers.add_parser('run', help='Measure configurations')
+    run.add_argument('configs', nargs='*',
+                     help='YAML files (default: the configurations of '
+                          'CONFIGS)')
+    run.add_argument('-o', '--output', default=None,
+                     help='Write the results to this JSON file (default: '
+                          'standard output)')
+    run.add_argument('--batches', type=int, default=50,
+                     help='Number of batches to train each configuration on')
+    run.add_argument('-D', dest='hyper_params', action='append', default=[],
+                     type=parse_hyper_param, metavar='NAME=VALUE',
+                     help='Value of a template of the configurations')
+    compare = subparsers.add_parser('compare',
+                                    help='Compare two sets of results')
+    compare.add_argument('baseline', help='JSON file of the reference run')
+    compare.add_argument('current', help='JSON file of the new run')
+    compare.add_argument('--threshold', type=float, default=.1,
+                         help='Relative slowdown above which a '
+                              'configuration is reported as a regression')
+    # Used by `run` to measure each configuration in a new process
+    measure = subparsers.add_parser('measure')
+    measure.add_argument('config')
+    measure.add_argument('--batches', type=int, required=True)
+    measure.add_argument('--output', required=True)
+    measure.add_argument('--hyper', default='{}')
+    return parser
+
+
+def main(args):
+    """
+    Runs, measures or compares the configurations according to the
+    command-line arguments.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The arguments parsed by the parser of `make_argument_parser`.
+
+    Returns
+    -------
+    status : int
+        The exit status: 1 if a configuration failed or the comparison
+        found regressions, else 0.
+    """
+    if args.command == 'measure':
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            result = measure(args.config, json.loads(args.hyper),
+                             max(args.batches, 2), tmp_dir)
+            status = 0
+        except Exception as e:
+            logger.exception('Could not measure %s' % args.config)
+            result = {'error': '%s: %s' % (type(e).__name__, e)}
+            status = 1
+        finally:
+            shutil.rmtree(tmp_dir)
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+        return status
+
+    if args.command == 'run':
+        paths = args.configs or [os.path.join(SCRIPTS_DIR, path)
+                                 for path in CONFIGS]
+        results = run_configs(paths, dict(args.hyper_params), args.batches)
+        if args.output is None:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        return int(any('error' in result
+                       for result in results['results'].values()))
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare_results(baseline, current, args.threshold,
+                           key='seconds_per_example')
+    print_comparison(rows)
+    regressions = [row for row in rows if row[-1] == 'regression']
+    if regressions:
+        print('%d regression(s) beyond %g%%.' %
+              (len(regressions), 100 * args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = make_argument_parser()
+    sys.exit(main(parser.parse_args()))
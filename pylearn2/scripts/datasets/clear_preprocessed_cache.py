@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Usage: python clear_preprocessed_cache.py [--path PATH] [--max-bytes N]
+                                          [--list] [key ...]
+
+Removes entries from the cache of preprocessed datasets used by
+pylearn2.datasets.preprocessed_cache.CachedPreprocessor. By default, all
+the entries are removed. If keys are given, only these entries are
+removed. With --max-bytes, the least recently used entries are removed
+until the cache takes at most that many bytes.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+from pylearn2.datasets.preprocessed_cache import PreprocessedCache
+
+
+def make_argument_parser():
+    """
+    Creates an ArgumentParser to read the options for this script from
+    sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description="Invalidate entries of the preprocessed dataset cache.")
+    parser.add_argument('--path', default=None,
+                        help="Directory of the cache (defaults to "
+                             "${PYLEARN2_DATA_PATH}/preprocessed_cache)")
+    parser.add_argument('--max-bytes', type=int, default=None,
+                        help="Only evict the least recently used entries, "
+                             "until the cache takes at most this many bytes")
+    parser.add_argument('--list', action='store_true',
+                        help="List the entries instead of removing them")
+    parser.add_argument('keys', nargs='*',
+                        help="Keys of the entries to remove")
+    return parser
+
+
+def main(args):
+    """
+    Lists, trims or clears the cache according to the command-line
+    arguments.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The arguments parsed by the parser of `make_argument_parser`.
+    """
+    cache = PreprocessedCache(args.path)
+    if args.list:
+        for last_use, size, key in cache.entries():
+            print('%s %12d %s' % (time.ctime(last_use), size, key))
+    elif args.keys:
+        for key in args.keys:
+            cache.invalidate(key)
+    elif args.max_bytes is not None:
+        cache.trim(args.max_bytes)
+    else:
+        cache.clear()
+
+
+if __name__ == '__main__':
+    parser = make_argument_parser()
+    main(parser.parse_args())
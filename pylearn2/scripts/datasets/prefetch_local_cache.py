@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""
+Usage: python prefetch_local_cache.py [--threads N] <file.yaml> ...
+
+Copies to ${PYLEARN2_LOCAL_DATA_PATH}, concurrently, all the files under
+${PYLEARN2_DATA_PATH} that the given YAML files refer to, so that a job
+starting afterwards finds them in the local dataset cache.
+"""
+from __future__ import print_function
+
+import argparse
+
+from pylearn2.datasets.cache import datasetCache
+
+
+def make_argument_parser():
+    """
+    Creates an ArgumentParser to read the options for this script from
+    sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description="Cache locally the data files used by YAML files.")
+    parser.add_argument('--threads', type=int, default=4,
+                        help="Number of files copied concurrently")
+    parser.add_argument('yaml_files', nargs='+')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = make_argument_parser()
+    args = parser.parse_args()
+    filenames = []
+    for yaml_file in args.yaml_files:
+        filenames.extend(f for f in datasetCache.yaml_data_files(yaml_file)
+                         if f not in filenames)
+    for remote, local in zip(filenames,
+                             datasetCache.prefetch(filenames, args.threads)):
+        print('%s -> %s' % (remote, local))
@@ -8,6 +8,11 @@ Loads any number of .pkl files produced by train.py. Extracts
 all of their monitoring channels and prompts the user to select
 a subset of them to be plotted.
 
+The history logs written beside the .pkl files when train.py is run with
+`monitor_history` (files ending with _monitor.jsonl) can be given
+instead, to plot the channels of a job that is still running without
+unpickling the model.
+
 """
 from __future__ import print_function
 
@@ -24,6 +29,7 @@ import sys
 
 from theano.compat.six.moves import input, xrange
 from pylearn2.utils import serial
+from pylearn2.utils.channel_history import HISTORY_SUFFIX, load_history
 from theano.printing import _TagGenerator
 from pylearn2.utils.string_utils import number_aware_alphabetical_key
 from pylearn2.utils import contains_nan, contains_inf
@@ -89,15 +95,19 @@ def main():
     print('...done')
 
     for i, arg in enumerate(model_paths):
-        try:
-            model = serial.load(arg)
-        except Exception:
-            if arg.endswith('.yaml'):
-                print(sys.stderr, arg + " is a yaml config file," + 
-                      "you need to load a trained model.", file=sys.stderr)
-                quit(-1)
-            raise
-        this_model_channels = model.monitor.channels
+        if arg.endswith(HISTORY_SUFFIX):
+            this_model_channels = load_history(arg)
+            model = None
+        else:
+            try:
+                model = serial.load(arg)
+            except Exception:
+                if arg.endswith('.yaml'):
+                    print(sys.stderr, arg + " is a yaml config file," +
+                          "you need to load a trained model.", file=sys.stderr)
+                    quit(-1)
+                raise
+            this_model_channels = model.monitor.channels
 
         if len(sys.argv) > 2:
             postfix = ":" + model_names[i]
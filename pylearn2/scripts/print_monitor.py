@@ -15,19 +15,27 @@ __email__ = "pylearn-dev@googlegroups"
 
 def print_monitor(args):
     from pylearn2.utils import serial
+    from pylearn2.utils.channel_history import HISTORY_SUFFIX, load_history
     import gc
     for model_path in args:
         if len(args) > 1:
             print(model_path)
-        model = serial.load(model_path)
-        monitor = model.monitor
-        del model
-        gc.collect()
-        channels = monitor.channels
-        if not hasattr(monitor, '_epochs_seen'):
-            print('old file, not all fields parsed correctly')
+        if model_path.endswith(HISTORY_SUFFIX):
+            # A log written by Monitor.set_history_path, which can be read
+            # without unpickling the model
+            channels = load_history(model_path)
+            print('epochs seen: ', max(channels[key].epoch_record[-1]
+                                       for key in channels))
         else:
-            print('epochs seen: ', monitor._epochs_seen)
+            model = serial.load(model_path)
+            monitor = model.monitor
+            del model
+            gc.collect()
+            channels = monitor.channels
+            if not hasattr(monitor, '_epochs_seen'):
+                print('old file, not all fields parsed correctly')
+            else:
+                print('epochs seen: ', monitor._epochs_seen)
         print('time trained: ', max(channels[key].time_record[-1] for key in
               channels))
         for key in sorted(channels.keys()):
@@ -78,6 +78,7 @@ if os.getenv('DISPLAY') is None:
 
 # Local imports
 from pylearn2.utils import serial
+from pylearn2.utils import compile as compile_utils
 from pylearn2.utils.logger import (
     CustomStreamHandler, CustomFormatter, restore_defaults
 )
@@ -168,6 +169,11 @@ def make_argument_parser():
                         action='store_true',
                         help='Display any DEBUG-level log messages, '
                              'suppressed by default.')
+    parser.add_argument('--profile', '-P', default=None,
+                        help='Compile the Theano functions with profiling '
+                             'and write a report of the ops taking the '
+                             'most time and memory to this file at the '
+                             'end of training.')
     parser.add_argument('config', action='store',
                         choices=None,
                         help='A YAML configuration file specifying the '
@@ -176,7 +182,7 @@ def make_argument_parser():
 
 
 def train(config, level_name=None, timestamp=None, time_budget=None,
-          verbose_logging=None, debug=None):
+          verbose_logging=None, debug=None, profile=None):
     """
     Trains a given YAML file.
 
@@ -202,6 +208,26 @@ def train(config, level_name=None, timestamp=None, time_budget=None,
     debug : bool, optional
         Display any DEBUG-level log messages,
         False by default.
+    profile : str, optional
+        If specified, the Theano functions compiled by pylearn2 are
+        profiled, and the report is written to this file at the end
+        of training.
+    """
+    if profile is not None:
+        compile_utils.start_profiling()
+    try:
+        _train(config, level_name, timestamp, time_budget, verbose_logging,
+               debug)
+    finally:
+        if profile is not None:
+            compile_utils.write_profile_report(profile)
+            compile_utils.stop_profiling()
+
+
+def _train(config, level_name, timestamp, time_budget, verbose_logging,
+           debug):
+    """
+    Trains a given YAML file, see `train`.
     """
     train_obj = serial.load_train_file(config)
     try:
@@ -258,4 +284,4 @@ if __name__ == "__main__":
     parser = make_argument_parser()
     args = parser.parse_args()
     train(args.config, args.level_name, args.timestamp, args.time_budget,
-          args.verbose_logging, args.debug)
+          args.verbose_logging, args.debug, args.profile)
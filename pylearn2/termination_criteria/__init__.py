@@ -55,14 +55,25 @@ class MonitorBased(TerminationCriterion):
         Name of the channel to examine. If None and the monitor
         has only one channel, this channel will be used; otherwise, an
         error will be raised.
+    full_evaluation_std_errs : float, optional
+        Only used if the dataset of the channel is subsampled by the
+        monitor (see the `subsample` argument of `Monitor.add_dataset`).
+        If specified, the channel is evaluated on the whole dataset
+        whenever its subsampled value is less than this many standard
+        errors above the best value so far, i.e. when it may be an
+        improvement, and the criterion uses the exact value. Otherwise,
+        the subsampled values are used as they are. The records of the
+        channel are not modified.
     """
 
-    def __init__(self, prop_decrease=.01, N=5, channel_name=None):
+    def __init__(self, prop_decrease=.01, N=5, channel_name=None,
+                 full_evaluation_std_errs=None):
         self._channel_name = channel_name
         self.prop_decrease = prop_decrease
         self.N = N
         self.countdown = N
         self.best_value = np.inf
+        self.full_evaluation_std_errs = full_evaluation_std_errs
 
     def continue_learning(self, model):
         """
@@ -86,21 +97,35 @@ class MonitorBased(TerminationCriterion):
         # available. However, if the monitor has multiple channels, leaving
         # the channel_name unspecified will raise an error.
         if self._channel_name is None:
-            v = monitor.channels['objective'].val_record
+            channel = monitor.channels['objective']
         else:
-            v = monitor.channels[self._channel_name].val_record
+            channel = monitor.channels[self._channel_name]
+        value = channel.val_record[-1]
+
+        # Get the exact value of a subsampled channel if its estimate is
+        # close enough to the best value to possibly be an improvement
+        full_evaluation_std_errs = getattr(self, 'full_evaluation_std_errs',
+                                           None)
+        if (full_evaluation_std_errs is not None and
+                monitor.is_subsampled(channel.dataset)):
+            std_err = channel.std_err_record[-1]
+            if (not np.isfinite(std_err) or
+                    value - full_evaluation_std_errs * std_err <
+                    self.best_value):
+                value = monitor.evaluate_full([channel.dataset])[
+                    channel.name]
 
         # The countdown decreases every time the termination criterion is
         # called unless the channel value is lower than the best value times
         # the prop_decrease factor, in which case the countdown is reset to N
         # and the best value is updated
-        if v[-1] < (1. - self.prop_decrease) * self.best_value:
+        if value < (1. - self.prop_decrease) * self.best_value:
             self.countdown = self.N
         else:
             self.countdown = self.countdown - 1
 
-        if v[-1] < self.best_value:
-            self.best_value = v[-1]
+        if value < self.best_value:
+            self.best_value = value
 
         # The optimization continues until the countdown has reached 0,
         # meaning that N epochs have passed without the model improving
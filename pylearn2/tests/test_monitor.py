@@ -18,7 +18,8 @@ from pylearn2.monitor import _err_ambig_data
 from pylearn2.monitor import _err_no_data
 from pylearn2.monitor import Monitor
 from pylearn2.monitor import push_monitor
-from pylearn2.space import VectorSpace
+from pylearn2.space import NullSpace, VectorSpace
+from pylearn2.termination_criteria import MonitorBased
 from pylearn2.testing.datasets import ArangeDataset
 from pylearn2.training_algorithms.default import DefaultTrainingAlgorithm
 from pylearn2.utils.iteration import _iteration_schemes, has_uniform_batch_size
@@ -109,6 +110,102 @@ def test_channel_scaling_sequential():
     # Specifying both, uneven split, non-exhaustive
     yield channel_scaling_checker, 10, 'sequential', 3, 3
 
+def test_subsample():
+    # Tests the evaluation of channels on a subset of a dataset
+    def subsample_checker(rotate):
+        num_features = 2
+        monitor = Monitor(DummyModel(num_features))
+        dataset = DummyDataset(100, num_features)
+        monitor.add_dataset(dataset=dataset, mode='sequential',
+                            batch_size=10, subsample=30,
+                            rotate_subsample=rotate)
+        assert monitor.is_subsampled(dataset)
+        vis_batch = T.matrix()
+        data_specs = (monitor.model.get_input_space(),
+                      monitor.model.get_input_source())
+        monitor.add_channel(name='mean', ipt=vis_batch,
+                            val=vis_batch.mean(), dataset=dataset,
+                            data_specs=data_specs)
+        monitor()
+        monitor.report_epoch()
+        monitor()
+        channel = monitor.channels['mean']
+        X = dataset.get_design_matrix()
+        assert len(channel.std_err_record) == 2
+        assert all(0 < std_err < X.std() for std_err in
+                   channel.std_err_record)
+        assert (channel.val_record[0] != channel.val_record[1]) == rotate
+
+        val_record = list(channel.val_record)
+        values = monitor.evaluate_full()
+        assert list(values.keys()) == ['mean']
+        assert np.allclose(values['mean'], X.mean())
+        # The records keep the subsampled values
+        assert list(channel.val_record) == val_record
+        assert channel.std_err_record[-1] > 0.
+
+        # Termination criteria can use the full value
+        monitor.model.monitor = monitor
+        criterion = MonitorBased(channel_name='mean',
+                                 full_evaluation_std_errs=np.inf)
+        criterion.continue_learning(monitor.model)
+        assert np.allclose(criterion.best_value, X.mean())
+        assert list(channel.val_record) == val_record
+
+    yield subsample_checker, False
+    yield subsample_checker, True
+
+
+def test_async():
+    # Tests that the channels computed by the worker process use the
+    # parameters and counters of the snapshot
+    model = DummyModel(1)
+    param = sharedX(1.)
+    model._params = [param]
+    monitor = Monitor(model)
+    dataset = DummyDataset(10, 1)
+    monitor.add_dataset(dataset=dataset, mode='sequential', batch_size=5)
+    monitor.add_channel(name='param', ipt=None, val=param,
+                        data_specs=(NullSpace(), ''), dataset=dataset)
+    monitor.start_worker()
+    try:
+        monitor.call_async()
+        param.set_value(np.cast[param.dtype](2.))
+        monitor.report_epoch()
+        monitor.call_async()
+        param.set_value(np.cast[param.dtype](3.))
+        monitor.synchronize()
+        channel = monitor.channels['param']
+        assert channel.val_record == [1., 2.]
+        assert channel.epoch_record == [0, 1]
+        monitor()
+        assert channel.val_record == [1., 2., 3.]
+    finally:
+        monitor.stop_worker()
+
+
+def test_async_worker_died():
+    # Tests that a dead monitoring worker is reported as such
+    model = DummyModel(1)
+    param = sharedX(1.)
+    model._params = [param]
+    monitor = Monitor(model)
+    dataset = DummyDataset(10, 1)
+    monitor.add_dataset(dataset=dataset, mode='sequential', batch_size=5)
+    monitor.add_channel(name='param', ipt=None, val=param,
+                        data_specs=(NullSpace(), ''), dataset=dataset)
+    monitor.start_worker()
+    monitor._worker.terminate()
+    monitor._worker.join()
+    try:
+        monitor.call_async()
+    except RuntimeError as e:
+        assert 'monitoring worker died' in str(e)
+    else:
+        raise AssertionError("call_async did not fail.")
+    monitor.stop_worker()
+
+
 def test_counting():
     BATCH_SIZE = 2
     BATCHES = 3
@@ -5,6 +5,10 @@ __license__ = "3-clause BSD"
 __maintainer__ = "LISA Lab"
 __email__ = "pylearn-dev@googlegroups"
 
+import json
+import os
+import shutil
+import tempfile
 from types import MethodType
 import numpy as np
 from pylearn2.monitor import Monitor
@@ -16,6 +20,7 @@ from pylearn2.training_algorithms.training_algorithm import TrainingAlgorithm
 from pylearn2.train_extensions import TrainExtension
 from pylearn2.models.mlp import MLP, Softmax
 from pylearn2.training_algorithms.sgd import SGD
+from pylearn2.training_algorithms.learning_rule import Momentum
 from pylearn2.termination_criteria import EpochCounter
 
 class DummyModel(Model):
@@ -114,3 +119,108 @@ def test_serialization_guard():
     except RuntimeError:
         return
     assert False # train did not complain, this is a bug
+
+
+class Interrupt(Exception):
+    pass
+
+
+class InterruptAfter(object):
+    """
+    Update callback simulating a job killed after some number of batches
+    """
+
+    def __init__(self, num_batches):
+        self.num_batches = num_batches
+
+    def __call__(self, algorithm):
+        if algorithm.monitor.get_batches_seen() == self.num_batches:
+            raise Interrupt()
+
+
+def test_resume_mid_epoch():
+
+    # tests that a resumable job interrupted in the middle of an epoch
+    # ends with the same parameters as a job that was not interrupted
+
+    rng = np.random.RandomState([2015, 4, 27])
+    dataset = DenseDesignMatrix(X=rng.normal(size=(12, 3)),
+                                y=rng.normal(size=(12, 2)))
+
+    def make_train(save_path, seed, update_callbacks=None):
+        model = MLP(layers=[Softmax(layer_name='y', n_classes=2,
+                                    irange=.5)],
+                    nvis=3, seed=seed)
+        algorithm = SGD(batch_size=2, learning_rate=0.1,
+                        learning_rule=Momentum(.9),
+                        train_iteration_mode='shuffled_sequential',
+                        termination_criterion=EpochCounter(max_epochs=2),
+                        update_callbacks=update_callbacks)
+        return Train(dataset=dataset, model=model, algorithm=algorithm,
+                     save_path=save_path, save_freq=1, resumable=True,
+                     mid_epoch_save_freq=4)
+
+    save_dir = tempfile.mkdtemp()
+    try:
+        train = make_train(os.path.join(save_dir, 'reference.pkl'), 1)
+        train.main_loop()
+        expected = train.model.get_param_values()
+
+        save_path = os.path.join(save_dir, 'interrupted.pkl')
+        train = make_train(save_path, 1, [InterruptAfter(9)])
+        try:
+            train.main_loop()
+        except Interrupt:
+            pass
+        else:
+            assert False
+
+        # The model is loaded from the checkpoint saved after 8 batches,
+        # in the middle of the second epoch
+        train = make_train(save_path, 2)
+        train.main_loop()
+        assert train.model.monitor.get_batches_seen() == 12
+        for value, expected_value in zip(train.model.get_param_values(),
+                                         expected):
+            assert np.allclose(value, expected_value)
+    finally:
+        shutil.rmtree(save_dir)
+
+
+def test_phase_timers():
+
+    # tests that the times of the phases of the main loop are recorded in
+    # the monitor and in the trace file
+
+    rng = np.random.RandomState([2015, 4, 28])
+    dataset = DenseDesignMatrix(X=rng.normal(size=(12, 3)),
+                                y=rng.normal(size=(12, 2)))
+    model = MLP(layers=[Softmax(layer_name='y', n_classes=2, irange=.5)],
+                nvis=3)
+    algorithm = SGD(batch_size=2, learning_rate=0.1,
+                    monitoring_dataset={'valid': dataset},
+                    termination_criterion=EpochCounter(max_epochs=2))
+    save_dir = tempfile.mkdtemp()
+    try:
+        trace_path = os.path.join(save_dir, 'trace.json')
+        train = Train(dataset=dataset, model=model, algorithm=algorithm,
+                      trace_path=trace_path)
+        train.main_loop()
+
+        channels = train.model.monitor.channels
+        for name in ['phase_seconds_train', 'phase_seconds_train_fetch',
+                     'phase_seconds_train_sgd_update',
+                     'phase_seconds_monitor_valid']:
+            assert name in channels
+        # Nothing is trained before the first monitoring step
+        assert channels['phase_seconds_train'].val_record[0] == 0.
+        assert channels['phase_seconds_train'].val_record[-1] > 0.
+        assert channels['phase_seconds_monitor_valid'].val_record[-1] > 0.
+
+        with open(trace_path) as f:
+            events = json.loads(f.read().rstrip().rstrip(',') + ']')
+        paths = [event['args']['path'] for event in events]
+        assert paths.count('train/sgd_update') == 12
+        assert paths.count('train') == 2
+    finally:
+        shutil.rmtree(save_dir)
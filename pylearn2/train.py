@@ -5,21 +5,43 @@ __credits__ = ["Ian Goodfellow"]
 __license__ = "3-clause BSD"
 __maintainer__ = "LISA Lab"
 __email__ = "pylearn-dev@googlegroups"
+import copy
 from datetime import datetime
 import os
 import sys
 import logging
 import warnings
+from theano.compat import six
+from pylearn2.compat import OrderedDict
 from pylearn2.utils import serial
 from pylearn2.utils.string_utils import preprocess
 from pylearn2.monitor import Monitor
 from pylearn2.space import NullSpace
-from pylearn2.utils.timing import log_timing, total_seconds
+from pylearn2.utils.timing import (log_timing, total_seconds, PhaseTimer,
+                                   NullPhaseTimer)
 from pylearn2.utils import sharedX
+from pylearn2.utils import channel_history
+from pylearn2.utils import compile as compile_utils
+from pylearn2.utils import param_checkpoint
+from pylearn2.utils.channel_history import history_path
 
 
 log = logging.getLogger(__name__)
 
+# The phases of the main loop timed when Train.phase_timers is True, by
+# path (see pylearn2.utils.timing.PhaseTimer). The monitoring of each
+# dataset is timed as a child of the 'monitor' phase.
+TIMED_PHASES = ['train',
+                'train/fetch',
+                'train/fetch/convert',
+                'train/on_load_batch',
+                'train/stage',
+                'train/sgd_update',
+                'train/update_callbacks',
+                'monitor',
+                'extensions',
+                'save']
+
 
 class Train(object):
     """
@@ -52,11 +74,102 @@ class Train(object):
         If `True`, will save the model to save_path even if there is
         already something there. Otherwise, will raise an error if the
         `save_path` is already occupied.
+    async_monitoring : bool, optional
+        If `True`, after the first monitoring step, the monitoring channels
+        are computed by a worker process on a snapshot of the model (see
+        `Monitor.start_worker`) while the next epoch of training runs. The
+        values are recorded with the counters of the snapshot when they
+        are ready, so the extensions and the termination criteria may see
+        the values of the previous monitoring step, unless they wait for
+        the current ones with `Monitor.synchronize`.
+        `MonitorBasedSaveBest` keeps a copy of the parameters of each
+        pending step instead, and looks at its value at the next
+        monitoring step or save of the model, so the value of the last
+        monitoring step is only taken into account if the model is saved
+        at the end of training (`save_freq` > 0). Only supported on CPU.
+    monitor_history : bool, optional
+        If `True`, the monitor appends the values of its channels at each
+        monitoring step to a log beside `save_path` (see
+        `Monitor.set_history_path`), which `print_monitor.py` and
+        `plot_monitor.py` can read while the job is running.
+    background_save : bool, optional
+        If `True`, the model is saved by a `serial.CheckpointWriter`: the
+        training loop only waits for an in-memory snapshot of the model,
+        which is pickled and written to `save_path` on a background
+        thread. The pending writes are flushed at the end of `main_loop`.
+    resumable : bool, optional
+        If `True`, each save also writes the state of the algorithm (see
+        `TrainingAlgorithm.get_state`) and the plain attributes of the
+        extensions (see `serial.plain_state`) beside `save_path`. If
+        these files exist when training starts, the model is loaded from
+        `save_path` instead of using `model`, and training resumes
+        exactly where it stopped, without monitoring the model again
+        first.
+    mid_epoch_save_freq : int, optional
+        If specified, the model is also saved every `mid_epoch_save_freq`
+        batches during the epochs, so that a resumable job loses at most
+        that many batches when it is interrupted. Requires an algorithm
+        with `update_callbacks`, like SGD.
+    param_checkpoint : bool, optional
+        If `True`, each save also writes the parameters of the model to
+        `<save_path>_params.npz` (see `pylearn2.utils.param_checkpoint`),
+        which `serial.load` turns back into the model much faster than
+        the pickle, since the monitor and its history are not in it.
+    phase_timers : bool, optional
+        If `True`, the time spent in each phase of the main loop is
+        measured (see `TIMED_PHASES`): fetching the batches, converting
+        them, the `on_load_batch` callbacks, copying them to shared
+        variables (see the `stage_batches` argument of SGD), `sgd_update`
+        and the update callbacks of SGD, the monitoring of each dataset,
+        the extensions and saving. The totals since the previous
+        monitoring step are recorded in `phase_seconds_*` monitoring
+        channels (for the phases that run after the monitor, these are the
+        totals of the previous epoch), which tell whether training is bound
+        by the data, the computation or the callbacks.
+    trace_path : str, optional
+        If specified, implies `phase_timers`, and each timed phase is also
+        written to this file in the Chrome trace event format.
+    profile_path : str, optional
+        If specified, the Theano functions compiled during `main_loop`
+        (the training function of the algorithm, the monitoring functions,
+        ...) are compiled with profiling, and a report of the ops taking
+        the most time and memory is written to this file at the end of
+        `main_loop` (see `pylearn2.utils.compile.write_profile_report`).
     """
 
     def __init__(self, dataset, model, algorithm=None, save_path=None,
-                 save_freq=0, extensions=None, allow_overwrite=True):
+                 save_freq=0, extensions=None, allow_overwrite=True,
+                 async_monitoring=False, monitor_history=False,
+                 background_save=False, resumable=False,
+                 mid_epoch_save_freq=None, param_checkpoint=False,
+                 phase_timers=False, trace_path=None, profile_path=None):
         self.allow_overwrite = allow_overwrite
+        self.async_monitoring = async_monitoring
+        self.monitor_history = monitor_history
+        if background_save:
+            self.checkpoint_writer = serial.CheckpointWriter()
+            self.state_writer = serial.CheckpointWriter()
+        else:
+            self.checkpoint_writer = None
+            self.state_writer = None
+        self.resumable = resumable
+        self.mid_epoch_save_freq = mid_epoch_save_freq
+        self.param_checkpoint = param_checkpoint
+        self.phase_timers = phase_timers or trace_path is not None
+        if self.phase_timers:
+            if trace_path is not None:
+                trace_path = preprocess(trace_path)
+            self.phase_timer = PhaseTimer(trace_path)
+        else:
+            self.phase_timer = NullPhaseTimer()
+        # Shared variables holding the times of the phases, by path
+        self.phase_seconds = OrderedDict()
+        if profile_path is not None:
+            profile_path = preprocess(profile_path)
+        self.profile_path = profile_path
+        # The training state loaded from the last checkpoint, if resuming
+        self._resume_state = None
+        self._old_monitor = None
         self.first_save = True
         self.dataset = dataset
         self.model = model
@@ -115,17 +228,150 @@ class Train(object):
         main loop, so you need only call it if you're using a driver
         script that replaces the main loop with something else.
         """
+        if getattr(self, 'resumable', False):
+            self._load_checkpoint()
         self.model.monitor = Monitor.get_monitor(self.model)
         self.model.monitor.time_budget_exceeded = False
+        mid_epoch_save_freq = getattr(self, 'mid_epoch_save_freq', None)
+        if mid_epoch_save_freq:
+            if not hasattr(self.algorithm, 'update_callbacks'):
+                raise ValueError("mid_epoch_save_freq requires an algorithm "
+                                 "with update_callbacks.")
+            if not any(isinstance(callback, _MidEpochSave)
+                       for callback in self.algorithm.update_callbacks):
+                self.algorithm.update_callbacks.append(
+                    _MidEpochSave(self, mid_epoch_save_freq))
         if self.algorithm is not None:
             self.algorithm.setup(model=self.model, dataset=self.dataset)
+        if getattr(self, 'phase_timers', False):
+            if self.algorithm is not None:
+                self.algorithm.phase_timer = self.phase_timer
+            self.model.monitor.set_phase_timer(self.phase_timer)
+        if getattr(self, 'monitor_history', False):
+            save_path = getattr(self, 'save_path', None)
+            if save_path is None:
+                warnings.warn('monitor_history requires a save_path, the '
+                              'history of the monitor will not be logged.')
+            else:
+                self.model.monitor.set_history_path(history_path(save_path))
+        resume_state = getattr(self, '_resume_state', None)
+        if (resume_state is not None and self.algorithm is not None and
+                resume_state['algorithm'] is not None):
+            self.algorithm.set_state(resume_state['algorithm'])
         self.setup_extensions()
+        if resume_state is not None:
+            for extension, extension_state in zip(self.extensions,
+                                                  resume_state['extensions']):
+                serial.set_plain_state(extension, extension_state)
 
         # Model.modify_updates is used by the training algorithm to
         # enforce constraints after each step of learning. Here we
         # make sure the constraints are enforced from the start.
         self.model.enforce_constraints()
 
+    def _load_checkpoint(self):
+        """
+        Loads the model and the training state saved by a previous run of
+        this job, if any.
+        """
+        self._resume_state = None
+        save_path = getattr(self, 'save_path', None)
+        if save_path is None:
+            warnings.warn('resumable requires a save_path, training will '
+                          'not be resumed.')
+            return
+        state_path = training_state_path(save_path)
+        if not (os.path.exists(save_path) and os.path.exists(state_path)):
+            return
+        with log_timing(log, 'Loading checkpoint ' + save_path):
+            model = serial.load(save_path)
+            state = serial.load(state_path)
+        old_monitor = model.monitor
+        if state['batches_seen'] != old_monitor.get_batches_seen():
+            # The job died between the two writes
+            log.warning('The training state in %s does not match the model '
+                        'in %s, starting a new training run.' %
+                        (state_path, save_path))
+            return
+        log.info('Resuming training after %d batches.' %
+                 state['batches_seen'])
+
+        # The channels of an unpickled monitor can not be computed, so the
+        # algorithm sets up a new one that takes over the counters and the
+        # records of the old one
+        del model.monitor
+        monitor = Monitor.get_monitor(model)
+        monitor._num_batches_seen = old_monitor._num_batches_seen
+        monitor._examples_seen = old_monitor._examples_seen
+        monitor._epochs_seen = old_monitor._epochs_seen
+        monitor.t0 = old_monitor.t0
+        monitor.on_channel_conflict = 'copy_history'
+        monitor.channels = copy.copy(old_monitor.channels)
+        for channel in monitor.channels.values():
+            channel.prereqs = None
+        self.model = model
+        self._old_monitor = old_monitor
+        self._resume_state = state
+        self.first_save = False
+
+    def _restore_monitor_records(self):
+        """
+        Gives the channels of a resumed monitor all the records of the
+        monitor of the checkpoint, and drops the channels that were not
+        set up again.
+        """
+        monitor = self.model.monitor
+        for name in list(monitor.channels.keys()):
+            channel = monitor.channels[name]
+            if not hasattr(channel, 'val'):
+                del monitor.channels[name]
+            elif name in self._old_monitor.channels:
+                old_channel = self._old_monitor.channels[name]
+                for field in channel_history.RECORD_DTYPES:
+                    setattr(channel, field, getattr(old_channel, field))
+        monitor.on_channel_conflict = 'error'
+        if getattr(monitor, 'history_path', None) is not None:
+            monitor.set_history_path(monitor.history_path)
+        self._old_monitor = None
+
+    def run_initial_monitoring(self):
+        """
+        Runs the monitor and the callbacks of the extensions before the
+        first epoch, unless training resumes from a checkpoint, which was
+        saved after they ran.
+
+        Returns
+        -------
+        continue_learning : bool
+            If `False`, signals that at least one train
+            extension wants to stop learning.
+        """
+        if getattr(self, '_resume_state', None) is not None:
+            self._restore_monitor_records()
+            self._resume_state = None
+            return True
+        return self.run_callbacks_and_monitoring()
+
+    def get_training_state(self):
+        """
+        Returns the state that `resumable` jobs save beside the model.
+
+        Returns
+        -------
+        state : dict
+            The number of batches seen, which identifies the checkpoint of
+            the model the state goes with, the state of the algorithm and
+            the plain attributes of the extensions.
+        """
+        if self.algorithm is None:
+            algorithm_state = None
+        else:
+            algorithm_state = self.algorithm.get_state()
+        return {'batches_seen': self.model.monitor.get_batches_seen(),
+                'algorithm': algorithm_state,
+                'extensions': [serial.plain_state(extension)
+                               for extension in self.extensions]}
+
     def main_loop(self, time_budget=None):
         """
         Repeatedly runs an epoch of the training algorithm, runs any
@@ -137,10 +383,30 @@ class Train(object):
             The maximum number of seconds before interrupting
             training. Default is `None`, no time limit.
         """
+        profile_path = getattr(self, 'profile_path', None)
+        if profile_path is None:
+            self._main_loop(time_budget)
+            return
+        # Profiling may already have been started by the caller, e.g. the
+        # train.py script, which then also reports the other functions
+        started_profiling = not compile_utils.profiling_enabled()
+        compile_utils.start_profiling()
+        try:
+            self._main_loop(time_budget)
+        finally:
+            compile_utils.write_profile_report(profile_path)
+            if started_profiling:
+                compile_utils.stop_profiling()
+
+    def _main_loop(self, time_budget):
+        """
+        Runs the main loop, see `main_loop`.
+        """
         t0 = datetime.now()
         self.setup()
         if self.algorithm is None:
-            extension_continue = self.run_callbacks_and_monitoring()
+            extension_continue = self.run_initial_monitoring()
+            self.start_monitoring_worker()
             # First check if the model is already beyond the stop criteria of
             # training, if so, just return directly.
             continue_learning = (self.model.continue_learning() and
@@ -150,7 +416,8 @@ class Train(object):
                 if self.exceeded_time_budget(t0, time_budget):
                     break
 
-                rval = self.model.train_all(dataset=self.dataset)
+                with self.phase_timer.phase('train'):
+                    rval = self.model.train_all(dataset=self.dataset)
                 if rval is not None:
                     raise ValueError(
                         "Model.train_all should not return anything. Use "
@@ -198,7 +465,10 @@ already been reported."""
                     val=self.total_seconds,
                     data_specs=(NullSpace(), ''),
                     dataset=self.model.monitor._datasets[0])
-            extension_continue = self.run_callbacks_and_monitoring()
+                if getattr(self, 'phase_timers', False):
+                    self.add_phase_channels()
+            extension_continue = self.run_initial_monitoring()
+            self.start_monitoring_worker()
 
             # First check if the model is already beyond the stop criteria of
             # training, if so, just return directly.
@@ -217,7 +487,8 @@ already been reported."""
                         log, None, final_msg='Time this epoch:',
                         callbacks=[self.training_seconds.set_value]
                     ):
-                        rval = self.algorithm.train(dataset=self.dataset)
+                        with self.phase_timer.phase('train'):
+                            rval = self.algorithm.train(dataset=self.dataset)
                     if rval is not None:
                         raise ValueError(
                             "TrainingAlgorithm.train should not return "
@@ -237,10 +508,58 @@ already been reported."""
                 )
                 assert continue_learning in [True, False, 0, 1]
 
+        self.model.monitor.stop_worker()
         self.model.monitor.training_succeeded = True
 
         if self.save_freq > 0:
             self.save()
+        # Wait for the checkpoints written in the background, including
+        # those of the extensions
+        serial.flush_checkpoint_writers()
+        self.phase_timer.close()
+
+    def add_phase_channels(self):
+        """
+        Adds a monitoring channel for each of the `TIMED_PHASES`, and for
+        the monitoring of each dataset.
+        """
+        monitor = self.model.monitor
+        paths = []
+        for path in TIMED_PHASES:
+            paths.append(path)
+            if path == 'monitor':
+                paths.extend('monitor/' + monitor.dataset_phase_name(index)
+                             for index in range(len(monitor._datasets)))
+        for path in paths:
+            shared = sharedX(value=0, name='phase_seconds_' +
+                             path.replace('/', '_'))
+            shared.__doc__ = """\
+The number of seconds spent in the %s phase of the main loop since the
+previous monitoring step.""" % path
+            monitor.add_channel(name=shared.name,
+                                ipt=None,
+                                val=shared,
+                                data_specs=(NullSpace(), ''),
+                                dataset=monitor._datasets[0])
+            self.phase_seconds[path] = shared
+
+    def _publish_phase_times(self, timer):
+        """
+        Sets the phase_seconds channels to the times of the phases since
+        the previous monitoring step.
+        """
+        totals = timer.pop_totals()
+        for path, shared in six.iteritems(getattr(self, 'phase_seconds',
+                                                  {})):
+            shared.set_value(totals.get(path, 0.))
+
+    def start_monitoring_worker(self):
+        """
+        Starts the worker process of the monitor if asynchronous
+        monitoring was requested.
+        """
+        if self.async_monitoring:
+            self.model.monitor.start_worker()
 
     def run_callbacks_and_monitoring(self):
         """
@@ -252,26 +571,49 @@ already been reported."""
             If `False`, signals that at least one train
             extension wants to stop learning.
         """
-        self.model.monitor()
+        timer = getattr(self, 'phase_timer', None)
+        if timer is None:
+            timer = NullPhaseTimer()
+        self._publish_phase_times(timer)
+        with timer.phase('monitor'):
+            if getattr(self, 'async_monitoring', False):
+                self.model.monitor.call_async()
+            else:
+                self.model.monitor()
         continue_learning = True
-        for extension in self.extensions:
-            try:
-                extension.on_monitor(self.model, self.dataset, self.algorithm)
-            except TypeError:
-                logging.warning('Failure during callback ' + str(extension))
-                raise
-            # We catch an exception here instead of relying on return
-            # values for backward compatibility. Lots of extensions
-            # exist that don't return anything, currently.
-            except StopIteration:
-                log.info("Extension requested training halt.")
-                continue_learning = False
+        with timer.phase('extensions'):
+            for extension in self.extensions:
+                try:
+                    extension.on_monitor(self.model, self.dataset,
+                                         self.algorithm)
+                except TypeError:
+                    logging.warning('Failure during callback ' +
+                                    str(extension))
+                    raise
+                # We catch an exception here instead of relying on return
+                # values for backward compatibility. Lots of extensions
+                # exist that don't return anything, currently.
+                except StopIteration:
+                    log.info("Extension requested training halt.")
+                    continue_learning = False
         return continue_learning
 
     def save(self):
         """Saves the model."""
-        #TODO-- save state of training algorithm so training can be
-        # resumed after a crash
+        timer = getattr(self, 'phase_timer', None)
+        if timer is None:
+            timer = NullPhaseTimer()
+        with timer.phase('save'):
+            self._save()
+
+    def _save(self):
+        """
+        Saves the model, see `save`.
+        """
+        # Do not save the model without the results of pending asynchronous
+        # monitoring steps
+        if hasattr(self.model, 'monitor'):
+            self.model.monitor.synchronize()
         for extension in self.extensions:
             extension.on_save(self.model, self.dataset, self.algorithm)
         if self.save_path is not None:
@@ -285,12 +627,76 @@ already been reported."""
                 try:
                     # Make sure that saving does not serialize the dataset
                     self.dataset._serialization_guard = SerializationGuard()
-                    serial.save(self.save_path, self.model,
-                                on_overwrite='backup')
+                    checkpoint_writer = getattr(self, 'checkpoint_writer',
+                                                None)
+                    if checkpoint_writer is not None:
+                        # The snapshot is taken here, under the guard
+                        checkpoint_writer.save(self.save_path, self.model,
+                                               on_overwrite='backup')
+                    else:
+                        serial.save(self.save_path, self.model,
+                                    on_overwrite='backup')
                 finally:
                     self.dataset._serialization_guard = None
+                if getattr(self, 'param_checkpoint', False):
+                    param_checkpoint.save_params(
+                        param_checkpoint.params_path(self.save_path),
+                        self.model)
+                if getattr(self, 'resumable', False):
+                    self._save_training_state()
             self.first_save = False
 
+    def _save_training_state(self):
+        """
+        Saves the training state of a resumable job beside the model.
+        """
+        state = self.get_training_state()
+        state_path = training_state_path(self.save_path)
+        state_writer = getattr(self, 'state_writer', None)
+        if state_writer is not None:
+            state_writer.save(state_path, state)
+        else:
+            serial.save(state_path, state, on_overwrite='backup')
+
+
+def training_state_path(save_path):
+    """
+    Returns the path of the training state of a resumable job saving its
+    model to `save_path`.
+
+    Parameters
+    ----------
+    save_path : str
+        The path the model is saved to.
+
+    Returns
+    -------
+    path : str
+        `save_path` with its extension replaced by `_training_state.pkl`.
+    """
+    return os.path.splitext(save_path)[0] + '_training_state.pkl'
+
+
+class _MidEpochSave(object):
+    """
+    An update callback saving the model every `freq` batches.
+
+    Parameters
+    ----------
+    train : Train
+        The main loop.
+    freq : int
+        The number of batches between saves.
+    """
+
+    def __init__(self, train, freq):
+        self.train = train
+        self.freq = freq
+
+    def __call__(self, algorithm):
+        if self.train.model.monitor.get_batches_seen() % self.freq == 0:
+            self.train.save()
+
 
 class SerializationGuard(object):
     """
@@ -13,6 +13,7 @@ import os.path
 import socket
 import numpy
 np = numpy
+from theano.compat.six.moves import xrange
 from pylearn2.train_extensions import TrainExtension
 import theano
 import theano.tensor as T
@@ -122,15 +123,23 @@ class MonitorBasedSaveBest(TrainExtension):
     tag_key : str, optional
         A unique key to use for storing diagnostic information in
         `model.tag`. If `None`, use the class name (default).
+    background_save : bool, optional
+        If `True`, the best model is written to `save_path` on a background
+        thread by a `serial.CheckpointWriter`. Defaults to `False`.
     """
     def __init__(self, channel_name, save_path=None, store_best_model=False,
-                 start_epoch=0, higher_is_better=False, tag_key=None):
+                 start_epoch=0, higher_is_better=False, tag_key=None,
+                 background_save=False):
         self.channel_name = channel_name
         assert save_path is not None or store_best_model, (
             "Either save_path must be defined or store_best_model must be " +
             "True. (Or both.)")
         self.save_path = save_path
         self.store_best_model = store_best_model
+        if background_save:
+            self.checkpoint_writer = serial.CheckpointWriter()
+        else:
+            self.checkpoint_writer = None
         self.start_epoch = start_epoch
         self.higher_is_better = higher_is_better
         if higher_is_better:
@@ -191,21 +200,106 @@ class MonitorBasedSaveBest(TrainExtension):
             Not used
         """
         monitor = model.monitor
-        channels = monitor.channels
-        channel = channels[self.channel_name]
+        # With asynchronous monitoring, the value of the current parameters
+        # is computed while training goes on. Keep a copy of them, in case
+        # this value turns out to be the best, and only wait for the values
+        # of the earlier monitoring steps, which are usually done by now.
+        monitor.synchronize(max_pending=1)
+        if monitor.is_pending():
+            if getattr(self, '_pending_params', None) is None:
+                self._pending_params = []
+            self._pending_params.append((monitor.get_batches_seen(),
+                                         model.get_param_values()))
+        self._check_new_values(model)
+
+    def on_save(self, model, dataset, algorithm):
+        """
+        Looks at the values recorded since the last monitoring step, which
+        may be late with asynchronous monitoring.
+
+        Parameters
+        ----------
+        model : pylearn2.models.model.Model
+            model.monitor must contain a channel with name given by
+            self.channel_name
+        dataset : pylearn2.datasets.dataset.Dataset
+            Not used
+        algorithm : TrainingAlgorithm
+            Not used
+        """
+        self._check_new_values(model)
+
+    def _check_new_values(self, model):
+        """
+        Looks whether the values of the channel recorded since the last
+        call are better than the best one so far, and if so, saves the
+        model with the parameters they were computed with.
+
+        Parameters
+        ----------
+        model : pylearn2.models.model.Model
+            The model being trained.
+        """
+        monitor = model.monitor
+        channel = monitor.channels[self.channel_name]
         val_record = channel.val_record
-        new_cost = val_record[-1]
+        first = getattr(self, '_num_values_seen', None)
+        if first is None or first > len(val_record):
+            first = max(len(val_record) - 1, 0)
+        pending_params = getattr(self, '_pending_params', None) or []
 
-        if self.coeff * new_cost < self.coeff * self.best_cost and \
-           monitor._epochs_seen >= self.start_epoch:
-            self.best_cost = new_cost
-            # Update the tag of the model object before saving it.
-            self._update_tag(model)
-            if self.store_best_model:
+        for index in xrange(first, len(val_record)):
+            # The parameters of asynchronous monitoring steps were kept
+            # by on_monitor, the others are the current ones
+            params = None
+            epochs_seen = monitor.get_epochs_seen()
+            if pending_params:
+                batches_seen = channel.batch_record[index]
+                while (pending_params and
+                       pending_params[0][0] <= batches_seen):
+                    param_batches_seen, param_values = pending_params.pop(0)
+                    if param_batches_seen == batches_seen:
+                        params = param_values
+                        epochs_seen = channel.epoch_record[index]
+            new_cost = val_record[index]
+            if self.coeff * new_cost < self.coeff * self.best_cost and \
+               epochs_seen >= self.start_epoch:
+                self.best_cost = new_cost
+                self._save_best(model, params)
+        self._num_values_seen = len(val_record)
+
+    def _save_best(self, model, params=None):
+        """
+        Stores and/or saves the model as the best one.
+
+        Parameters
+        ----------
+        model : pylearn2.models.model.Model
+            The model being trained.
+        params : list, optional
+            The values of the parameters of the best model, if they are
+            not the current ones.
+        """
+        # Update the tag of the model object before saving it.
+        self._update_tag(model)
+        if params is not None:
+            best_model = deepcopy(model)
+            best_model.set_param_values(params)
+        else:
+            best_model = model
+        if self.store_best_model:
+            if best_model is model:
                 self.best_model = deepcopy(model)
-            if self.save_path is not None:
-                with log_timing(log, 'Saving to ' + self.save_path):
-                    serial.save(self.save_path, model, on_overwrite='backup')
+            else:
+                self.best_model = best_model
+        if self.save_path is not None:
+            with log_timing(log, 'Saving to ' + self.save_path):
+                if getattr(self, 'checkpoint_writer', None) is not None:
+                    self.checkpoint_writer.save(self.save_path, best_model,
+                                                on_overwrite='backup')
+                else:
+                    serial.save(self.save_path, best_model,
+                                on_overwrite='backup')
 
     def _update_tag(self, model):
         """
@@ -9,9 +9,13 @@ __maintainer__ = "David Warde-Farley"
 
 import os
 import tempfile
+import numpy as np
+from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
 from pylearn2.models.model import Model
 from pylearn2.monitor import Monitor
+from pylearn2.space import NullSpace
 from pylearn2.train_extensions.best_params import MonitorBasedSaveBest
+from pylearn2.utils import sharedX
 
 
 class MockModel(Model):
@@ -116,3 +120,51 @@ def test_tagging():
 
     finally:
         os.remove(fn)
+
+
+def test_async_monitoring():
+    """
+    Test that the parameters of the best asynchronous monitoring step are
+    kept, without waiting for its value.
+    """
+    model = MockModel()
+    param = sharedX(3.)
+    model._params = [param]
+    model.monitor = Monitor(model)
+    dataset = DenseDesignMatrix(X=np.zeros((2, 1)))
+    model.monitor.add_dataset(dataset=dataset, mode='sequential',
+                              batch_size=2)
+    model.monitor.add_channel(name='param', ipt=None, val=param,
+                              data_specs=(NullSpace(), ''), dataset=dataset)
+    ext = MonitorBasedSaveBest(channel_name='param', store_best_model=True)
+    ext.setup(model, None, None)
+    model.monitor()
+    ext.on_monitor(model, None, None)
+    assert ext.best_cost == 3.
+
+    def train_and_monitor(value):
+        param.set_value(np.cast[param.dtype](value))
+        model.monitor.report_batch(2)
+        model.monitor.report_epoch()
+        model.monitor.call_async()
+        ext.on_monitor(model, None, None)
+
+    model.monitor.start_worker()
+    try:
+        train_and_monitor(1.)
+        train_and_monitor(2.)
+        # The value of the first step is known by now, the best model has
+        # its parameters and not the current ones
+        assert ext.best_cost == 1.
+        assert ext.best_model.get_param_values()[0] == 1.
+        assert param.get_value() == 2.
+        model.monitor.synchronize()
+        ext.on_save(model, None, None)
+        assert ext.best_cost == 1.
+        train_and_monitor(0.)
+        model.monitor.synchronize()
+        ext.on_save(model, None, None)
+        assert ext.best_cost == 0.
+        assert ext.best_model.get_param_values()[0] == 0.
+    finally:
+        model.monitor.stop_worker()
@@ -68,6 +68,12 @@ class WindowAndFlip(TrainExtension):
     An extension that allows an image dataset to be flipped and
     windowed after each epoch of training.
 
+    This extension keeps a padded copy of the topological view of each
+    randomized dataset and rewrites the whole dataset after each epoch.
+    :py:class:`pylearn2.datasets.window_flip.WindowAndFlipDataset` does
+    the same windowing and flipping on each minibatch as it is requested,
+    without the extra copy.
+
     Parameters
     ----------
     window_shape : WRITEME
@@ -0,0 +1,299 @@
+"""
+Synchronous data-parallel SGD with several processes on one host.
+"""
+import logging
+import multiprocessing
+import traceback
+
+import numpy as np
+from theano.compat.six.moves import xrange
+from theano.sandbox.rng_mrg import MRG_RandomStreams, mrg_uniform_base
+
+from pylearn2.space import CompositeSpace
+from pylearn2.training_algorithms.sgd import SGD
+from pylearn2.utils import safe_izip
+from pylearn2.utils.data_specs import DataSpecsMapping
+from pylearn2.utils.general import fork_context
+
+
+log = logging.getLogger(__name__)
+
+
+class ParallelSGD(SGD):
+    """
+    SGD computing the gradient of each batch with several processes.
+
+    Each batch is split in `num_workers` shards of consecutive examples.
+    This process computes the gradients of the first shard, and
+    `num_workers - 1` worker processes forked by `setup` compute those of
+    the others, with their own copy of the training function. The
+    gradients are averaged through shared memory, weighted by the sizes of
+    the shards, and this process applies the learning rule to their
+    average. The parameters are copied to the workers through shared
+    memory before each batch, so training is synchronous and equivalent to
+    `SGD` with the same batches.
+
+    The batches are copied to shared memory by this process, from which
+    each worker reads its shard. The datasets themselves are not copied:
+    the workers are forked after they are loaded.
+
+    The workers are forked, whatever the default start method of
+    `multiprocessing` is, so this is not supported on Windows, and only
+    supported on CPU, since CUDA contexts do not survive a fork. Each
+    process should use a single BLAS thread (e.g. with
+    OMP_NUM_THREADS=1), which also avoids deadlocks of some OpenMP
+    runtimes after a fork. The random number generators of the training
+    function (e.g. of dropout) are reseeded in each worker.
+    The updates returned by the cost besides the gradients (e.g. of
+    persistent chains) are made by each process on its own copy of the
+    shared variables, and `fuse_train_monitoring` and `stage_batches` are
+    not supported.
+
+    Parameters
+    ----------
+    learning_rate : float
+        The learning rate, see `SGD`.
+    num_workers : int
+        The number of processes computing the gradients, including this
+        one.
+    kwargs : dict
+        The other arguments of `SGD`.
+    """
+
+    def __init__(self, learning_rate, num_workers, **kwargs):
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1, got %d." %
+                             num_workers)
+        if kwargs.get('fuse_train_monitoring'):
+            raise ValueError("ParallelSGD does not support "
+                             "fuse_train_monitoring.")
+        if kwargs.get('stage_batches') is not None:
+            raise ValueError("ParallelSGD does not support stage_batches.")
+        super(ParallelSGD, self).__init__(learning_rate, **kwargs)
+        self.num_workers = num_workers
+        self._workers = []
+
+    def _accumulates_gradients(self):
+        """
+        The gradients of the shards are accumulated before being applied.
+        """
+        return True
+
+    def setup(self, model, dataset):
+        """
+        Compiles the training functions and forks the worker processes.
+
+        Parameters
+        ----------
+        model : a Model instance
+        dataset : Dataset
+        """
+        self.stop_workers()
+        super(ParallelSGD, self).setup(model, dataset)
+        if self.on_load_batch:
+            raise ValueError("ParallelSGD does not support costs that need "
+                             "on_load_batch callbacks.")
+
+        data_specs = self.cost.get_data_specs(self.model)
+        mapping = DataSpecsMapping(data_specs)
+        self._spaces = mapping.flatten(data_specs[0], return_tuple=True)
+        self._space = CompositeSpace(self._spaces)
+        self._batch_buffers = []
+        for space in self._spaces:
+            if getattr(space, 'sparse', False):
+                raise ValueError("ParallelSGD does not support sparse "
+                                 "spaces, got %s." % space)
+            origin = space.get_origin_batch(self.batch_size)
+            self._batch_buffers.append(_shared_array(origin.shape,
+                                                     origin.dtype))
+        self._param_buffers = [_shared_array(value.shape, value.dtype)
+                               for value in (param.get_value(borrow=True)
+                                             for param in self.params)]
+        # The accumulated gradients of each worker other than this process
+        self._grad_buffers = []
+        for acc in self._accumulators:
+            value = acc.get_value(borrow=True)
+            self._grad_buffers.append(_shared_array(
+                (self.num_workers - 1,) + value.shape, value.dtype))
+
+        context = fork_context()
+        for index in xrange(1, self.num_workers):
+            conn, child_conn = context.Pipe()
+            worker = context.Process(target=_sgd_worker,
+                                     args=(self, index, child_conn))
+            worker.daemon = True
+            worker.start()
+            child_conn.close()
+            self._workers.append((worker, conn))
+        log.info('Started %d SGD worker processes' % len(self._workers))
+
+    def _shard(self, start, stop):
+        """
+        Returns the examples `start` to `stop` of the batch in shared
+        memory.
+        """
+        return tuple(_batch_slice(buf, space, start, stop)
+                     for buf, space in safe_izip(self._batch_buffers,
+                                                 self._spaces))
+
+    def _accumulate(self, batch):
+        """
+        Accumulates the gradients of the shards of a batch computed by
+        this process and the workers.
+
+        Parameters
+        ----------
+        batch : tuple
+            The batch, in the flat data specs of the cost.
+        """
+        num_examples = self._space.np_batch_size(batch)
+        for buf, value, space in safe_izip(self._batch_buffers, batch,
+                                           self._spaces):
+            _batch_slice(buf, space, 0, num_examples)[...] = value
+        for buf, param in safe_izip(self._param_buffers, self.params):
+            buf[...] = param.get_value(borrow=True)
+
+        bounds = np.linspace(0, num_examples,
+                             self.num_workers + 1).astype('int64')
+        for index, (worker, conn) in enumerate(self._workers):
+            conn.send((int(bounds[index + 1]), int(bounds[index + 2])))
+        if bounds[1] > 0:
+            self.sgd_accumulate(*self._shard(0, int(bounds[1])))
+
+        errors = []
+        for worker, conn in self._workers:
+            try:
+                success, error = conn.recv()
+            except EOFError:
+                raise RuntimeError("An SGD worker process died.")
+            if not success:
+                errors.append(error)
+        if errors:
+            raise RuntimeError("Error in an SGD worker process:\n" +
+                               errors[0])
+        for acc, buf in safe_izip(self._accumulators, self._grad_buffers):
+            acc.set_value(np.asarray(acc.get_value() + buf.sum(axis=0),
+                                     dtype=acc.dtype))
+
+    def stop_workers(self):
+        """
+        Stops the worker processes started by `setup`.
+        """
+        for worker, conn in getattr(self, '_workers', []):
+            try:
+                conn.send(None)
+            except (IOError, OSError):
+                pass
+            worker.join()
+            conn.close()
+        self._workers = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ['_workers', '_batch_buffers', '_param_buffers',
+                     '_grad_buffers']:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        super(ParallelSGD, self).__setstate__(state)
+        self._workers = []
+
+
+def _shared_array(shape, dtype):
+    """
+    Returns a numpy array in memory shared with the processes forked
+    afterwards.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the array.
+    dtype : str or numpy dtype
+        The type of its elements.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buf = multiprocessing.RawArray('b', max(size * dtype.itemsize, 1))
+    return np.frombuffer(buf, dtype=dtype, count=size).reshape(shape)
+
+
+def _batch_slice(batch, space, start, stop):
+    """
+    Returns the examples `start` to `stop` of a numeric batch of `space`.
+    """
+    index = [slice(None)] * batch.ndim
+    index[space.get_batch_axis()] = slice(start, stop)
+    return batch[tuple(index)]
+
+
+def _reseed_random_states(function, seed):
+    """
+    Gives new seeds to the random number generators of a compiled function,
+    so that the worker processes do not draw the same numbers.
+
+    Parameters
+    ----------
+    function : theano.compile.Function
+        The function.
+    seed : int
+        Seeds the new seeds.
+    """
+    rng = np.random.RandomState(seed)
+    for var in function.get_shared():
+        default_update = getattr(var, 'default_update', None)
+        if default_update is None:
+            continue
+        value = var.get_value(borrow=True)
+        if isinstance(value, np.random.RandomState):
+            var.set_value(np.random.RandomState(rng.randint(2 ** 30)),
+                          borrow=True)
+        elif isinstance(getattr(default_update.owner, 'op', None),
+                        mrg_uniform_base):
+            streams = MRG_RandomStreams(rng.randint(1, 2 ** 30))
+            var.set_value(streams.get_substream_rstates(value.shape[0],
+                                                        value.dtype),
+                          borrow=True)
+
+
+def _sgd_worker(algorithm, index, conn):
+    """
+    Main loop of the worker processes started by `ParallelSGD.setup`.
+
+    Receives the (start, stop) bounds of its shard of the batch in shared
+    memory, loads the parameters from shared memory, computes the
+    gradients of the shard and writes the accumulated gradients to its
+    slot of the shared gradient buffers.
+
+    Parameters
+    ----------
+    algorithm : ParallelSGD
+        The (forked copy of the) algorithm.
+    index : int
+        The index of the worker, from 1 to `num_workers - 1`.
+    conn : multiprocessing.Connection
+        The connection with the training process.
+    """
+    _reseed_random_states(algorithm.sgd_accumulate, index)
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+        start, stop = msg
+        try:
+            for param, buf in safe_izip(algorithm.params,
+                                        algorithm._param_buffers):
+                param.set_value(buf)
+            for acc in algorithm._accumulators:
+                acc.set_value(np.zeros_like(acc.get_value(borrow=True)))
+            if stop > start:
+                algorithm.sgd_accumulate(*algorithm._shard(start, stop))
+            for acc, buf in safe_izip(algorithm._accumulators,
+                                      algorithm._grad_buffers):
+                buf[index - 1] = acc.get_value(borrow=True)
+            conn.send((True, None))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
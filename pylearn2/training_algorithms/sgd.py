@@ -15,9 +15,14 @@ import logging
 import warnings
 
 import numpy as np
+import theano
 from theano.compat import six
 from theano import config
 from theano import function
+from theano import tensor as T
+from theano.compat.six.moves import xrange
+from theano.compile import SharedVariable
+from theano.gof.graph import inputs as graph_inputs
 from theano.gof.op import get_debug_values
 
 from pylearn2.compat import OrderedDict, first_key
@@ -32,13 +37,14 @@ from pylearn2.utils.iteration import is_stochastic, has_uniform_batch_size
 from pylearn2.utils import py_integer_types, py_float_types
 from pylearn2.utils import safe_zip
 from pylearn2.utils import serial
+from pylearn2.utils.compile import cached_function
 from pylearn2.utils import sharedX
 from pylearn2.utils import contains_nan
 from pylearn2.utils import contains_inf
 from pylearn2.utils import isfinite
 from pylearn2.utils.data_specs import DataSpecsMapping
 from pylearn2.utils.exc import reraise_as
-from pylearn2.utils.timing import log_timing
+from pylearn2.utils.timing import log_timing, NullPhaseTimer
 from pylearn2.utils.rng import make_np_rng
 
 
@@ -149,6 +155,60 @@ class SGD(TrainingAlgorithm):
     seed : valid argument to np.random.RandomState, optional
         The seed used for the random number generate to be passed to the
         training dataset iterator (if any)
+    train_prefetch : int, optional
+        If specified, the training dataset iterator is asked to prepare
+        up to this many batches ahead on a background thread, so that
+        fetching and formatting the data overlaps with `sgd_update`.
+        The training dataset must support the `prefetch` argument of
+        `Dataset.iterator`. The time spent waiting for data during each
+        epoch is then reported in the `train_data_wait_seconds_this_epoch`
+        monitoring channel.
+    train_reuse_buffers : int, optional
+        If specified, the training dataset iterator is asked to gather
+        shuffled batches into a ring of this many preallocated buffers
+        rather than allocating a new array for each batch. The training
+        dataset must support the `reuse_buffers` argument of
+        `Dataset.iterator`. If `train_prefetch` is also specified, this
+        must be at least `train_prefetch + 2`.
+    fuse_train_monitoring : bool, optional
+        If True and the training dataset is also one of the monitoring
+        datasets, the monitor does not make a separate pass over it.
+        Instead, the objective and the channels of the cost and of the
+        model on that dataset are computed by `sgd_update` on each batch,
+        right before the parameters are updated, and averaged over the
+        epoch. The values are thus those seen during the epoch, as the
+        parameters changed, rather than those of the final parameters,
+        and they are NaN before the first epoch. The model channels are
+        only included if the model's monitoring data are available from
+        the training batches. There must be at least one other
+        monitoring dataset. Defaults to False.
+    stage_batches : int, optional
+        If specified, the training examples are copied to Theano shared
+        variables this many batches at a time, and `sgd_update` reads each
+        batch from them given its start and stop indices, instead of
+        receiving it as an argument. This saves the overhead of passing
+        each batch to the training function, which dominates for small
+        models and batches, and on GPU copies the data to the device once
+        per chunk. The training iteration mode then applies to the chunks:
+        e.g. with 'shuffled_sequential', the chunks are random subsets of
+        the examples, and their batches are trained on in order. Requires
+        a batch size, dense spaces and a cost without `on_load_batch`
+        callbacks.
+    updates_per_call : int, optional
+        The number of consecutive batches each call to the training
+        function trains on, with a Theano `scan`. Requires
+        `stage_batches`. The update callbacks are called after each call,
+        i.e. every `updates_per_call` batches. Defaults to 1.
+    accumulate_steps : int, optional
+        If more than 1, the gradients of this many consecutive batches of
+        `batch_size` examples are accumulated, and the parameters (and the
+        learning rule) are updated once with their average, weighted by
+        the sizes of the batches. This trains with batches of
+        `batch_size * accumulate_steps` examples while only computing the
+        activations of `batch_size` examples at once. `batches_per_iter`,
+        the update callbacks and the batch counters of the monitor count
+        these effective batches. Can not be combined with
+        `stage_batches`. Defaults to 1.
     """
     def __init__(self, learning_rate, cost=None, batch_size=None,
                  monitoring_batch_size=None, monitoring_batches=None,
@@ -158,7 +218,10 @@ class SGD(TrainingAlgorithm):
                  learning_rule=None, set_batch_size=False,
                  train_iteration_mode=None, batches_per_iter=None,
                  theano_function_mode=None, monitoring_costs=None,
-                 seed=[2012, 10, 5]):
+                 seed=[2012, 10, 5], train_prefetch=None,
+                 train_reuse_buffers=None, fuse_train_monitoring=False,
+                 stage_batches=None, updates_per_call=1,
+                 accumulate_steps=1):
 
         if isinstance(cost, (list, tuple, set)):
             raise TypeError("SGD no longer supports using collections of " +
@@ -192,6 +255,67 @@ class SGD(TrainingAlgorithm):
         self.rng = make_np_rng(seed, which_method=["randn", "randint"])
         self.theano_function_mode = theano_function_mode
         self.monitoring_costs = monitoring_costs
+        self.train_prefetch = train_prefetch
+        self.train_reuse_buffers = train_reuse_buffers
+        self.data_wait_seconds = sharedX(
+            0, 'train_data_wait_seconds_this_epoch')
+        self.fuse_train_monitoring = fuse_train_monitoring
+        if updates_per_call < 1:
+            raise ValueError("updates_per_call must be at least 1, got %d." %
+                             updates_per_call)
+        if updates_per_call > 1 and stage_batches is None:
+            raise ValueError("updates_per_call requires stage_batches.")
+        self.stage_batches = stage_batches
+        self.updates_per_call = updates_per_call
+        if accumulate_steps < 1:
+            raise ValueError("accumulate_steps must be at least 1, got %d." %
+                             accumulate_steps)
+        if accumulate_steps > 1 and stage_batches is not None:
+            raise ValueError("accumulate_steps can not be combined with "
+                             "stage_batches.")
+        self.accumulate_steps = accumulate_steps
+        # Name of the monitoring dataset whose channels are computed by
+        # sgd_update, if any, and the accumulators of these channels.
+        self._fused_dataset_name = None
+        self._fused_channels = OrderedDict()
+        self._fused_accumulators = []
+        # Position in the current epoch, for get_state
+        self._epoch_rng_state = None
+        self._batches_this_epoch = 0
+        self._resume_state = None
+        # Set by Train to time the phases of each step
+        self.phase_timer = NullPhaseTimer()
+
+    def __setstate__(self, d):
+        """
+        An implementation of __setstate__ that patches old pickle files.
+        """
+
+        self.__dict__.update(d)
+
+        # Patch old pickle files, saved before these attributes existed
+        defaults = [('train_prefetch', None),
+                    ('train_reuse_buffers', None),
+                    ('fuse_train_monitoring', False),
+                    ('stage_batches', None),
+                    ('updates_per_call', 1),
+                    ('accumulate_steps', 1),
+                    ('_fused_dataset_name', None),
+                    ('_epoch_rng_state', None),
+                    ('_batches_this_epoch', 0),
+                    ('_resume_state', None)]
+        for name, value in defaults:
+            if name not in d:
+                setattr(self, name, value)
+        if '_fused_channels' not in d:
+            self._fused_channels = OrderedDict()
+        if '_fused_accumulators' not in d:
+            self._fused_accumulators = []
+        if 'data_wait_seconds' not in d:
+            self.data_wait_seconds = sharedX(
+                0, 'train_data_wait_seconds_this_epoch')
+        if 'phase_timer' not in d:
+            self.phase_timer = NullPhaseTimer()
 
     def _setup_monitor(self):
         """
@@ -208,14 +332,30 @@ class SGD(TrainingAlgorithm):
                     self.monitoring_batches is None):
                 self.monitoring_batch_size = self.batch_size
                 self.monitoring_batches = self.batches_per_iter
-            self.monitor.setup(dataset=self.monitoring_dataset,
+                accumulate_steps = self.accumulate_steps
+                if self.monitoring_batches is not None:
+                    # batches_per_iter counts the accumulated batches
+                    self.monitoring_batches *= accumulate_steps
+            # The channels of the training dataset may be computed by
+            # sgd_update instead of by the monitor
+            monitoring_datasets = OrderedDict(
+                (name, d) for name, d in six.iteritems(self.monitoring_dataset)
+                if name != self._fused_dataset_name)
+            self.monitor.setup(dataset=monitoring_datasets,
                                cost=self.cost,
                                batch_size=self.monitoring_batch_size,
                                num_batches=self.monitoring_batches,
                                extra_costs=self.monitoring_costs,
                                mode=self.monitor_iteration_mode)
-            dataset_name = first_key(self.monitoring_dataset)
-            monitoring_dataset = self.monitoring_dataset[dataset_name]
+            dataset_name = first_key(monitoring_datasets)
+            monitoring_dataset = monitoring_datasets[dataset_name]
+
+            for name, val in six.iteritems(self._fused_channels):
+                self.monitor.add_channel(name=name,
+                                         ipt=None,
+                                         val=val,
+                                         data_specs=(NullSpace(), ''),
+                                         dataset=monitoring_dataset)
             # TODO: have Monitor support non-data-dependent channels
             self.monitor.add_channel(name='learning_rate',
                                      ipt=None,
@@ -223,6 +363,18 @@ class SGD(TrainingAlgorithm):
                                      data_specs=(NullSpace(), ''),
                                      dataset=monitoring_dataset)
 
+            if self.train_prefetch:
+                self.data_wait_seconds.__doc__ = """\
+The number of seconds the training loop spent waiting for the background
+thread to prepare a batch during the most recent epoch. A large value
+means that training is limited by data loading rather than computation."""
+                self.monitor.add_channel(
+                    name='train_data_wait_seconds_this_epoch',
+                    ipt=None,
+                    val=self.data_wait_seconds,
+                    data_specs=(NullSpace(), ''),
+                    dataset=monitoring_dataset)
+
             if self.learning_rule:
                 self.learning_rule.add_channels_to_monitor(
                     self.monitor,
@@ -361,6 +513,16 @@ class SGD(TrainingAlgorithm):
             lr = learning_rate.get_value() * lr_scalers.get(param, 1.)
             log.info('\t' + param_name + ': ' + str(lr))
 
+        # When accumulating, the updates that depend on the batch are made
+        # by sgd_accumulate, and sgd_update applies the learning rule to
+        # the accumulated gradients
+        batch_updates = None
+        if self._accumulates_gradients():
+            batch_updates = updates
+            updates = OrderedDict()
+            grads, resets = self._setup_gradient_accumulators(
+                grads, batch_updates, theano_args, space_tuple)
+
         if self.learning_rule:
             updates.update(self.learning_rule.get_updates(
                 learning_rate, grads, lr_scalers))
@@ -386,6 +548,15 @@ class SGD(TrainingAlgorithm):
                     raise ValueError("debug value of %s contains nans" %
                                      update.name)
 
+        if self.fuse_train_monitoring:
+            fused_updates = self._setup_fused_channels(
+                dataset, theano_args, nested_args, cost_value,
+                space_tuple, source_tuple, fixed_var_descr)
+            if batch_updates is not None:
+                batch_updates.update(fused_updates)
+            else:
+                updates.update(fused_updates)
+
         # Set up monitor to model the objective value, learning rate,
         # momentum (if applicable), and extra channels defined by
         # the cost.
@@ -395,14 +566,254 @@ class SGD(TrainingAlgorithm):
         # for AdaDelta and RMSProp).
         self._setup_monitor()
 
-        with log_timing(log, 'Compiling sgd_update'):
-            self.sgd_update = function(theano_args,
-                                       updates=updates,
-                                       name='sgd_update',
-                                       on_unused_input='ignore',
-                                       mode=self.theano_function_mode)
+        # The shared variables, other than the parameters, that the
+        # training function reads or updates: learning rate, accumulators
+        # of the learning rule, states of the Theano random streams, ...
+        all_updates = OrderedDict(updates)
+        if batch_updates is not None:
+            all_updates.update(batch_updates)
+        state_vars = [var for var in all_updates if var not in params]
+        for var in graph_inputs(list(all_updates.values())):
+            if (isinstance(var, SharedVariable) and var not in params and
+                    var not in state_vars):
+                state_vars.append(var)
+        self._state_vars = state_vars
+
+        if batch_updates is not None:
+            with log_timing(log, 'Compiling sgd_accumulate'):
+                self.sgd_accumulate = cached_function(
+                    theano_args,
+                    updates=batch_updates,
+                    name='sgd_accumulate',
+                    on_unused_input='ignore',
+                    mode=self.theano_function_mode)
+            updates.update(resets)
+            with log_timing(log, 'Compiling sgd_update'):
+                self.sgd_update = cached_function(
+                    [],
+                    updates=updates,
+                    name='sgd_update',
+                    mode=self.theano_function_mode)
+        elif self.stage_batches is not None:
+            self._setup_staged_updates(theano_args, space_tuple,
+                                       source_tuple, updates)
+        else:
+            with log_timing(log, 'Compiling sgd_update'):
+                self.sgd_update = cached_function(
+                    theano_args,
+                    updates=updates,
+                    name='sgd_update',
+                    on_unused_input='ignore',
+                    mode=self.theano_function_mode)
         self.params = params
 
+    def _setup_gradient_accumulators(self, grads, batch_updates, theano_args,
+                                     space_tuple):
+        """
+        Creates the shared variables accumulating the gradients when
+        `_accumulates_gradients` is True.
+
+        Parameters
+        ----------
+        grads : OrderedDict
+            Maps the parameters to their gradients on a batch.
+        batch_updates : OrderedDict
+            The updates made on each batch, to which the updates of the
+            accumulators are added.
+        theano_args : tuple
+            The inputs of the training graph.
+        space_tuple : tuple
+            Their spaces.
+
+        Returns
+        -------
+        grads : OrderedDict
+            Maps the parameters to the average of their accumulated
+            gradients, weighted by the sizes of the batches.
+        resets : OrderedDict
+            The updates resetting the accumulators.
+        """
+        batch_size = T.cast(CompositeSpace(space_tuple).batch_size(
+            theano_args), config.floatX)
+        count = sharedX(0., 'accumulated_examples')
+        batch_updates[count] = count + batch_size
+        resets = OrderedDict([(count, T.zeros_like(count))])
+        accumulated_grads = OrderedDict()
+        for param, grad in six.iteritems(grads):
+            value = param.get_value(borrow=True)
+            acc = theano.shared(np.zeros(value.shape, dtype=value.dtype),
+                                name='accumulated_grad(%s)' % param.name,
+                                broadcastable=param.broadcastable)
+            batch_updates[acc] = acc + T.cast(grad * batch_size, acc.dtype)
+            resets[acc] = T.zeros_like(acc)
+            accumulated_grads[param] = T.cast(acc / count, param.dtype)
+            accumulated_grads[param].name = grad.name
+        self._accumulators = list(resets.keys())
+        return accumulated_grads, resets
+
+    def _accumulates_gradients(self):
+        """
+        Returns True if the gradients are accumulated by `sgd_accumulate`
+        and applied by `sgd_update`, rather than applied on each batch.
+        """
+        return self.accumulate_steps > 1
+
+    def _setup_staged_updates(self, theano_args, space_tuple, source_tuple,
+                              updates):
+        """
+        Compiles the training functions reading their batches from shared
+        variables, when `stage_batches` is set.
+
+        `sgd_update` takes the start and stop indices of a batch among the
+        staged examples. If `updates_per_call` is more than 1,
+        `sgd_update_scan` takes the start index of the first of
+        `updates_per_call` consecutive batches, and trains on all of them.
+        """
+        if self.on_load_batch:
+            raise ValueError("stage_batches can not be used with a cost "
+                             "that needs on_load_batch callbacks.")
+        if self.batch_size is None:
+            raise ValueError("stage_batches requires a batch size.")
+        self._staged_data = []
+        for space, source in safe_zip(space_tuple, source_tuple):
+            if getattr(space, 'sparse', False):
+                raise ValueError("stage_batches does not support sparse "
+                                 "spaces, got %s for %s." % (space, source))
+            name = '%s_staged[%s]' % (self.__class__.__name__, source)
+            self._staged_data.append(space.make_shared_batch(
+                self.batch_size * self.stage_batches, name=name))
+
+        def batch_givens(start, stop):
+            """
+            Maps the inputs of the training graph to a batch of the staged
+            examples.
+            """
+            givens = OrderedDict()
+            for arg, space, data in safe_zip(theano_args, space_tuple,
+                                             self._staged_data):
+                index = [slice(None)] * data.ndim
+                index[space.get_batch_axis()] = slice(start, stop)
+                givens[arg] = T.patternbroadcast(data[tuple(index)],
+                                                 arg.broadcastable)
+            return givens
+
+        start = T.lscalar('start')
+        stop = T.lscalar('stop')
+        with log_timing(log, 'Compiling sgd_update'):
+            self.sgd_update = cached_function([start, stop],
+                                              updates=updates,
+                                              givens=batch_givens(start, stop),
+                                              name='sgd_update',
+                                              on_unused_input='ignore',
+                                              mode=self.theano_function_mode)
+
+        self.sgd_update_scan = None
+        if self.updates_per_call > 1:
+            batch_size = self.batch_size
+            variables = list(updates.keys())
+
+            def step(k, first):
+                """
+                Returns the updates of the k-th batch after `first`.
+                """
+                begin = first + k * batch_size
+                values = theano.clone(
+                    list(updates.values()),
+                    replace=batch_givens(begin, begin + batch_size))
+                return OrderedDict(safe_zip(variables, values))
+
+            _, scan_updates = theano.scan(
+                step, sequences=[T.arange(self.updates_per_call)],
+                non_sequences=[start], name='sgd_update_scan')
+            with log_timing(log, 'Compiling sgd_update_scan'):
+                self.sgd_update_scan = cached_function(
+                    [start],
+                    updates=scan_updates,
+                    name='sgd_update_scan',
+                    mode=self.theano_function_mode)
+
+    def _setup_fused_channels(self, dataset, theano_args, nested_args,
+                              cost_value, space_tuple, source_tuple,
+                              fixed_var_descr):
+        """
+        Builds the channels of the training dataset that are computed by
+        `sgd_update` when `fuse_train_monitoring` is True.
+
+        Each channel value is accumulated, weighted by the batch size, in
+        a shared variable, and the monitor reports its average over the
+        epoch.
+
+        Returns
+        -------
+        updates : OrderedDict
+            The updates of the accumulators, to be added to those of
+            `sgd_update`.
+        """
+        updates = OrderedDict()
+        self._fused_dataset_name = None
+        self._fused_channels = OrderedDict()
+        self._fused_accumulators = []
+        if not self.monitoring_dataset:
+            return updates
+        names = [name for name, d in six.iteritems(self.monitoring_dataset)
+                 if d is dataset]
+        if len(names) == 0:
+            log.warning("fuse_train_monitoring is set but the training "
+                        "dataset is not a monitoring dataset.")
+            return updates
+        if len(self.monitoring_dataset) == 1:
+            log.warning("fuse_train_monitoring needs a monitoring dataset "
+                        "other than the training dataset, the training "
+                        "dataset will be monitored separately.")
+            return updates
+        dataset_name = names[0]
+        if dataset_name == '':
+            prefix = ''
+        else:
+            prefix = dataset_name + '_'
+
+        model = self.model
+        raw_channels = OrderedDict()
+        if cost_value is not None:
+            raw_channels['objective'] = cost_value
+        raw_channels.update(self.cost.get_monitoring_channels(
+            model, nested_args, **fixed_var_descr.fixed_vars))
+
+        # The model channels can only be computed if the training batches
+        # contain the data the model asks for.
+        m_space, m_source = model.get_monitoring_data_specs()
+        m_mapping = DataSpecsMapping((m_space, m_source))
+        m_spaces = m_mapping.flatten(m_space, return_tuple=True)
+        m_sources = m_mapping.flatten(m_source, return_tuple=True)
+        available = list(safe_zip(space_tuple, source_tuple))
+        if all((space, source) in available
+               for space, source in safe_zip(m_spaces, m_sources)):
+            m_args = tuple(theano_args[available.index((space, source))]
+                           for space, source in safe_zip(m_spaces,
+                                                         m_sources))
+            raw_channels.update(model.get_monitoring_channels(
+                m_mapping.nest(m_args)))
+        else:
+            log.warning("The training batches do not contain the "
+                        "monitoring data of the model, its channels will "
+                        "not be computed on the training dataset.")
+
+        batch_size = T.cast(CompositeSpace(space_tuple).batch_size(
+            theano_args), config.floatX)
+        count = sharedX(0., prefix + 'examples_accumulator')
+        updates[count] = count + batch_size
+        self._fused_accumulators.append(count)
+        for name, val in six.iteritems(raw_channels):
+            acc = sharedX(0., prefix + name + '_accumulator')
+            updates[acc] = acc + T.cast(val * batch_size, config.floatX)
+            self._fused_accumulators.append(acc)
+            # NaN until a batch was seen
+            self._fused_channels[prefix + name] = T.cast(
+                acc / T.switch(T.eq(count, 0.), np.nan, count),
+                config.floatX)
+        self._fused_dataset_name = dataset_name
+        return updates
+
     def train(self, dataset):
         """
         Runs one epoch of SGD training on the specified dataset.
@@ -425,6 +836,15 @@ class SGD(TrainingAlgorithm):
         if not is_stochastic(self.train_iteration_mode):
             rng = None
 
+        # Resuming an interrupted epoch starts it again from the same state
+        # of the random number generator, then skips the batches that were
+        # already seen
+        resume_state = self._resume_state
+        self._resume_state = None
+        if resume_state is not None:
+            self.rng.set_state(resume_state['epoch_rng_state'])
+        self._epoch_rng_state = self.rng.get_state()
+
         data_specs = self.cost.get_data_specs(self.model)
 
         # The iterator should be built from flat data specs, so it returns
@@ -442,26 +862,109 @@ class SGD(TrainingAlgorithm):
                 "data_specs: %s" % str(data_specs))
         flat_data_specs = (CompositeSpace(space_tuple), source_tuple)
 
+        iterator_kwargs = {}
+        if self.train_prefetch:
+            iterator_kwargs['prefetch'] = self.train_prefetch
+        if self.train_reuse_buffers:
+            iterator_kwargs['reuse_buffers'] = self.train_reuse_buffers
+        # When staging, the iterator returns chunks of stage_batches batches
+        stage_batches = self.stage_batches
+        accumulates_gradients = self._accumulates_gradients()
+        batch_size = self.batch_size
+        num_batches = self.batches_per_iter
+        if stage_batches is not None:
+            batch_size = self.batch_size * stage_batches
+            if num_batches is not None:
+                num_batches = -(-num_batches // stage_batches)
+        # When accumulating, the iterator returns the accumulated batches
+        accumulate_steps = self.accumulate_steps
+        if num_batches is not None:
+            num_batches *= accumulate_steps
         iterator = dataset.iterator(mode=self.train_iteration_mode,
-                                    batch_size=self.batch_size,
+                                    batch_size=batch_size,
                                     data_specs=flat_data_specs,
                                     return_tuple=True, rng=rng,
-                                    num_batches=self.batches_per_iter)
-
-        on_load_batch = self.on_load_batch
-        for batch in iterator:
-            for callback in on_load_batch:
-                callback(*batch)
-            self.sgd_update(*batch)
-            # iterator might return a smaller batch if dataset size
-            # isn't divisible by batch_size
-            # Note: if data_specs[0] is a NullSpace, there is no way to know
-            # how many examples would actually have been in the batch,
-            # since it was empty, so actual_batch_size would be reported as 0.
-            actual_batch_size = flat_data_specs[0].np_batch_size(batch)
-            self.monitor.report_batch(actual_batch_size)
-            for callback in self.update_callbacks:
-                callback(self)
+                                    num_batches=num_batches,
+                                    **iterator_kwargs)
+
+        # The prefetching thread of the iterator, if any, is stopped even
+        # if training fails
+        try:
+            num_skipped = 0
+            skipped_in_chunk = 0
+            if resume_state is not None:
+                num_skipped = resume_state['batches_this_epoch']
+                log.info('Resuming the epoch after %d batches' % num_skipped)
+                num_skipped_iter = num_skipped * accumulate_steps
+                if stage_batches is not None:
+                    num_skipped_iter, skipped_in_chunk = divmod(num_skipped,
+                                                                stage_batches)
+                if hasattr(iterator, 'skip'):
+                    iterator.skip(num_skipped_iter)
+                else:
+                    for i in xrange(num_skipped_iter):
+                        six.next(iterator)
+            else:
+                # The fused channels are averages over this epoch only
+                for accumulator in self._fused_accumulators:
+                    accumulator.set_value(np.cast[config.floatX](0.))
+            self._batches_this_epoch = num_skipped
+
+            on_load_batch = self.on_load_batch
+            timer = self.phase_timer
+            if stage_batches is not None:
+                self._train_staged(iterator, flat_data_specs[0],
+                                   skipped_in_chunk, timer)
+            else:
+                # Number of batches and of examples accumulated
+                accumulated = 0
+                accumulated_examples = 0
+                while True:
+                    with timer.phase('fetch'):
+                        try:
+                            batch = six.next(iterator)
+                        except StopIteration:
+                            break
+                    with timer.phase('on_load_batch'):
+                        for callback in on_load_batch:
+                            callback(*batch)
+                    # iterator might return a smaller batch if dataset size
+                    # isn't divisible by batch_size
+                    # Note: if data_specs[0] is a NullSpace, there is no way to
+                    # know how many examples would actually have been in the
+                    # batch, since it was empty, so actual_batch_size would be
+                    # reported as 0.
+                    actual_batch_size = flat_data_specs[0].np_batch_size(batch)
+                    if not accumulates_gradients:
+                        with timer.phase('sgd_update'):
+                            self.sgd_update(*batch)
+                        self._end_batch(actual_batch_size, timer)
+                        continue
+                    with timer.phase('sgd_update'):
+                        self._accumulate(batch)
+                    accumulated += 1
+                    accumulated_examples += actual_batch_size
+                    if accumulated == accumulate_steps:
+                        self._apply_accumulated(accumulated_examples, timer)
+                        accumulated = accumulated_examples = 0
+                # The last batches of the epoch, if fewer than accumulate_steps
+                if accumulated > 0:
+                    self._apply_accumulated(accumulated_examples, timer)
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        self._batches_this_epoch = 0
+        self._epoch_rng_state = None
+
+        # The conversions are only part of the time spent fetching when
+        # they run on this thread
+        if not self.train_prefetch and hasattr(iterator, 'conversion_time'):
+            timer.add('fetch/convert', iterator.conversion_time)
+
+        if self.train_prefetch:
+            log.info('Time spent waiting for training data: %f seconds',
+                     iterator.starvation_time)
+            self.data_wait_seconds.set_value(iterator.starvation_time)
 
         # Make sure none of the parameters have bad values
         for param in self.params:
@@ -469,6 +972,174 @@ class SGD(TrainingAlgorithm):
             if not isfinite(value):
                 raise RuntimeError("NaN in " + param.name)
 
+    def _end_batch(self, num_examples, timer):
+        """
+        Records that the model was trained on a batch, and calls the update
+        callbacks.
+
+        Parameters
+        ----------
+        num_examples : int
+            The number of examples of the batch.
+        timer : PhaseTimer
+            Times the update callbacks.
+        """
+        self.monitor.report_batch(num_examples)
+        self._batches_this_epoch += 1
+        with timer.phase('update_callbacks'):
+            for callback in self.update_callbacks:
+                callback(self)
+
+    def _accumulate(self, batch):
+        """
+        Adds the gradients of a batch to the accumulators, when
+        `_accumulates_gradients` is True.
+
+        Parameters
+        ----------
+        batch : tuple
+            The batch, in the flat data specs of the cost.
+        """
+        self.sgd_accumulate(*batch)
+
+    def _apply_accumulated(self, num_examples, timer):
+        """
+        Updates the parameters with the accumulated gradients, when
+        `_accumulates_gradients` is True.
+
+        Parameters
+        ----------
+        num_examples : int
+            The number of examples of the accumulated batches.
+        timer : PhaseTimer
+            Times the phases of the update.
+        """
+        with timer.phase('sgd_update'):
+            self.sgd_update()
+        self._end_batch(num_examples, timer)
+
+    def _train_staged(self, iterator, space, skip, timer):
+        """
+        Runs the rest of an epoch with the staged training functions.
+
+        Parameters
+        ----------
+        iterator : iterator
+            Returns the chunks of `stage_batches` batches.
+        space : CompositeSpace
+            The space of the chunks.
+        skip : int
+            The number of batches of the first chunk to skip, when resuming
+            an epoch.
+        timer : PhaseTimer
+            Times the phases of the loop.
+        """
+        batch_size = self.batch_size
+        updates_per_call = self.updates_per_call
+        # Reused buffers may be overwritten while they are staged
+        borrow = not self.train_reuse_buffers
+        while True:
+            with timer.phase('fetch'):
+                try:
+                    chunk = six.next(iterator)
+                except StopIteration:
+                    return
+            with timer.phase('stage'):
+                for data, value in safe_zip(self._staged_data, chunk):
+                    data.set_value(value, borrow=borrow)
+            num_examples = space.np_batch_size(chunk)
+            start = skip * batch_size
+            skip = 0
+            while start < num_examples:
+                remaining = None
+                if self.batches_per_iter is not None:
+                    remaining = self.batches_per_iter - \
+                        self._batches_this_epoch
+                    if remaining <= 0:
+                        return
+                num_batches = 1
+                if (updates_per_call > 1 and
+                        start + updates_per_call * batch_size <=
+                        num_examples and
+                        (remaining is None or remaining >= updates_per_call)):
+                    num_batches = updates_per_call
+                stop = min(start + num_batches * batch_size, num_examples)
+                with timer.phase('sgd_update'):
+                    if num_batches > 1:
+                        self.sgd_update_scan(start)
+                    else:
+                        self.sgd_update(start, stop)
+                for begin in xrange(start, stop, batch_size):
+                    self.monitor.report_batch(min(batch_size, stop - begin))
+                self._batches_this_epoch += num_batches
+                start = stop
+                with timer.phase('update_callbacks'):
+                    for callback in self.update_callbacks:
+                        callback(self)
+
+    def get_state(self):
+        """
+        Returns the state of the algorithm, including the position in the
+        current epoch when called from an update callback.
+
+        Returns
+        -------
+        state : dict
+            The values of the shared variables of the training function
+            other than the model parameters (learning rate, accumulators
+            of the learning rule, states of the Theano random streams...),
+            the state of the numpy random number generator, the position in
+            the current epoch and the plain attributes of the update
+            callbacks and of the termination criterion (see
+            `serial.plain_state`).
+        """
+        if not hasattr(self, '_state_vars'):
+            raise Exception("get_state called without first calling setup")
+        return {
+            'shared': [(var.name, var.get_value())
+                       for var in self._state_vars],
+            'rng': self.rng.get_state(),
+            'epoch_rng_state': self._epoch_rng_state,
+            'batches_this_epoch': self._batches_this_epoch,
+            'update_callbacks': [serial.plain_state(callback)
+                                 for callback in self.update_callbacks],
+            'termination_criterion': serial.plain_state(
+                self.termination_criterion)
+        }
+
+    def set_state(self, state):
+        """
+        Restores a state returned by `get_state`. If it was taken in the
+        middle of an epoch, the next call to `train` finishes that epoch.
+
+        Parameters
+        ----------
+        state : dict
+            A state returned by `get_state`, by an algorithm set up with
+            the same model, cost and learning rule.
+        """
+        if not hasattr(self, '_state_vars'):
+            raise Exception("set_state called without first calling setup")
+        names = [name for name, value in state['shared']]
+        if names != [var.name for var in self._state_vars]:
+            raise ValueError("The state does not match the training "
+                             "function: it has the shared variables %s, "
+                             "expected %s." %
+                             (names, [var.name for var in self._state_vars]))
+        for var, (name, value) in safe_zip(self._state_vars,
+                                           state['shared']):
+            var.set_value(value)
+        self.rng.set_state(state['rng'])
+        if state['batches_this_epoch'] > 0:
+            self._resume_state = state
+        # Callbacks added after the state was taken keep their own state
+        for callback, callback_state in zip(self.update_callbacks,
+                                            state['update_callbacks']):
+            serial.set_plain_state(callback, callback_state)
+        if self.termination_criterion is not None:
+            serial.set_plain_state(self.termination_criterion,
+                                   state['termination_criterion'])
+
     def continue_learning(self, model):
         """
         Returns True if the algorithm should continue running, or False
@@ -1152,6 +1823,9 @@ class PolyakAveraging(TrainExtension):
         WRITEME
     save_freq : int, optional
         WRITEME
+    background_save : bool, optional
+        If True, the averaged model is written on a background thread by a
+        `serial.CheckpointWriter`.
 
     Notes
     -----
@@ -1159,7 +1833,8 @@ class PolyakAveraging(TrainExtension):
     rate. It may be used in conjunction with momentum.
     """
 
-    def __init__(self, start, save_path=None, save_freq=1):
+    def __init__(self, start, save_path=None, save_freq=1,
+                 background_save=False):
         self.__dict__.update(locals())
         del self.self
         self._count = 0
@@ -1192,7 +1867,14 @@ class PolyakAveraging(TrainExtension):
             for param in model.get_params():
                 saved_params[param] = param.get_value()
                 param.set_value(self._worker.param_to_mean[param].get_value())
-            serial.save(self.save_path, model)
+            if getattr(self, 'background_save', False):
+                # The snapshot holds the averaged parameters, so they can
+                # be restored right away
+                if getattr(self, '_checkpoint_writer', None) is None:
+                    self._checkpoint_writer = serial.CheckpointWriter()
+                self._checkpoint_writer.save(self.save_path, model)
+            else:
+                serial.save(self.save_path, model)
             for param in model.get_params():
                 param.set_value(saved_params[param])
         self._count += 1
@@ -1,5 +1,8 @@
 from __future__ import print_function
 
+import pickle
+import threading
+
 import numpy as np
 from theano.compat.six.moves import cStringIO, xrange
 import theano.tensor as T
@@ -24,6 +27,7 @@ from pylearn2.training_algorithms.sgd import (ExponentialDecay,
                                               SGD,
                                               AnnealedLearningRate,
                                               EpochMonitor)
+from pylearn2.training_algorithms.parallel_sgd import ParallelSGD
 from pylearn2.training_algorithms.learning_rule import (Momentum,
                                                         MomentumAdjustor)
 from pylearn2.utils.iteration import _iteration_schemes
@@ -1991,5 +1995,210 @@ def test_epoch_monitor():
         assert len(val.val_record) == n_batches//monitor_rate
 
 
+def test_fuse_train_monitoring():
+    """
+    Checks that the training set channels computed by sgd_update when
+    fuse_train_monitoring is set match those of a separate monitoring
+    pass, if the parameters do not change during the epoch.
+    """
+    dim = 3
+    batch_size = 5
+    rng = np.random.RandomState([2015, 4, 20])
+    train = DenseDesignMatrix(X=rng.randn(20, dim))
+    valid = DenseDesignMatrix(X=rng.randn(15, dim))
+
+    values = []
+    for fuse in [False, True]:
+        model = SoftmaxModel(dim)
+        algorithm = SGD(0., DummyCost(),
+                        batch_size=batch_size,
+                        train_iteration_mode='sequential',
+                        monitoring_dataset={'train': train,
+                                            'valid': valid},
+                        termination_criterion=EpochCounter(1),
+                        fuse_train_monitoring=fuse)
+        algorithm.setup(model=model, dataset=train)
+        monitor = model.monitor
+        monitor()
+        if fuse:
+            assert train not in monitor._datasets
+            assert np.isnan(
+                monitor.channels['train_objective'].val_record[-1])
+        algorithm.train(train)
+        monitor()
+        values.append(monitor.channels['train_objective'].val_record[-1])
+        assert len(monitor.channels['train_objective'].val_record) == 2
+
+    assert np.allclose(values[0], values[1])
+
+
+def test_stage_batches():
+    """
+    Checks that training with the batches staged in shared variables,
+    with one or several updates per call, gives the same parameters and
+    counters as passing each batch to sgd_update.
+    """
+    dim = 3
+    batch_size = 5
+    rng = np.random.RandomState([2015, 5, 10])
+    # 7 full batches and a smaller one, in chunks of 3 batches
+    dataset = DenseDesignMatrix(X=rng.randn(37, dim), y=rng.randn(37, dim))
+
+    values = []
+    for stage_batches, updates_per_call in [(None, 1), (3, 1), (3, 2)]:
+        model = SoftmaxModel(dim)
+        algorithm = SGD(.1, SupervisedDummyCost(),
+                        batch_size=batch_size,
+                        learning_rule=Momentum(.5),
+                        train_iteration_mode='sequential',
+                        stage_batches=stage_batches,
+                        updates_per_call=updates_per_call)
+        algorithm.setup(model=model, dataset=dataset)
+        for epoch in xrange(2):
+            algorithm.train(dataset)
+        values.append(model.P.get_value())
+        assert model.monitor.get_batches_seen() == 16
+        assert model.monitor.get_examples_seen() == 74
+        # The staged examples are not part of the state of the algorithm
+        names = [name for name, value in algorithm.get_state()['shared']]
+        assert not any('staged' in name for name in names)
+
+    assert np.allclose(values[0], values[1])
+    assert np.allclose(values[0], values[2])
+
+    # The number of batches per epoch is respected
+    model = SoftmaxModel(dim)
+    algorithm = SGD(.1, SupervisedDummyCost(), batch_size=batch_size,
+                    train_iteration_mode='sequential', batches_per_iter=4,
+                    stage_batches=3, updates_per_call=2)
+    algorithm.setup(model=model, dataset=dataset)
+    algorithm.train(dataset)
+    assert model.monitor.get_batches_seen() == 4
+
+
+def test_accumulate_steps():
+    """
+    Checks that accumulating the gradients of several batches gives the
+    same training as one batch of all their examples, and that the
+    counters count the accumulated batches.
+    """
+    dim = 3
+    rng = np.random.RandomState([2015, 5, 11])
+    # The last accumulated batch has a single smaller batch
+    dataset = DenseDesignMatrix(X=rng.randn(23, dim), y=rng.randn(23, dim))
+
+    values = []
+    for batch_size, accumulate_steps in [(10, 1), (5, 2)]:
+        model = SoftmaxModel(dim)
+        algorithm = SGD(.1, SupervisedDummyCost(),
+                        batch_size=batch_size,
+                        learning_rule=Momentum(.5),
+                        train_iteration_mode='sequential',
+                        accumulate_steps=accumulate_steps)
+        algorithm.setup(model=model, dataset=dataset)
+        for epoch in xrange(2):
+            algorithm.train(dataset)
+        values.append(model.P.get_value())
+        assert model.monitor.get_batches_seen() == 6
+        assert model.monitor.get_examples_seen() == 46
+    assert np.allclose(values[0], values[1])
+
+    # batches_per_iter counts the accumulated batches
+    model = SoftmaxModel(dim)
+    algorithm = SGD(.1, SupervisedDummyCost(), batch_size=5,
+                    train_iteration_mode='sequential', batches_per_iter=2,
+                    accumulate_steps=2)
+    algorithm.setup(model=model, dataset=dataset)
+    algorithm.train(dataset)
+    assert model.monitor.get_batches_seen() == 2
+    assert model.monitor.get_examples_seen() == 20
+
+
+def test_parallel_sgd():
+    """
+    Checks that ParallelSGD trains like SGD with the same batches,
+    including batches smaller than the number of processes.
+    """
+    dim = 3
+    rng = np.random.RandomState([2015, 5, 12])
+    # The last batch has 2 examples for 3 processes
+    dataset = DenseDesignMatrix(X=rng.randn(22, dim), y=rng.randn(22, dim))
+
+    values = []
+    for num_workers in [None, 1, 3]:
+        model = SoftmaxModel(dim)
+        kwargs = dict(cost=SupervisedDummyCost(), batch_size=10,
+                      learning_rule=Momentum(.5),
+                      train_iteration_mode='sequential')
+        if num_workers is None:
+            algorithm = SGD(.1, **kwargs)
+        else:
+            algorithm = ParallelSGD(.1, num_workers=num_workers, **kwargs)
+        algorithm.setup(model=model, dataset=dataset)
+        try:
+            for epoch in xrange(2):
+                algorithm.train(dataset)
+        finally:
+            if num_workers is not None:
+                algorithm.stop_workers()
+        values.append(model.P.get_value())
+        assert model.monitor.get_batches_seen() == 6
+        assert model.monitor.get_examples_seen() == 44
+
+    assert np.allclose(values[0], values[1])
+    assert np.allclose(values[0], values[2])
+
+
+def test_train_prefetch_closed_on_error():
+    """
+    Checks that the prefetching thread of the training iterator is
+    stopped when training fails in the middle of an epoch.
+    """
+    dim = 3
+    rng = np.random.RandomState([2015, 5, 20])
+    dataset = DenseDesignMatrix(X=rng.randn(40, dim))
+    model = SoftmaxModel(dim)
+
+    def fail(algorithm):
+        raise ValueError("Failed update callback")
+    algorithm = SGD(0.01, DummyCost(), batch_size=5,
+                    train_iteration_mode='sequential', train_prefetch=2,
+                    update_callbacks=[fail])
+    algorithm.setup(model=model, dataset=dataset)
+    try:
+        algorithm.train(dataset)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("The update callback did not fail.")
+    assert not any(thread.name == 'FiniteDatasetIterator'
+                   for thread in threading.enumerate())
+
+
+def test_old_pickle():
+    """
+    Checks that an SGD pickled before its newer attributes existed can be
+    set up and trained again.
+    """
+    dim = 3
+    rng = np.random.RandomState([2015, 5, 21])
+    dataset = DenseDesignMatrix(X=rng.randn(20, dim))
+    model = SoftmaxModel(dim)
+    algorithm = SGD(0.01, DummyCost(), batch_size=5,
+                    train_iteration_mode='sequential',
+                    monitoring_dataset=dataset,
+                    termination_criterion=EpochCounter(1))
+    for name in ['train_prefetch', 'train_reuse_buffers',
+                 'fuse_train_monitoring', 'stage_batches', 'updates_per_call',
+                 'accumulate_steps', '_fused_dataset_name', '_fused_channels',
+                 '_fused_accumulators', '_epoch_rng_state',
+                 '_batches_this_epoch', '_resume_state', 'phase_timer',
+                 'data_wait_seconds']:
+        delattr(algorithm, name)
+    algorithm = pickle.loads(pickle.dumps(algorithm))
+    algorithm.setup(model=model, dataset=dataset)
+    algorithm.train(dataset)
+
+
 if __name__ == '__main__':
     test_monitor_based_lr()
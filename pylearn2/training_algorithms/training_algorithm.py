@@ -60,6 +60,33 @@ class TrainingAlgorithm(object):
         """
         raise NotImplementedError()
 
+    def get_state(self):
+        """
+        Returns the state of the algorithm that is not stored in the model,
+        like the accumulators of the learning rule or the state of the
+        random number generators, so that training can be resumed exactly
+        after a crash.
+
+        Returns
+        -------
+        state : object or None
+            A picklable object to pass to `set_state`, or None if the
+            algorithm does not support resuming.
+        """
+        return None
+
+    def set_state(self, state):
+        """
+        Restores a state returned by `get_state`. Called after `setup`.
+
+        Parameters
+        ----------
+        state : object
+            A state returned by `get_state`.
+        """
+        raise NotImplementedError(str(type(self)) + " does not implement "
+                                  "set_state.")
+
     def _set_monitoring_dataset(self, monitoring_dataset):
         """
         .. todo::
@@ -377,7 +377,13 @@ def function(*args, **kwargs):
     A wrapper around theano.function that disables the on_unused_input error.
     Almost no part of pylearn2 can assume that an unused input is an error, so
     the default from theano is inappropriate for this project.
+
+    The function is also profiled if `pylearn2.utils.compile.start_profiling`
+    was called.
     """
+    from pylearn2.utils.compile import profile_stats
+    if kwargs.get('profile') is None:
+        kwargs['profile'] = profile_stats(kwargs.get('name'))
     return theano.function(*args, on_unused_input='ignore', **kwargs)
 
 
@@ -0,0 +1,358 @@
+"""
+Compact storage of the history of the monitoring channels.
+
+The records of a :py:class:`pylearn2.monitor.MonitorChannel` (values,
+counters and times of every monitoring step) are stored in
+:py:class:`ChannelRecord` objects, growable typed arrays that behave like
+the lists they replace but pickle as a single array instead of one boxed
+numpy scalar per entry.
+
+The monitor can also append its history to a log file beside the saved
+model (see `Monitor.set_history_path`), with one JSON line per monitoring
+step. :py:func:`load_history` reads it back without unpickling the model,
+which is what `print_monitor.py` and `plot_monitor.py` do when given such
+a file.
+"""
+__copyright__ = "Copyright 2010-2015, Universite de Montreal"
+__license__ = "3-clause BSD"
+__maintainer__ = "LISA Lab"
+__email__ = "pylearn-dev@googlegroups"
+
+import json
+import logging
+import os
+
+import numpy as np
+from theano.compat import six
+
+from pylearn2.compat import OrderedDict
+
+
+log = logging.getLogger(__name__)
+
+# Suffix replacing the extension of the save path to name the history log
+HISTORY_SUFFIX = '_monitor.jsonl'
+
+# The record fields of a channel, with the dtypes they are stored with
+RECORD_DTYPES = OrderedDict([('val_record', 'float64'),
+                             ('std_err_record', 'float64'),
+                             ('batch_record', 'int64'),
+                             ('example_record', 'int64'),
+                             ('epoch_record', 'int64'),
+                             ('time_record', 'float64')])
+
+# Names of the counters of a monitoring step in the history log
+_LOG_FIELDS = [('batch_record', 'batches'),
+               ('example_record', 'examples'),
+               ('epoch_record', 'epochs'),
+               ('time_record', 'time')]
+
+
+class ChannelRecord(object):
+    """
+    An append-only sequence of numbers stored in a growable typed array.
+
+    Supports the parts of the list interface the monitoring code uses:
+    `append`, `extend`, `+` and `+=`, `len`, indexing (slices return a new
+    ChannelRecord), assignment of an item, iteration and comparison with a
+    sequence.
+    `np.asarray` returns the recorded values without copying.
+
+    Parameters
+    ----------
+    dtype : str or numpy dtype, optional
+        The type of the recorded values.
+    values : iterable, optional
+        Initial values.
+    """
+
+    def __init__(self, dtype='float64', values=None):
+        if values is None:
+            values = []
+        data = np.asarray(list(values), dtype=dtype)
+        if data.ndim != 1:
+            raise ValueError("ChannelRecord expects a sequence of scalars, "
+                             "got an array of shape %s" % str(data.shape))
+        self._data = data
+        self._len = len(data)
+
+    @property
+    def dtype(self):
+        """
+        The type of the recorded values.
+        """
+        return self._data.dtype
+
+    def _grow(self):
+        """
+        Doubles the capacity of the underlying array.
+        """
+        data = np.empty(max(16, 2 * len(self._data)), dtype=self._data.dtype)
+        data[:self._len] = self._data[:self._len]
+        self._data = data
+
+    def append(self, value):
+        """
+        Appends a value at the end of the record.
+
+        Parameters
+        ----------
+        value : scalar
+            The value, converted to the dtype of the record.
+        """
+        if self._len == len(self._data):
+            self._grow()
+        self._data[self._len] = value
+        self._len += 1
+
+    def extend(self, values):
+        """
+        Appends each element of `values` at the end of the record.
+
+        Parameters
+        ----------
+        values : iterable
+            The values.
+        """
+        for value in values:
+            self.append(value)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __add__(self, values):
+        rval = ChannelRecord(self.dtype, self)
+        rval.extend(values)
+        return rval
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self._data[:self._len]
+        if dtype is not None:
+            arr = arr.astype(dtype)
+        return arr
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ChannelRecord(self.dtype,
+                                 self._data[:self._len][index])
+        return self._data[:self._len][index]
+
+    def __setitem__(self, index, value):
+        self._data[:self._len][index] = value
+
+    def __iter__(self):
+        return iter(self._data[:self._len])
+
+    def __eq__(self, other):
+        try:
+            other = list(other)
+        except TypeError:
+            return False
+        return len(other) == self._len and all(a == b for a, b in
+                                               zip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ChannelRecord(%r, %r)' % (str(self.dtype), list(self))
+
+    def __getstate__(self):
+        # Only pickle the recorded values, not the spare capacity
+        return {'dtype': str(self.dtype),
+                'data': self._data[:self._len].copy()}
+
+    def __setstate__(self, d):
+        self._data = d['data']
+        self._len = len(self._data)
+
+
+def as_record(values, field):
+    """
+    Converts a record of a channel to a ChannelRecord.
+
+    Parameters
+    ----------
+    values : sequence
+        The recorded values, e.g. a list from an old pickle file.
+    field : str
+        The name of the record, a key of `RECORD_DTYPES`.
+
+    Returns
+    -------
+    record : ChannelRecord or list
+        The record, or `values` itself if it can not be stored as an
+        array (e.g. old pickle files with `None` in their `batch_record`).
+    """
+    if isinstance(values, ChannelRecord):
+        return values
+    try:
+        return ChannelRecord(RECORD_DTYPES[field], values)
+    except (TypeError, ValueError):
+        return values
+
+
+def history_path(save_path):
+    """
+    Returns the path of the history log of a model saved at `save_path`.
+
+    Parameters
+    ----------
+    save_path : str
+        The path the model is saved to.
+
+    Returns
+    -------
+    path : str
+        `save_path` with its extension replaced by `_monitor.jsonl`.
+    """
+    return os.path.splitext(save_path)[0] + HISTORY_SUFFIX
+
+
+def _to_json(value):
+    """
+    Converts a recorded value to a type the json module can serialize.
+    """
+    if value is None:
+        return None
+    value = np.asarray(value).item()
+    return value
+
+
+def _step_line(counters, values):
+    """
+    Formats one monitoring step as a line of the history log.
+
+    Parameters
+    ----------
+    counters : dict
+        Maps the names of the counters (see `_LOG_FIELDS`) to their
+        values.
+    values : dict
+        Maps the names of the channels to (value, standard error) pairs.
+    """
+    step = OrderedDict((name, _to_json(counters[name]))
+                       for _, name in _LOG_FIELDS)
+    step['channels'] = OrderedDict(
+        (name, [_to_json(val), _to_json(std_err)])
+        for name, (val, std_err) in sorted(six.iteritems(values)))
+    return json.dumps(step) + '\n'
+
+
+def append_step(path, counters, values):
+    """
+    Appends one monitoring step to a history log.
+
+    Parameters
+    ----------
+    path : str
+        The path of the log.
+    counters : dict
+        Maps 'batches', 'examples', 'epochs' and 'time' to their values
+        at this step.
+    values : dict
+        Maps the names of the channels to (value, standard error) pairs.
+    """
+    with open(path, 'a') as f:
+        f.write(_step_line(counters, values))
+
+
+def write_history(path, channels):
+    """
+    Writes the whole history of some channels to a new history log,
+    replacing any previous one.
+
+    Parameters
+    ----------
+    path : str
+        The path of the log.
+    channels : dict
+        Maps names to MonitorChannel objects.
+    """
+    # The channels may have been added at different times, so the steps
+    # are identified by their counters
+    steps = OrderedDict()
+    for name, channel in six.iteritems(channels):
+        std_err_record = getattr(channel, 'std_err_record',
+                                 [0.] * len(channel.val_record))
+        for i in range(len(channel.val_record)):
+            counters = dict((log_name, _to_json(getattr(channel, field)[i]))
+                            for field, log_name in _LOG_FIELDS)
+            key = tuple(counters[log_name] for _, log_name in _LOG_FIELDS)
+            if key not in steps:
+                steps[key] = (counters, {})
+            steps[key][1][name] = (channel.val_record[i],
+                                   std_err_record[i])
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'w') as f:
+        for key in sorted(steps, key=lambda k: [-1 if c is None else c
+                                                for c in k[::-1]]):
+            counters, values = steps[key]
+            f.write(_step_line(counters, values))
+    os.rename(tmp_path, path)
+
+
+class ChannelHistory(object):
+    """
+    The history of one channel, read from a history log.
+
+    It has the same record fields as a MonitorChannel, so the scripts that
+    read monitors can use it in place of one.
+
+    Parameters
+    ----------
+    name : str
+        The name of the channel.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.doc = None
+        for field, dtype in six.iteritems(RECORD_DTYPES):
+            setattr(self, field, ChannelRecord(dtype))
+
+
+def load_history(path):
+    """
+    Reads the channels from a history log.
+
+    Parameters
+    ----------
+    path : str
+        The path of the log.
+
+    Returns
+    -------
+    channels : OrderedDict
+        Maps the names of the channels to ChannelHistory objects, in the
+        order they first appear in the log.
+    """
+    channels = OrderedDict()
+    with open(path) as f:
+        for line_number, line in enumerate(f):
+            try:
+                step = json.loads(line)
+            except ValueError:
+                # The last line may be incomplete if the writer died
+                log.warning("Ignoring line %d of %s, which is not valid." %
+                            (line_number + 1, path))
+                continue
+            for name, (val, std_err) in six.iteritems(step['channels']):
+                if name not in channels:
+                    channels[name] = ChannelHistory(name)
+                channel = channels[name]
+                for field, log_name in _LOG_FIELDS:
+                    value = step[log_name]
+                    if value is None:
+                        # Missing from channels of old pickle files
+                        value = -1
+                    getattr(channel, field).append(value)
+                channel.val_record.append(val)
+                channel.std_err_record.append(std_err)
+    return channels
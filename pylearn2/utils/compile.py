@@ -1,12 +1,61 @@
-"""Utilities related to the compilation of Theano functions."""
+"""
+Utilities related to the compilation of Theano functions.
+
+Compiling the functions of big graphs, like the training function of a deep
+MLP or the monitoring functions of a DBM, can take minutes, most of it
+spent in the graph optimizer. :py:func:`cached_function` is a replacement
+for `theano.function` that stores the compiled functions in a directory
+keyed by a hash of the graph before optimization, the mode and floatX, so
+that later jobs (other folds of a cross-validation, resumed jobs, ...)
+building the same graph only have to unpickle and link them. The cache
+is enabled by setting ${PYLEARN2_FUNCTION_CACHE} to a directory.
+
+Between :py:func:`start_profiling` and :py:func:`stop_profiling`, the
+functions compiled by pylearn2 (through `cached_function`,
+`pylearn2.utils.function` or `Block.function`) are compiled with a Theano
+`ProfileStats` each, and :py:func:`write_profile_report` writes the top
+ops of all of them by time and by memory, followed by the report of each
+function.
+"""
 import functools
+import hashlib
+import logging
+import os
+
+import numpy as np
+import theano
+from theano import config
+from theano.compat import six
+from theano.compat.six.moves import cPickle
+from theano.compile import SharedVariable
+from theano.compile.profiling import ProfileStats
+from theano.gof import Constant, Op, Variable
+from theano.misc.frozendict import frozendict
+from theano.scalar import ScalarOp
+
+from pylearn2.utils.string_utils import preprocess
+from pylearn2.utils.timing import log_timing
 
 __author__ = "David Warde-Farley"
 __copyright__ = "Copyright 2012, David Warde-Farley / Universite de Montreal"
 __license__ = "3-clause BSD"
 __maintainer__ = "David Warde-Farley"
 __email__ = "wardefar@iro"
-__all__ = ["compiled_theano_function", "HasCompiledFunctions"]
+__all__ = ["compiled_theano_function", "HasCompiledFunctions",
+           "cached_function", "start_profiling", "stop_profiling",
+           "profile_stats", "write_profile_report"]
+
+log = logging.getLogger(__name__)
+
+# Environment variable holding the directory of the function cache
+FUNCTION_CACHE_VARIABLE = 'PYLEARN2_FUNCTION_CACHE'
+
+# The ProfileStats of the functions compiled since start_profiling, or None
+# when not profiling
+_profiles = None
+
+# The value of config.profile_memory before start_profiling
+_old_profile_memory = None
 
 
 def compiled_theano_function(fn):
@@ -82,3 +131,461 @@ class HasCompiledFunctions(object):
         if '_compiled_functions' in state:
             del state['_compiled_functions']
         return state
+
+
+class _Uncacheable(Exception):
+    """
+    Raised when a graph can not be identified by a hash.
+    """
+
+
+def _class_key(obj):
+    """
+    Returns the full name of the class of an object.
+    """
+    cls = obj.__class__
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+def _prop_key(value):
+    """
+    Returns a string identifying the value of a property of an Op, that
+    is the same in every process.
+    """
+    if isinstance(value, Op):
+        return _op_key(value)
+    if isinstance(value, tuple):
+        return '(%s)' % ', '.join(_prop_key(v) for v in value)
+    if isinstance(value, list):
+        return '[%s]' % ', '.join(_prop_key(v) for v in value)
+    if isinstance(value, (dict, frozendict)):
+        items = sorted((_prop_key(k), _prop_key(v))
+                       for k, v in value.items())
+        return '{%s}' % ', '.join('%s: %s' % item for item in items)
+    if isinstance(value, np.ndarray):
+        return '%s%s%s' % (value.dtype, value.shape,
+                           hashlib.sha1(value.tobytes()).hexdigest())
+    key = repr(value)
+    # The default repr of objects (and of functions, classes, ...) holds
+    # their address, which differs from one process to the next
+    if ' at 0x' in key:
+        raise _Uncacheable("%s has no repr independent of its address" %
+                           key)
+    return key
+
+
+def _op_key(op):
+    """
+    Returns a string identifying an Op and its parameters.
+    """
+    if hasattr(op, '__props__'):
+        props = _prop_key(op._props())
+    elif isinstance(op, ScalarOp):
+        props = '{%s}' % str(op)
+    else:
+        try:
+            props = hashlib.sha1(cPickle.dumps(op, 2)).hexdigest()
+        except Exception as e:
+            raise _Uncacheable("%s can not be pickled (%s)" % (op, e))
+    return _class_key(op) + props
+
+
+def _constant_key(var):
+    """
+    Returns a string identifying the value of a Constant.
+    """
+    data = var.data
+    if isinstance(data, np.ndarray) or np.isscalar(data):
+        data = np.asarray(data)
+        return '%s%s%s' % (data.dtype, data.shape,
+                           hashlib.sha1(data.tobytes()).hexdigest())
+    return repr(data)
+
+
+class _GraphDescription(object):
+    """
+    A canonical description of a graph, independent of the identity of
+    its variables, and the list of its shared variables in the order they
+    are first met.
+
+    Parameters
+    ----------
+    inputs : list of Variables
+        The explicit inputs of the function.
+    givens : list of Variables
+        The variables replaced through the `givens` of the function.
+    """
+
+    def __init__(self, inputs, givens):
+        self.lines = []
+        self.shared = []
+        self._memo = {}
+        self._inputs = dict((var, i) for i, var in enumerate(inputs))
+        self._givens = dict((var, i) for i, var in enumerate(givens))
+
+    def _add(self, line):
+        self.lines.append(line)
+        return len(self.lines) - 1
+
+    def describe(self, var):
+        """
+        Describes the graph of a variable, and returns its identifier in
+        the description.
+        """
+        stack = [var]
+        while stack:
+            v = stack[-1]
+            if v in self._memo:
+                stack.pop()
+                continue
+            if not isinstance(v, Variable):
+                raise _Uncacheable("%s is not a Variable" % str(v))
+            node = v.owner
+            if v in self._inputs:
+                self._memo[v] = self._add(('input', self._inputs[v],
+                                           str(v.type)))
+            elif v in self._givens:
+                self._memo[v] = self._add(('given', self._givens[v],
+                                           str(v.type)))
+            elif node is not None:
+                pending = [i for i in node.inputs if i not in self._memo]
+                if pending:
+                    stack.extend(reversed(pending))
+                    continue
+                line = self._add(('apply', _op_key(node.op),
+                                  [self._memo[i] for i in node.inputs],
+                                  [str(o.type) for o in node.outputs]))
+                for j, out in enumerate(node.outputs):
+                    self._memo[out] = (line, j)
+            elif isinstance(v, SharedVariable):
+                self._memo[v] = self._add(('shared', len(self.shared),
+                                           str(v.type)))
+                self.shared.append(v)
+            elif isinstance(v, Constant):
+                self._memo[v] = self._add(('constant', str(v.type),
+                                           _constant_key(v)))
+            else:
+                raise _Uncacheable("%s is not an input of the function" %
+                                   str(v))
+            stack.pop()
+        return self._memo[var]
+
+
+def _function_key(inputs, outputs, updates, givens, mode, kwargs):
+    """
+    Returns the key under which a function is stored in the cache, and
+    the shared variables of its graph, in the order the key refers to them.
+    """
+    if isinstance(updates, dict):
+        updates = list(updates.items())
+    updates = list(updates or [])
+    if isinstance(givens, dict):
+        givens = list(givens.items())
+    givens = list(givens or [])
+    single_output = outputs is None or not isinstance(outputs, (list, tuple))
+    if outputs is None:
+        outputs = []
+    elif single_output:
+        outputs = [outputs]
+
+    graph = _GraphDescription(inputs, [old for old, new in givens])
+    for var in inputs:
+        graph.describe(var)
+    key = [[graph.describe(var) for var in outputs], single_output,
+           [(graph.describe(old), graph.describe(new))
+            for old, new in givens],
+           [(graph.describe(var), graph.describe(update))
+            for var, update in updates]]
+    # theano.function adds the default updates of the shared variables it
+    # finds, which may themselves refer to new shared variables
+    if not kwargs.get('no_default_updates', False):
+        updated = set(var for var, update in updates)
+        i = 0
+        while i < len(graph.shared):
+            var = graph.shared[i]
+            default_update = getattr(var, 'default_update', None)
+            if default_update is not None and var not in updated:
+                key.append((i, graph.describe(default_update)))
+            i += 1
+    if mode is None:
+        mode = config.mode
+    key.extend([graph.lines, str(mode), config.floatX, theano.__version__,
+                sorted((name, repr(value))
+                       for name, value in six.iteritems(kwargs))])
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest(), graph.shared
+
+
+def _load_function(path, shared, name):
+    """
+    Loads a function from the cache, and makes it work on the shared
+    variables of the calling process instead of the unpickled copies.
+    """
+    with open(path, 'rb') as f:
+        func, positions = cPickle.load(f)
+    unpickled = [i.variable for i in func.maker.inputs if i.shared]
+    swap = dict(zip(unpickled, [shared[p] for p in positions]))
+    return func.copy(swap=swap, name=name)
+
+
+def _store_function(path, func, shared):
+    """
+    Stores a function in the cache, with the positions of its shared
+    variables in the list of shared variables of the graph description.
+    """
+    positions = []
+    for i in func.maker.inputs:
+        if i.shared:
+            matches = [p for p, var in enumerate(shared) if var is i.variable]
+            if len(matches) == 0:
+                raise _Uncacheable("%s is not in the graph" % i.variable)
+            positions.append(matches[0])
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    try:
+        with open(tmp_path, 'wb') as f:
+            cPickle.dump((func, positions), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def cached_function(inputs, outputs=None, mode=None, updates=None,
+                    givens=None, name=None, cache_dir=None, **kwargs):
+    """
+    A replacement for `theano.function` that reuses the functions compiled
+    by previous jobs.
+
+    The key of a function is a hash of its graph before optimization (the
+    ops, their parameters and the values of the constants, but not the
+    values of the shared variables), of the mode, of floatX and of the
+    version of Theano. On a hit, the function is unpickled, which does not
+    run the optimizer, and linked to the shared variables of the caller.
+    Hits and misses are reported through `log_timing`.
+
+    Parameters
+    ----------
+    inputs, outputs, mode, updates, givens, name : WRITEME
+        As for `theano.function`.
+    cache_dir : str, optional
+        The directory of the cache. Defaults to ${PYLEARN2_FUNCTION_CACHE}.
+        If it is not set either, the function is compiled without cache.
+    kwargs : dict
+        Other arguments of `theano.function`.
+
+    Returns
+    -------
+    func : theano.compile.Function
+        The compiled function.
+    """
+    def compile_function():
+        return theano.function(inputs, outputs, mode=mode, updates=updates,
+                               givens=givens, name=name, **kwargs)
+
+    if kwargs.get('profile') is None and _profiles is not None:
+        kwargs['profile'] = profile_stats(name)
+    if cache_dir is None:
+        cache_dir = os.environ.get(FUNCTION_CACHE_VARIABLE)
+    # RecordMode and profiling need the function to be compiled in this
+    # process
+    if (cache_dir is None or hasattr(mode, 'record') or
+            kwargs.get('profile') or config.profile):
+        return compile_function()
+    cache_dir = preprocess(cache_dir)
+    try:
+        key, shared = _function_key(list(inputs), outputs, updates, givens,
+                                    mode, kwargs)
+    except _Uncacheable as e:
+        log.debug("Can not cache %s: %s" % (name, e))
+        return compile_function()
+    path = os.path.join(cache_dir, key + '.pkl')
+
+    if os.path.exists(path):
+        try:
+            with log_timing(log, 'Function cache hit for %s, loading %s' %
+                            (name, key)):
+                return _load_function(path, shared, name)
+        except Exception as e:
+            log.warning("Could not load %s from the function cache (%s), "
+                        "compiling it." % (name, e))
+
+    with log_timing(log, 'Function cache miss for %s, compiling' % name):
+        func = compile_function()
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        _store_function(path, func, shared)
+    except Exception as e:
+        log.warning("Could not store %s in the function cache (%s)." %
+                    (name, e))
+    return func
+
+
+def start_profiling(memory=True):
+    """
+    Makes the functions compiled by pylearn2 from now on collect Theano
+    profiling information, until `stop_profiling` is called. Does nothing
+    if profiling was already started.
+
+    Parameters
+    ----------
+    memory : bool, optional
+        If True, `config.profile_memory` is also set, so that the shapes of
+        the intermediate results are recorded.
+    """
+    global _profiles, _old_profile_memory
+    if _profiles is not None:
+        return
+    _profiles = []
+    _old_profile_memory = config.profile_memory
+    if memory:
+        config.profile_memory = True
+
+
+def stop_profiling():
+    """
+    Stops compiling the functions with profiling.
+
+    Returns
+    -------
+    profiles : list
+        The ProfileStats of the functions compiled since `start_profiling`.
+    """
+    global _profiles, _old_profile_memory
+    profiles = _profiles
+    if profiles is None:
+        return []
+    _profiles = None
+    config.profile_memory = _old_profile_memory
+    _old_profile_memory = None
+    return profiles
+
+
+def profiling_enabled():
+    """
+    Tells whether `start_profiling` was called and `stop_profiling` was
+    not called since.
+    """
+    return _profiles is not None
+
+
+def profile_stats(name=None):
+    """
+    Returns the value to give as the `profile` argument of
+    `theano.function`.
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of the function, used in the report.
+
+    Returns
+    -------
+    profile : ProfileStats or None
+        A new ProfileStats registered for the report if profiling,
+        otherwise None.
+    """
+    if _profiles is None:
+        return None
+    profile = ProfileStats(atexit_print=False,
+                           message=name if name is not None else 'unnamed')
+    _profiles.append(profile)
+    return profile
+
+
+def _node_memory(profile):
+    """
+    Returns the number of bytes of the outputs of each node of a profiled
+    function, for the nodes whose output shapes were recorded.
+    """
+    shapes = getattr(profile, 'variable_shape', {})
+    rval = {}
+    for node in profile.apply_time:
+        total = 0
+        for output in node.outputs:
+            shape = shapes.get(output)
+            dtype = getattr(output.type, 'dtype', None)
+            if shape is None or dtype is None or not isinstance(shape,
+                                                                tuple):
+                continue
+            total += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        rval[node] = total
+    return rval
+
+
+def _write_top(f, title, totals, calls, unit, n):
+    """
+    Writes the `n` largest entries of `totals` to `f`, as a table.
+    """
+    f.write('%s\n' % title)
+    grand_total = sum(totals.values())
+    if grand_total == 0:
+        f.write('  No data.\n\n')
+        return
+    f.write('  %12s %7s %9s  %s\n' % (unit, '%', 'calls', 'name'))
+    for name, value in sorted(six.iteritems(totals),
+                              key=lambda item: -item[1])[:n]:
+        f.write('  %12.6g %6.2f%% %9d  %s\n' %
+                (value, 100. * value / grand_total, calls.get(name, 0),
+                 name))
+    f.write('\n')
+
+
+def write_profile_report(path, profiles=None, n_ops=20):
+    """
+    Writes the profiling report of the functions compiled with profiling.
+
+    The report starts with the ops taking the most time and producing the
+    most memory over all the functions, aggregated by op class and by
+    op, then has the report of Theano for each function that was called.
+
+    Parameters
+    ----------
+    path : str
+        The path of the report.
+    profiles : list, optional
+        The ProfileStats to report. Defaults to those registered since
+        `start_profiling`.
+    n_ops : int, optional
+        The number of ops listed in each table.
+    """
+    if profiles is None:
+        profiles = _profiles if _profiles is not None else []
+    profiles = [profile for profile in profiles if profile.fct_callcount > 0]
+    class_time, class_calls = {}, {}
+    op_time, op_calls = {}, {}
+    class_memory, op_memory = {}, {}
+    for profile in profiles:
+        memory = _node_memory(profile)
+        for node, t in six.iteritems(profile.apply_time):
+            calls = profile.apply_callcount.get(node, 0)
+            class_name = type(node.op).__name__
+            op_name = str(node.op)
+            for totals, counts, key in [(class_time, class_calls,
+                                         class_name),
+                                        (op_time, op_calls, op_name)]:
+                totals[key] = totals.get(key, 0.) + t
+                counts[key] = counts.get(key, 0) + calls
+            class_memory[class_name] = (class_memory.get(class_name, 0) +
+                                        memory.get(node, 0))
+            op_memory[op_name] = op_memory.get(op_name, 0) + \
+                memory.get(node, 0)
+
+    with open(preprocess(path), 'w') as f:
+        total_time = sum(profile.fct_call_time for profile in profiles)
+        total_calls = sum(profile.fct_callcount for profile in profiles)
+        f.write('Profile of %d pylearn2 functions, %g seconds in %d calls\n'
+                '\n' % (len(profiles), total_time, total_calls))
+        _write_top(f, 'Op classes by time', class_time, class_calls,
+                   'seconds', n_ops)
+        _write_top(f, 'Ops by time', op_time, op_calls, 'seconds', n_ops)
+        _write_top(f, 'Op classes by output memory (last call)',
+                   class_memory, class_calls, 'bytes', n_ops)
+        _write_top(f, 'Ops by output memory (last call)', op_memory,
+                   op_calls, 'bytes', n_ops)
+        for profile in sorted(profiles,
+                              key=lambda profile: -profile.fct_call_time):
+            profile.summary(file=f, n_ops_to_print=n_ops,
+                            n_apply_to_print=n_ops)
+            f.write('\n')
+    log.info('Wrote the profile of %d functions to %s' %
+             (len(profiles), path))
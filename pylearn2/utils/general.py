@@ -3,6 +3,8 @@
 
     WRITEME
 """
+import multiprocessing
+
 import numpy as np
 
 
@@ -114,3 +116,24 @@ def isfinite(arr):
     a boolean array with the same shape as the input array.
     """
     return np.isfinite(np.max(arr)) and np.isfinite(np.min(arr))
+
+
+def fork_context():
+    """
+    Returns the `multiprocessing` context starting the processes by
+    forking.
+
+    Worker processes relying on inheriting the state of this process
+    (compiled functions, datasets, shared memory, ...) must be started
+    from it: the 'spawn' and 'forkserver' start methods, the defaults on
+    some platforms, pickle the target and its arguments instead.
+
+    Returns
+    -------
+    context : module or multiprocessing context
+        An object with the API of the `multiprocessing` module.
+    """
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    # Before Python 3.4, processes are always forked on POSIX systems
+    return multiprocessing
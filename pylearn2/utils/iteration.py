@@ -14,12 +14,19 @@ Presets:
 - random_uniform: on each call to next, returns a random subset of the
   dataset. Samples with replacement, but still reports that
   container is empty after num_examples / batch_size calls
+- block_shuffled: shuffles the order of contiguous chunks of the
+  dataset, then shuffles examples within a small window of chunks.
+  Meant for datasets stored on disk, where random access is slow
 """
 from __future__ import division
 
+import sys
+import threading
+import time
 import warnings
 import numpy as np
 from theano.compat import six
+from theano.compat.six.moves import copyreg, queue, xrange
 
 from pylearn2.space import CompositeSpace
 from pylearn2.utils import safe_izip, wraps
@@ -645,6 +652,172 @@ class BatchwiseShuffledSequentialIterator(SequentialSubsetIterator):
     uniform_batch_size = False
 
 
+class BlockShuffledSubsetIterator(ShuffledSequentialSubsetIterator):
+    """
+    Shuffles the order of contiguous chunks of examples, then shuffles
+    the examples within consecutive windows of `window_chunks` chunks.
+
+    This is a compromise between sequential and fully shuffled
+    iteration for datasets that are read from disk (`HDF5Dataset`,
+    `DenseDesignMatrixPyTables`, memory-mapped arrays): every batch
+    only touches a handful of chunks, so it can be read with a few
+    large contiguous reads, while the order of the examples is still
+    randomized at two levels.
+
+    Parameters
+    ----------
+    dataset_size : int
+        The number of examples, total, in the dataset.
+    batch_size : int, optional
+        See :py:class:`SubsetIterator`.
+    num_batches : int, optional
+        See :py:class:`SubsetIterator`.
+    rng : `np.random.RandomState` or seed, optional
+        See :py:class:`SubsetIterator`.
+    chunk_size : int, optional
+        The number of contiguous examples in a chunk. For best
+        performance it should be a multiple of the storage chunk size
+        of the dataset (e.g. `h5py.Dataset.chunks[0]`). Defaults to the
+        `chunk_size` class attribute.
+    window_chunks : int, optional
+        The number of chunks whose examples are shuffled together,
+        i.e. that need to be held in memory at the same time. Defaults
+        to the `window_chunks` class attribute.
+
+    Notes
+    -----
+    Returns lists of indices (`fancy = True`). The indices of a batch
+    are sorted in increasing order, so that storage backends can
+    coalesce them into contiguous reads.
+
+    Because the dataset constructs the iterator with the standard
+    arguments only, use :py:func:`block_shuffled` to obtain a version
+    of this class with other defaults for `chunk_size` and
+    `window_chunks`.
+    """
+    stochastic = True
+    fancy = True
+    uniform_batch_size = False
+
+    chunk_size = 1024
+    window_chunks = 8
+
+    def __init__(self, dataset_size, batch_size, num_batches, rng=None,
+                 chunk_size=None, window_chunks=None):
+        SequentialSubsetIterator.__init__(self,
+                                          dataset_size,
+                                          batch_size,
+                                          num_batches,
+                                          None)
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        if window_chunks is not None:
+            self.window_chunks = window_chunks
+        if self.chunk_size <= 0 or self.window_chunks <= 0:
+            raise ValueError("chunk_size and window_chunks must be positive, "
+                             "got %s and %s" % (self.chunk_size,
+                                                self.window_chunks))
+        self._rng = make_np_rng(rng, which_method=["permutation",
+                                                   "shuffle"])
+        self._shuffled = self._block_permutation()
+
+    def _block_permutation(self):
+        """
+        Returns a permutation of the example indices, built by shuffling
+        the order of the chunks, then the examples within each window of
+        chunks.
+        """
+        size = self._dataset_size
+        num_chunks = int(np.ceil(size / self.chunk_size))
+        chunk_order = self._rng.permutation(num_chunks)
+        windows = []
+        for start in xrange(0, num_chunks, self.window_chunks):
+            window = np.concatenate([
+                np.arange(c * self.chunk_size,
+                          min((c + 1) * self.chunk_size, size))
+                for c in chunk_order[start:start + self.window_chunks]
+            ])
+            self._rng.shuffle(window)
+            windows.append(window)
+        if len(windows) == 0:
+            return np.arange(0)
+        return np.concatenate(windows)
+
+    @wraps(SubsetIterator.next)
+    def next(self):
+        return np.sort(
+            super(BlockShuffledSubsetIterator, self).next())
+
+    def __next__(self):
+        return self.next()
+
+
+def block_shuffled(chunk_size=None, window_chunks=None):
+    """
+    Returns a subclass of :py:class:`BlockShuffledSubsetIterator` with
+    the given defaults for `chunk_size` and `window_chunks`.
+
+    The result can be used wherever an iteration mode is expected, e.g.
+    in a YAML file:
+
+    .. code-block:: none
+
+        train_iteration_mode: !obj:pylearn2.utils.iteration.block_shuffled {
+            chunk_size: 4096,
+            window_chunks: 4,
+        }
+
+    Parameters
+    ----------
+    chunk_size : int, optional
+        See :py:class:`BlockShuffledSubsetIterator`.
+    window_chunks : int, optional
+        See :py:class:`BlockShuffledSubsetIterator`.
+
+    Returns
+    -------
+    class
+        A subclass of :py:class:`BlockShuffledSubsetIterator`. The same
+        arguments give the same class, which can be pickled (e.g. with
+        the monitor using it as iteration mode).
+    """
+    args = (chunk_size, window_chunks)
+    if args not in _block_shuffled_classes:
+        dct = {'_block_shuffled_args': args}
+        if chunk_size is not None:
+            dct['chunk_size'] = chunk_size
+        if window_chunks is not None:
+            dct['window_chunks'] = window_chunks
+        _block_shuffled_classes[args] = _BlockShuffledType(
+            "BlockShuffledSubsetIterator_%s_%s" % args,
+            (BlockShuffledSubsetIterator,), dct)
+    return _block_shuffled_classes[args]
+
+
+class _BlockShuffledType(type):
+    """
+    Metaclass of the classes returned by :py:func:`block_shuffled`,
+    which are not attributes of the module, so they are pickled as the
+    call to `block_shuffled` that makes them (see
+    `_reduce_block_shuffled`).
+    """
+
+
+def _reduce_block_shuffled(cls):
+    """
+    Pickles a class made by :py:func:`block_shuffled`.
+    """
+    if '_block_shuffled_args' not in cls.__dict__:
+        # A subclass defined in a module, pickled by name as usual
+        return cls.__name__
+    return block_shuffled, cls._block_shuffled_args
+
+copyreg.pickle(_BlockShuffledType, _reduce_block_shuffled)
+
+# The classes made by block_shuffled, by arguments
+_block_shuffled_classes = {}
+
+
 class EvenSequencesSubsetIterator(SubsetIterator):
     """
     An iterator for datasets with sequential data (e.g. list of words)
@@ -775,6 +948,8 @@ _iteration_schemes = {
     'even_batchwise_shuffled_sequential':
     as_even(BatchwiseShuffledSequentialIterator),
     'even_sequences': EvenSequencesSubsetIterator,
+    'block_shuffled': BlockShuffledSubsetIterator,
+    'even_block_shuffled': as_even(BlockShuffledSubsetIterator),
 }
 
 
@@ -855,6 +1030,25 @@ class FiniteDatasetIterator(object):
         A list of callables, in the same order as the sources
         in `data_specs`, that will be called on the individual
         source batches prior to any further processing.
+    prefetch : int, optional
+        If specified and positive, batches are retrieved and converted
+        on a background thread, which keeps a queue of at most
+        `prefetch` ready batches ahead of the consumer. The total time
+        (in seconds) the consumer spent waiting on an empty queue is
+        available as `starvation_time`.
+        The time spent in the conversion functions, on whichever thread
+        retrieves the batches, is available as `conversion_time`.
+    reuse_buffers : int, optional
+        If specified and positive, batches requested with lists of
+        indices (i.e. by shuffled iteration schemes) are gathered with
+        `numpy.take` into a ring of `reuse_buffers` preallocated buffers
+        per source, instead of allocating a new array for every batch.
+        A batch, and anything the conversion functions return that
+        shares memory with it, is then only valid until the ring wraps
+        around, `reuse_buffers` batches later. When used together with
+        `prefetch`, it must be at least `prefetch + 2`. Only applies to
+        datasets accessed through `get_data` (e.g. `DenseDesignMatrix`)
+        whose sources are numpy arrays.
 
     Notes
     -----
@@ -865,14 +1059,42 @@ class FiniteDatasetIterator(object):
     identifiers and a list or slice of indexes and returns a tuple of batches
     of examples, one for each source. The old interface using `get_data` is
     still supported for the moment being.
+
+    When prefetching, the dataset and the conversion functions are accessed
+    from the background thread, so they must not be modified by the
+    consumer while iterating.
     """
 
     def __init__(self, dataset, subset_iterator, data_specs=None,
-                 return_tuple=False, convert=None):
+                 return_tuple=False, convert=None, prefetch=None,
+                 reuse_buffers=None):
         self._data_specs = data_specs
         self._dataset = dataset
         self._subset_iterator = subset_iterator
         self._return_tuple = return_tuple
+        if prefetch is not None and prefetch < 0:
+            raise ValueError("prefetch must be a non-negative integer, "
+                             "got %s" % str(prefetch))
+        self._prefetch = prefetch
+        self._prefetch_queue = None
+        self._prefetch_thread = None
+        self._prefetch_stop = None
+        self._prefetch_done = False
+        self.starvation_time = 0.
+        self.conversion_time = 0.
+        if reuse_buffers:
+            if prefetch and reuse_buffers < prefetch + 2:
+                raise ValueError("reuse_buffers must be at least prefetch + "
+                                 "2 (%d) so that prefetched batches do not "
+                                 "overwrite the current one, got %d" %
+                                 (prefetch + 2, reuse_buffers))
+            if hasattr(dataset, 'get'):
+                warnings.warn("reuse_buffers is ignored for %s, which "
+                              "provides its own get method." %
+                              dataset.__class__.__name__)
+        self._reuse_buffers = reuse_buffers
+        self._buffers = {}
+        self._buffer_slot = 0
 
         # Keep only the needed sources in self._raw_data.
         # Remember what source they correspond to in self._source
@@ -975,32 +1197,150 @@ class FiniteDatasetIterator(object):
         StopIteration
             When there are no more batches to return.
         """
+        if self._prefetch:
+            rval = self._next_prefetched()
+        else:
+            rval = self._next_batch()
+
+        if not self._return_tuple and len(rval) == 1:
+            rval, = rval
+        return rval
+
+    def _next_batch(self):
         next_index = self._subset_iterator.next()
         # If the dataset is incompatible with the new interface, fall back to
         # the old one
         if hasattr(self._dataset, 'get'):
-            rval = self._next(next_index)
+            return self._next(next_index)
         else:
-            rval = self._fallback_next(next_index)
+            return self._fallback_next(next_index)
 
-        if not self._return_tuple and len(rval) == 1:
-            rval, = rval
-        return rval
+    def skip(self, num_batches):
+        """
+        Advances the iterator by `num_batches` batches without retrieving
+        them, e.g. to resume an epoch that was interrupted.
+
+        The subset iterator makes the same calls to its random number
+        generator as if the batches had been retrieved, so the rest of the
+        epoch is the same.
+
+        Parameters
+        ----------
+        num_batches : int
+            The number of batches to skip.
+
+        Raises
+        ------
+        StopIteration
+            If there are fewer than `num_batches` batches left.
+        """
+        if self._prefetch_thread is not None:
+            raise ValueError("FiniteDatasetIterator.skip can only be called "
+                             "before prefetching starts.")
+        for i in xrange(num_batches):
+            self._subset_iterator.next()
+
+    def _next_prefetched(self):
+        if self._prefetch_done:
+            raise StopIteration()
+        if self._prefetch_thread is None:
+            self._start_prefetching()
+
+        t0 = time.time()
+        has_batch, value = self._prefetch_queue.get()
+        self.starvation_time += time.time() - t0
+
+        if has_batch:
+            return value
+        self._prefetch_done = True
+        if value is None:
+            raise StopIteration()
+        six.reraise(*value)
+
+    def _start_prefetching(self):
+        self._prefetch_queue = queue.Queue(maxsize=self._prefetch)
+        self._prefetch_stop = threading.Event()
+        self._prefetch_thread = threading.Thread(target=self._prefetch_loop,
+                                                 name='FiniteDatasetIterator')
+        self._prefetch_thread.daemon = True
+        self._prefetch_thread.start()
+
+    def _prefetch_loop(self):
+        # Items are (True, batch) pairs, terminated by (False, None) at the
+        # end of the iteration or (False, exc_info) if an error occurred.
+        try:
+            while not self._prefetch_stop.is_set():
+                try:
+                    item = (True, self._next_batch())
+                except StopIteration:
+                    item = (False, None)
+                self._prefetch_put(item)
+                if not item[0]:
+                    return
+        except Exception:
+            self._prefetch_put((False, sys.exc_info()))
+
+    def _prefetch_put(self, item):
+        while not self._prefetch_stop.is_set():
+            try:
+                self._prefetch_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        """
+        Stops the background prefetching thread, if any, discarding the
+        batches that were prefetched but not consumed yet.
+        """
+        if self._prefetch_thread is not None:
+            self._prefetch_stop.set()
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+        self._prefetch_done = True
 
     def _next(self, next_index):
-        return tuple(
-            fn(batch) if fn else batch for batch, fn in
-            safe_izip(self._dataset.get(self._source, next_index),
-                      self._convert)
+        return self._apply_convert(self._dataset.get(self._source,
+                                                     next_index))
+
+    def _apply_convert(self, batches):
+        t0 = time.time()
+        rval = tuple(
+            fn(batch) if fn else batch
+            for batch, fn in safe_izip(batches, self._convert)
         )
+        self.conversion_time += time.time() - t0
+        return rval
 
     def _fallback_next(self, next_index):
-        # TODO: handle fancy-index copies by allocating a buffer and
-        # using np.take()
-        return tuple(
-            fn(data[next_index]) if fn else data[next_index]
-            for data, fn in safe_izip(self._raw_data, self._convert)
-        )
+        if self._reuse_buffers and not isinstance(next_index, slice):
+            slot = self._buffer_slot
+            self._buffer_slot = (slot + 1) % self._reuse_buffers
+            batches = [self._take(i, data, next_index, slot)
+                       for i, data in enumerate(self._raw_data)]
+        else:
+            batches = [data[next_index] for data in self._raw_data]
+        return self._apply_convert(batches)
+
+    def _take(self, source_idx, data, next_index, slot):
+        """
+        Gathers the examples `next_index` of `data` into the buffer
+        number `slot` of the ring of buffers of source `source_idx`.
+        """
+        if not isinstance(data, np.ndarray):
+            return data[next_index]
+        num_examples = len(next_index)
+        buf = self._buffers.get((source_idx, slot))
+        if buf is None or buf.shape[0] < num_examples:
+            size = max(num_examples, int(self.batch_size))
+            buf = np.empty((size,) + data.shape[1:], dtype=data.dtype)
+            self._buffers[(source_idx, slot)] = buf
+        out = buf[:num_examples]
+        # The indices come from the subset iterator and are known to be
+        # valid. Unlike the default 'raise' mode, 'clip' lets numpy write
+        # directly into `out` without an intermediate copy.
+        np.take(data, next_index, axis=0, out=out, mode='clip')
+        return out
 
     def __next__(self):
         return self.next()
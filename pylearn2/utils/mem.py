@@ -5,6 +5,7 @@
 """
 import subprocess
 import os
+import sys
 
 
 def get_memory_usage():
@@ -18,10 +19,29 @@ def get_memory_usage():
                                     shell=True,
                                     stdout=subprocess.PIPE,
                                     )
-    stdout_list = process.communicate()[0].split('\n')
+    stdout_list = process.communicate()[0].decode('ascii').split('\n')
     return int(stdout_list[0])
 
 
+def get_peak_memory_usage():
+    """
+    Return int containing the peak resident memory of this process since
+    it started, in kilobytes like `get_memory_usage`. Falls back to the
+    current usage where the resource module is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return get_memory_usage()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # ru_maxrss is in bytes on Mac OS X
+        peak //= 1024
+    # The kernel updates ru_maxrss lazily, so it can lag behind the
+    # current usage by a few pages
+    return max(int(peak), get_memory_usage())
+
+
 def improve_memory_error_message(error, msg=""):
     """
     Raises a TypicalMemoryError if the MemoryError has no messages
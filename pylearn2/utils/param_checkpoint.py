@@ -0,0 +1,463 @@
+"""
+Checkpoints holding only the parameters of a model.
+
+A pickled model carries everything reachable from it: the monitor and its
+history, the compiled functions it caches, the YAML of the dataset, ...
+Inference tools only need the parameter values. :py:func:`save_params`
+writes `Model.get_param_values()` to a single uncompressed `.npz` file,
+together with the YAML description of the model and a fingerprint of its
+structure (the class of the model and the name, shape and dtype of each
+parameter). :py:func:`load_model` builds the model from the YAML and sets
+its parameters from the file, after checking the fingerprint. The
+parameters are memory-mapped, so only the pages that are actually used
+are read, and loading can be restricted to some of the layers of an MLP.
+`serial.load` calls :py:func:`load_model` when given such a file.
+
+A checkpoint can be saved as a delta against a previous one (`base`): the
+parameters whose values did not change, like those of frozen layers, are
+then not written again, but referenced in the file that holds them.
+"""
+import json
+import logging
+import os
+import struct
+import uuid
+import zipfile
+
+import numpy as np
+from theano.compat import six
+
+from pylearn2.utils.string_utils import preprocess
+
+
+log = logging.getLogger(__name__)
+
+# Suffix replacing the extension of the save path to name the checkpoint
+PARAMS_SUFFIX = '_params.npz'
+
+# Version of the format, stored in the metadata
+FORMAT_VERSION = 1
+
+# Name of the member of the .npz file holding the metadata
+_METADATA_KEY = '__param_checkpoint__'
+
+# Layout of the local file header of a member of a zip file
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+# Alignment of the members of a checkpoint, so that the data of the .npy
+# files (whose headers are padded to a multiple of 16 or 64 bytes) can be
+# memory-mapped and used in place
+_ALIGNMENT = 64
+
+# Id of the extra field padding the local file headers, the one used by
+# Android's zipalign
+_PADDING_EXTRA_ID = 0xD935
+
+# Size of the zip64 extra field zipfile adds to the local file header of
+# large members
+_ZIP64_EXTRA_SIZE = 20
+
+
+def params_path(save_path):
+    """
+    Returns the path of the parameter checkpoint of a model saved at
+    `save_path`.
+
+    Parameters
+    ----------
+    save_path : str
+        The path the model is saved to.
+
+    Returns
+    -------
+    path : str
+        `save_path` with its extension replaced by `_params.npz`.
+    """
+    return os.path.splitext(save_path)[0] + PARAMS_SUFFIX
+
+
+def _param_layers(model):
+    """
+    Maps the ids of the parameters of a model with a `layers` attribute,
+    like an MLP, to the names of the layers they belong to.
+    """
+    owners = {}
+    for layer in getattr(model, 'layers', []):
+        get_params = getattr(layer, 'get_params', None)
+        if get_params is None:
+            continue
+        for param in get_params():
+            owners[id(param)] = getattr(layer, 'layer_name', None)
+    return owners
+
+
+def fingerprint(model, values=None):
+    """
+    Describes the structure of a model.
+
+    Parameters
+    ----------
+    model : Model
+        The model.
+    values : list, optional
+        The values of the parameters of the model, if already available.
+
+    Returns
+    -------
+    fingerprint : dict
+        'model_class' is the full name of the class of the model, and
+        'params' is a list with the name, shape and dtype of each
+        parameter, in the order of `model.get_params()`.
+    """
+    params = model.get_params()
+    if values is None:
+        values = [param.get_value(borrow=True) for param in params]
+    cls = model.__class__
+    return {'model_class': '%s.%s' % (cls.__module__, cls.__name__),
+            'params': [[param.name, list(value.shape), str(value.dtype)]
+                       for param, value in zip(params, values)]}
+
+
+def check_fingerprint(expected, actual, filepath):
+    """
+    Raises a ValueError if the model described by `actual` can not use the
+    parameters of the checkpoint described by `expected`.
+
+    Parameters
+    ----------
+    expected : dict
+        The fingerprint stored in the checkpoint.
+    actual : dict
+        The fingerprint of the model.
+    filepath : str
+        The path of the checkpoint, for the error message.
+    """
+    if expected['model_class'] != actual['model_class']:
+        raise ValueError("%s holds the parameters of a %s, not of a %s." %
+                         (filepath, expected['model_class'],
+                          actual['model_class']))
+    if len(expected['params']) != len(actual['params']):
+        raise ValueError("%s holds %d parameters, but the model has %d." %
+                         (filepath, len(expected['params']),
+                          len(actual['params'])))
+    for i, (stored, param) in enumerate(zip(expected['params'],
+                                            actual['params'])):
+        if list(stored) != list(param):
+            raise ValueError("Parameter %d of %s is %s with shape %s and "
+                             "dtype %s, but the model has %s with shape %s "
+                             "and dtype %s." %
+                             tuple([i, filepath] + list(stored) +
+                                   list(param)))
+
+
+def _member_offsets(filepath):
+    """
+    Finds the arrays stored aligned and without compression in a .npz
+    file.
+
+    Returns
+    -------
+    offsets : dict
+        Maps the names of the arrays to (offset, dtype, shape, fortran
+        order) tuples, where `offset` is the position of the data of the
+        array in the file.
+    """
+    offsets = {}
+    with zipfile.ZipFile(filepath) as archive:
+        infos = archive.infolist()
+    with open(filepath, 'rb') as f:
+        for info in infos:
+            if (info.compress_type != zipfile.ZIP_STORED or
+                    not info.filename.endswith('.npy')):
+                continue
+            f.seek(info.header_offset)
+            header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            name_length, extra_length = header[-2:]
+            f.seek(name_length + extra_length, os.SEEK_CUR)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                read_header = np.lib.format.read_array_header_1_0
+            elif version == (2, 0):
+                read_header = np.lib.format.read_array_header_2_0
+            else:
+                continue
+            shape, fortran_order, dtype = read_header(f)
+            # Unaligned data could not be given to the shared variables
+            # without a copy
+            if dtype.hasobject or f.tell() % dtype.alignment:
+                continue
+            offsets[info.filename[:-len('.npy')]] = (f.tell(), dtype, shape,
+                                                     fortran_order)
+    return offsets
+
+
+def _write_npz(f, arrays):
+    """
+    Writes arrays to an uncompressed .npz file, like `np.savez`, but
+    with the members aligned on `_ALIGNMENT` bytes.
+
+    Parameters
+    ----------
+    f : file
+        The file, open for writing in binary mode.
+    arrays : dict
+        Maps the names of the members to the arrays.
+    """
+    with zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED,
+                         allowZip64=True) as archive:
+        for name in sorted(arrays):
+            buf = six.BytesIO()
+            np.lib.format.write_array(buf, np.asanyarray(arrays[name]))
+            data = buf.getvalue()
+            info = zipfile.ZipInfo(name + '.npy')
+            info.external_attr = 0o644 << 16
+            start = f.tell() + _LOCAL_HEADER.size + len(info.filename)
+            if len(data) * 1.05 > zipfile.ZIP64_LIMIT:
+                start += _ZIP64_EXTRA_SIZE
+            padding = -(start + 4) % _ALIGNMENT
+            info.extra = (struct.pack('<2H', _PADDING_EXTRA_ID, padding) +
+                          b'\0' * padding)
+            archive.writestr(info, data)
+
+
+class ParamCheckpoint(object):
+    """
+    Read access to a parameter checkpoint.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the checkpoint. Environment variables are expanded.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = preprocess(filepath)
+        with np.load(self.filepath) as npz:
+            if _METADATA_KEY not in npz.files:
+                raise ValueError("%s is not a parameter checkpoint." %
+                                 self.filepath)
+            self.metadata = json.loads(six.text_type(npz[_METADATA_KEY][()]))
+        if self.metadata['format'] > FORMAT_VERSION:
+            raise ValueError("%s was written by a newer version of "
+                             "pylearn2 (format %d)." %
+                             (self.filepath, self.metadata['format']))
+        self._offsets = None
+
+    @property
+    def fingerprint(self):
+        """
+        The fingerprint of the model the parameters belong to.
+        """
+        return {'model_class': self.metadata['model_class'],
+                'params': self.metadata['params']}
+
+    @property
+    def yaml_src(self):
+        """
+        The YAML description of the model, or None if it was not known
+        when the checkpoint was saved.
+        """
+        return self.metadata['yaml_src']
+
+    @property
+    def layers(self):
+        """
+        The name of the layer each parameter belongs to, or None for the
+        parameters that do not belong to a layer.
+        """
+        return self.metadata['layers']
+
+    def _path_of(self, index):
+        """
+        Returns the path of the file holding the value of a parameter.
+        """
+        source = self.metadata['sources'][index]
+        if source is None:
+            return self.filepath
+        return os.path.join(os.path.dirname(self.filepath), source[0])
+
+    def source(self, index):
+        """
+        Returns the absolute path of the file holding the value of a
+        parameter, and the id of that checkpoint.
+
+        Parameters
+        ----------
+        index : int
+            The index of the parameter in `model.get_params()`.
+        """
+        source = self.metadata['sources'][index]
+        if source is None:
+            return os.path.abspath(self.filepath), self.metadata['id']
+        return os.path.abspath(self._path_of(index)), source[1]
+
+    def get_value(self, index, mmap=True):
+        """
+        Reads the value of a parameter.
+
+        Parameters
+        ----------
+        index : int
+            The index of the parameter in `model.get_params()`.
+        mmap : bool, optional
+            If True, the value is memory-mapped copy-on-write, so only the
+            pages that are used are read, and modifying it does not modify
+            the file.
+
+        Returns
+        -------
+        value : ndarray
+            The value of the parameter.
+        """
+        if self.metadata['sources'][index] is not None:
+            path, checkpoint_id = self.source(index)
+            base = ParamCheckpoint(path)
+            if base.metadata['id'] != checkpoint_id:
+                raise ValueError("Parameter %d of %s is stored in %s, "
+                                 "which was overwritten by another "
+                                 "checkpoint since." %
+                                 (index, self.filepath, path))
+            return base.get_value(index, mmap)
+        key = 'param_%d' % index
+        if mmap:
+            if self._offsets is None:
+                self._offsets = _member_offsets(self.filepath)
+            if key in self._offsets:
+                offset, dtype, shape, fortran_order = self._offsets[key]
+                if np.prod(shape) == 0:
+                    return np.empty(shape, dtype=dtype)
+                return np.memmap(self.filepath, dtype=dtype, mode='c',
+                                 offset=offset, shape=shape,
+                                 order='F' if fortran_order else 'C')
+        with np.load(self.filepath) as npz:
+            return npz[key]
+
+
+def save_params(filepath, model, base=None):
+    """
+    Saves the parameters of a model to a parameter checkpoint.
+
+    The file is written under a temporary name then renamed, so readers
+    never see a partially written checkpoint. The data of the parameters
+    is aligned in the file, so that it can be memory-mapped and given to
+    the shared variables without a copy.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the checkpoint. Should end with `.npz`. Environment
+        variables are expanded.
+    model : Model
+        The model. Its `yaml_src` attribute, set when the model is built
+        from a YAML file, is stored to build the model again at loading.
+    base : str, optional
+        The path of a previous checkpoint of the same model, which must
+        remain available. The parameters whose values are equal in both
+        are not written again, but referenced.
+    """
+    filepath = preprocess(filepath)
+    values = model.get_param_values(borrow=True)
+    metadata = fingerprint(model, values)
+    owners = _param_layers(model)
+    metadata['layers'] = [owners.get(id(param))
+                          for param in model.get_params()]
+    metadata['yaml_src'] = getattr(model, 'yaml_src', None)
+    metadata['format'] = FORMAT_VERSION
+    metadata['id'] = uuid.uuid4().hex
+
+    sources = [None] * len(values)
+    if base is not None:
+        base = ParamCheckpoint(base)
+        if os.path.abspath(base.filepath) == os.path.abspath(filepath):
+            raise ValueError("A checkpoint can not be a delta against the "
+                             "file it replaces.")
+        check_fingerprint(base.fingerprint, metadata, base.filepath)
+        directory = os.path.dirname(os.path.abspath(filepath))
+        for i, value in enumerate(values):
+            if np.array_equal(value, base.get_value(i)):
+                path, checkpoint_id = base.source(i)
+                sources[i] = [os.path.relpath(path, directory),
+                              checkpoint_id]
+    metadata['sources'] = sources
+
+    arrays = dict(('param_%d' % i, value)
+                  for i, (value, source) in enumerate(zip(values, sources))
+                  if source is None)
+    arrays[_METADATA_KEY] = np.array(json.dumps(metadata))
+
+    save_dir = os.path.dirname(filepath)
+    if save_dir != '' and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    tmp_path = '%s.tmp%d' % (filepath, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            _write_npz(f, arrays)
+        os.rename(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def is_param_checkpoint(filepath):
+    """
+    Tells whether a file is a parameter checkpoint.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the file.
+    """
+    try:
+        with zipfile.ZipFile(filepath) as archive:
+            return _METADATA_KEY + '.npy' in archive.namelist()
+    except (IOError, OSError, zipfile.BadZipfile):
+        return False
+
+
+def load_model(filepath, yaml_src=None, layers=None, mmap=True):
+    """
+    Builds a model from its YAML description and sets its parameters from
+    a parameter checkpoint.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the checkpoint.
+    yaml_src : str, optional
+        The YAML description of the model. Defaults to the one stored in
+        the checkpoint.
+    layers : list of str, optional
+        If specified, only the parameters of these layers are loaded, the
+        others keep the values the model was initialized with.
+    mmap : bool, optional
+        If True, the parameters are memory-mapped copy-on-write (see
+        `ParamCheckpoint.get_value`) and given to the shared variables
+        without copying, when they live on the CPU.
+
+    Returns
+    -------
+    model : Model
+        The model.
+    """
+    from pylearn2.config import yaml_parse
+
+    checkpoint = ParamCheckpoint(filepath)
+    if yaml_src is None:
+        yaml_src = checkpoint.yaml_src
+        if yaml_src is None:
+            raise ValueError("%s does not hold the YAML description of the "
+                             "model, which must be given." %
+                             checkpoint.filepath)
+    model = yaml_parse.load(yaml_src)
+    check_fingerprint(checkpoint.fingerprint, fingerprint(model),
+                      checkpoint.filepath)
+    if layers is not None:
+        unknown = set(layers).difference(checkpoint.layers)
+        if unknown:
+            raise ValueError("%s has no parameters of the layers %s." %
+                             (checkpoint.filepath, sorted(unknown)))
+    for i, param in enumerate(model.get_params()):
+        if layers is not None and checkpoint.layers[i] not in layers:
+            continue
+        param.set_value(checkpoint.get_value(i, mmap), borrow=mmap)
+    return model
@@ -5,8 +5,11 @@ try:
     from cPickle import BadPickleGet
 except ImportError:
     BadPickleGet = KeyError
+import copy
 import pickle
 import logging
+import threading
+import weakref
 import numpy as np
 from theano.compat import six
 from theano.compat.six.moves import cPickle, xrange
@@ -16,6 +19,7 @@ import warnings
 import sys
 from pylearn2.utils.string_utils import preprocess
 from pylearn2.utils.mem import improve_memory_error_message
+from pylearn2.utils.timing import log_timing
 io = None
 hdf_reader = None
 import struct
@@ -34,7 +38,9 @@ def load(filepath, retry=True):
     ----------
     filepath : str
         A path to a file to load. Should be a pickle, Matlab, or NumPy
-        file; or a .txt or .amat file that numpy.loadtxt can load.
+        file; or a .txt or .amat file that numpy.loadtxt can load. A
+        parameter checkpoint (see `pylearn2.utils.param_checkpoint`) is
+        loaded as the model it was saved from.
     retry : bool, optional
         If True, will make a handful of attempts to load the file before
         giving up. This can be useful if you are for example calling
@@ -124,6 +130,192 @@ def save(filepath, obj, on_overwrite='ignore'):
                 sys.setrecursionlimit(old_limit)
 
 
+def _atomic_save(filepath, obj, on_overwrite='ignore'):
+    """
+    Saves `obj` to a temporary file in the directory of `filepath`, then
+    renames it to `filepath`, so that readers never see a partially written
+    file, even if the job dies while saving.
+
+    Parameters
+    ----------
+    filepath : str
+        A filename, see `save`.
+    obj : object
+        The object to save.
+    on_overwrite : str, optional
+        Only used for .joblib files, which are made of several files and
+        can not be renamed atomically. See `save`.
+    """
+    filepath = preprocess(filepath)
+    if filepath.endswith('.joblib'):
+        save(filepath, obj, on_overwrite=on_overwrite)
+        return
+    # Keep the extension, since it decides how the object is saved
+    base, ext = os.path.splitext(filepath)
+    tmp_path = '%s.tmp%d%s' % (base, os.getpid(), ext)
+    try:
+        save(tmp_path, obj)
+        os.rename(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class CheckpointWriter(object):
+    """
+    Saves objects on a background thread, so that training goes on while
+    a checkpoint is pickled and written, which can take long for big
+    models on network file systems.
+
+    `save` takes an in-memory snapshot of the object with `copy.deepcopy`
+    (which, like pickling, goes through `__getstate__`, so the Theano
+    functions and datasets are not copied), so that the background thread
+    does not see the changes the training makes in the meantime. The
+    snapshot is then pickled and written to a temporary file, which is
+    renamed at the end. At most one write is in flight: `save` waits for
+    the previous one to complete before starting a new one.
+
+    Errors raised by a write are raised again by the next call to `save`
+    or `flush`.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._error = None
+        _checkpoint_writers.add(self)
+
+    def save(self, filepath, obj, on_overwrite='ignore'):
+        """
+        Starts saving a snapshot of `obj` to `filepath`.
+
+        Parameters
+        ----------
+        filepath : str
+            A filename, see `save`.
+        obj : object
+            The object to save.
+        on_overwrite : str, optional
+            Only used for .joblib files, see `save`. The other files are
+            always replaced atomically.
+        """
+        self.flush()
+        snapshot = copy.deepcopy(obj)
+
+        def write():
+            try:
+                _atomic_save(filepath, snapshot, on_overwrite)
+            except Exception:
+                self._error = sys.exc_info()
+
+        self._thread = threading.Thread(target=write,
+                                        name='CheckpointWriter')
+        self._thread.start()
+
+    def flush(self):
+        """
+        Waits for the write in flight, if any, to complete, and raises the
+        exception it raised, if any.
+        """
+        if self._thread is not None:
+            with log_timing(logger, None, level=logging.DEBUG,
+                            final_msg='Waited for the checkpoint writer:'):
+                self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            exc_info = self._error
+            self._error = None
+            six.reraise(*exc_info)
+
+
+# All the checkpoint writers, so that their writes can be flushed at the end
+# of training, including those of the extensions
+_checkpoint_writers = weakref.WeakSet()
+
+
+def flush_checkpoint_writers():
+    """
+    Waits for the writes in flight of all the `CheckpointWriter` objects.
+    """
+    for writer in list(_checkpoint_writers):
+        writer.flush()
+
+
+def _is_plain(value):
+    """
+    Tells whether a value is made only of numbers, strings, numpy arrays
+    and containers of those.
+    """
+    if value is None or isinstance(value, six.string_types + (bool, float,
+                                                              complex,
+                                                              np.number)):
+        return True
+    if isinstance(value, six.integer_types):
+        return True
+    if isinstance(value, np.ndarray):
+        return value.dtype != np.dtype(object)
+    if isinstance(value, (list, tuple)):
+        return all(_is_plain(item) for item in value)
+    if isinstance(value, dict):
+        return all(_is_plain(key) and _is_plain(item)
+                   for key, item in six.iteritems(value))
+    return False
+
+
+def plain_state(obj):
+    """
+    Returns the attributes of an object that are plain values (numbers,
+    strings, numpy arrays and containers of those), e.g. the counters of a
+    learning rate schedule.
+
+    This is used to checkpoint the state of training extensions and
+    callbacks, which are not pickled with the model: their other
+    attributes, like Theano variables or references to the model, are
+    recreated by the training script.
+
+    Parameters
+    ----------
+    obj : object
+        The object.
+
+    Returns
+    -------
+    state : tuple
+        The name of the class of `obj` and a copy of its plain
+        attributes, to restore with `set_plain_state`.
+    """
+    attributes = dict((name, value)
+                      for name, value in six.iteritems(
+                          getattr(obj, '__dict__', {}))
+                      if _is_plain(value))
+    return obj.__class__.__name__, copy.deepcopy(attributes)
+
+
+def set_plain_state(obj, state):
+    """
+    Restores the plain attributes of an object saved by `plain_state`.
+
+    Parameters
+    ----------
+    obj : object
+        The object.
+    state : tuple
+        A state returned by `plain_state`.
+
+    Returns
+    -------
+    restored : bool
+        False if the state was taken from an object of another class, in
+        which case it is not restored.
+    """
+    class_name, attributes = state
+    if class_name != obj.__class__.__name__:
+        logger.warning("Not restoring the state of a %s into a %s." %
+                       (class_name, obj.__class__.__name__))
+        return False
+    obj.__dict__.update(copy.deepcopy(attributes))
+    return True
+
+
 def get_pickle_protocol():
     """
     Allow configuration of the pickle protocol on a per-machine basis.
@@ -465,6 +657,11 @@ def _load(filepath, recurse_depth=0, retry=True):
     if recurse_depth == 0:
         filepath = preprocess(filepath)
 
+    if filepath.endswith('.npz'):
+        from pylearn2.utils import param_checkpoint
+        if param_checkpoint.is_param_checkpoint(filepath):
+            return param_checkpoint.load_model(filepath)
+
     if filepath.endswith('.npy') or filepath.endswith('.npz'):
         return np.load(filepath)
 
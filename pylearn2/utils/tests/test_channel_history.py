@@ -0,0 +1,92 @@
+"""
+Tests for pylearn2.utils.channel_history
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from theano.compat.six.moves import cPickle
+
+from pylearn2.utils.channel_history import (ChannelHistory, ChannelRecord,
+                                            append_step, as_record,
+                                            history_path, load_history,
+                                            write_history)
+
+
+def test_channel_record():
+    """
+    Tests that a ChannelRecord behaves like the list it replaces.
+    """
+    record = ChannelRecord('float64')
+    assert len(record) == 0
+    assert record == []
+    for i in range(40):
+        record.append(np.float32(i) / 2)
+    assert len(record) == 40
+    assert record[-1] == 19.5
+    assert record[:3] == [0., .5, 1.]
+    assert isinstance(record[:3], ChannelRecord)
+    record[-1] = 3.
+    assert list(record)[-1] == 3.
+    assert np.asarray(record).shape == (40,)
+
+    copy = cPickle.loads(cPickle.dumps(record))
+    assert copy == record
+    copy.append(1.)
+    assert len(copy) == 41
+
+    # Concatenation, as done by the live monitor
+    record = ChannelRecord('int64', [1, 2])
+    total = record + [3]
+    assert isinstance(total, ChannelRecord)
+    assert total == [1, 2, 3]
+    assert record == [1, 2]
+    same = record
+    record += ChannelRecord('int64', [3, 4])
+    assert record is same
+    assert record == [1, 2, 3, 4]
+
+    # Old pickle files may hold records that are not numbers
+    assert as_record([None, None], 'batch_record') == [None, None]
+    assert isinstance(as_record([1, 2], 'batch_record'), ChannelRecord)
+
+
+def test_history_log():
+    """
+    Tests writing and reading the history log.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        log_path = history_path(os.path.join(path, 'model.pkl'))
+        assert log_path == os.path.join(path, 'model_monitor.jsonl')
+
+        channels = {}
+        for name in ['a', 'b']:
+            channels[name] = ChannelHistory(name)
+        for step in range(3):
+            for name, channel in channels.items():
+                # Channel b is added after the first step
+                if name == 'b' and step == 0:
+                    continue
+                channel.val_record.append(step * 2.)
+                channel.std_err_record.append(0.)
+                channel.batch_record.append(step * 10)
+                channel.example_record.append(step * 100)
+                channel.epoch_record.append(step)
+                channel.time_record.append(step * 1.5)
+        write_history(log_path, channels)
+        append_step(log_path,
+                    {'epochs': 3, 'batches': 30, 'examples': 300,
+                     'time': 4.5},
+                    {'a': (6., 0.), 'b': (np.float32(6.), 0.1)})
+
+        loaded = load_history(log_path)
+        assert sorted(loaded.keys()) == ['a', 'b']
+        assert loaded['a'].val_record == [0., 2., 4., 6.]
+        assert loaded['a'].epoch_record == [0, 1, 2, 3]
+        assert loaded['b'].val_record == [2., 4., 6.]
+        assert loaded['b'].example_record == [100, 200, 300]
+        assert loaded['b'].std_err_record == [0., 0., .1]
+    finally:
+        shutil.rmtree(path)
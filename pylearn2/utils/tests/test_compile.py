@@ -1,10 +1,20 @@
 """Tests for compilation utilities."""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
 import theano
 import pickle
 
+from pylearn2.utils import function, sharedX
 from pylearn2.utils.compile import (
-    compiled_theano_function, HasCompiledFunctions
+    compiled_theano_function, HasCompiledFunctions, cached_function,
+    start_profiling, stop_profiling, profiling_enabled, write_profile_report
 )
+from pylearn2.utils.compile import _op_key
 
 
 class Dummy(HasCompiledFunctions):
@@ -32,3 +42,93 @@ def test_pickling():
     assert not hasattr(b, '_compiled_functions')
     assert abs(b.func() - Dummy.const) < 1e-6
     assert not (a.func is b.func)
+
+
+def test_cached_function():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        def make(value):
+            x = theano.tensor.vector('x')
+            w = sharedX(np.zeros(3), 'w')
+            w.set_value(np.cast[theano.config.floatX](value))
+            f = cached_function([x], (w * x).sum(), updates={w: w + x},
+                                cache_dir=cache_dir)
+            return f, w
+
+        f, w = make([0., 0., 0.])
+        assert len(os.listdir(cache_dir)) == 1
+        f(np.ones(3, dtype=theano.config.floatX))
+        assert np.allclose(w.get_value(), 1.)
+
+        # Same graph, other shared variable: the cached function is used,
+        # and works on the new shared variable
+        g, v = make([2., 2., 2.])
+        assert len(os.listdir(cache_dir)) == 1
+        out = g(np.ones(3, dtype=theano.config.floatX))
+        assert np.allclose(out, 6.)
+        assert np.allclose(v.get_value(), 3.)
+        assert np.allclose(w.get_value(), 1.)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def op_keys():
+    """
+    Returns the keys of the Ops of a graph holding Elemwise, reduction and
+    DimShuffle Ops, one per line.
+    """
+    x = theano.tensor.matrix('x')
+    y = (theano.tensor.exp(x) * 2).sum(axis=0).dimshuffle('x', 0) + x
+    nodes = theano.gof.graph.io_toposort([x], [y])
+    return '\n'.join(_op_key(node.op) for node in nodes)
+
+
+def test_op_key_across_processes():
+    """
+    Tests that the keys of Ops are the same in another process.
+    """
+    keys = op_keys()
+    assert ' at 0x' not in keys
+    code = ('from pylearn2.utils.tests.test_compile import op_keys; '
+            'print(op_keys())')
+    other = subprocess.check_output([sys.executable, '-c', code])
+    assert other.decode().strip() == keys
+
+
+def test_profile_report():
+    """
+    Tests that the functions compiled while profiling appear in the
+    report.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.matrix()
+        w = sharedX(np.ones((3, 2)))
+        start_profiling()
+        try:
+            assert profiling_enabled()
+            f = cached_function([x], theano.tensor.dot(x, w),
+                                name='profiled_dot')
+            g = function([x], theano.tensor.exp(x).sum(),
+                         name='profiled_exp')
+            for i in range(3):
+                f(np.ones((4, 3), dtype=x.dtype))
+                g(np.ones((4, 3), dtype=x.dtype))
+            report_path = os.path.join(path, 'profile.txt')
+            write_profile_report(report_path)
+        finally:
+            profiles = stop_profiling()
+        assert not profiling_enabled()
+        assert len(profiles) == 2
+        assert all(profile.fct_callcount == 3 for profile in profiles)
+        with open(report_path) as f:
+            report = f.read()
+        assert 'Profile of 2 pylearn2 functions' in report
+        assert 'Op classes by time' in report
+        assert 'profiled_dot' in report and 'profiled_exp' in report
+
+        # Functions compiled afterwards are not profiled
+        h = function([x], x.sum())
+        assert not h.profile
+    finally:
+        shutil.rmtree(path)
@@ -1,6 +1,8 @@
 """Tests for iterators."""
 from __future__ import print_function
 
+import pickle
+
 from nose.tools import assert_raises
 import numpy as np
 import theano
@@ -15,6 +17,11 @@ from pylearn2.utils.iteration import (
     BatchwiseShuffledSequentialIterator,
     as_even,
     EvenSequencesSubsetIterator,
+    FiniteDatasetIterator,
+    BlockShuffledSubsetIterator,
+    block_shuffled,
+    resolve_iterator_class,
+    is_stochastic,
 )
 
 
@@ -252,3 +259,125 @@ def test_determinism_even_sequences():
         for i in ind_list:
             visited2[i] = b_ind
     assert np.all(np.asarray(visited1) == np.asarray(visited2))
+
+
+def test_finitedataset_prefetch():
+    """
+    Check that a prefetching FiniteDatasetIterator returns the same
+    batches, in the same order, as a regular one.
+    """
+    X = np.random.rand(23, 15).astype(theano.config.floatX)
+    y = np.random.rand(23, 5).astype(theano.config.floatX)
+    dataset = DenseDesignMatrix(X=X, y=y)
+    data_specs = dataset.get_data_specs()
+
+    def batches(prefetch):
+        iterator = dataset.iterator(mode='shuffled_sequential',
+                                    batch_size=5,
+                                    data_specs=data_specs,
+                                    rng=42,
+                                    prefetch=prefetch)
+        rval = list(iterator)
+        assert_raises(StopIteration, iterator.next)
+        return rval, iterator
+
+    expected, _ = batches(None)
+    prefetched, iterator = batches(2)
+    assert len(expected) == len(prefetched) == 5
+    for (e_X, e_y), (p_X, p_y) in zip(expected, prefetched):
+        assert np.all(e_X == p_X)
+        assert np.all(e_y == p_y)
+    assert iterator.starvation_time >= 0.
+
+
+def test_finitedataset_prefetch_error():
+    """
+    Check that errors raised on the prefetching thread are
+    re-raised by the consumer.
+    """
+    dataset = DenseDesignMatrix(
+        X=np.random.rand(20, 15).astype(theano.config.floatX))
+
+    def convert(batch):
+        raise RuntimeError('conversion failed')
+
+    iterator = FiniteDatasetIterator(
+        dataset,
+        SequentialSubsetIterator(20, 5, None),
+        data_specs=(VectorSpace(15), 'features'),
+        convert=[convert],
+        prefetch=1)
+    assert_raises(RuntimeError, iterator.next)
+    assert_raises(StopIteration, iterator.next)
+
+
+def test_block_shuffled():
+    """
+    Check that BlockShuffledSubsetIterator visits every example exactly
+    once and that each batch only touches a bounded number of chunks.
+    """
+    dataset_size = 103
+    chunk_size = 10
+    window_chunks = 3
+    iterator = BlockShuffledSubsetIterator(dataset_size, 7, None, rng=3,
+                                           chunk_size=chunk_size,
+                                           window_chunks=window_chunks)
+    visited = np.zeros(dataset_size, dtype='int32')
+    for idxs in iterator:
+        assert np.all(np.diff(idxs) > 0)
+        visited[idxs] += 1
+        # A batch can straddle two consecutive windows
+        assert len(np.unique(idxs // chunk_size)) <= 2 * window_chunks
+    assert np.all(visited == 1)
+
+
+def test_block_shuffled_resolve():
+    """
+    Check that the block_shuffled modes can be resolved, and that the
+    block_shuffled factory overrides the default parameters.
+    """
+    assert (resolve_iterator_class('block_shuffled') is
+            BlockShuffledSubsetIterator)
+    assert is_stochastic('even_block_shuffled')
+    cls = resolve_iterator_class(block_shuffled(chunk_size=4,
+                                                window_chunks=1))
+    iterator = cls(16, 4, None, rng=0)
+    for idxs in iterator:
+        # With windows of a single chunk aligned with the batches, every
+        # batch is exactly one chunk.
+        assert np.all(idxs == np.arange(idxs[0], idxs[0] + 4))
+        assert idxs[0] % 4 == 0
+
+    # The class can be pickled, e.g. by a monitor using it as mode
+    mode = block_shuffled(chunk_size=4, window_chunks=2)
+    assert block_shuffled(chunk_size=4, window_chunks=2) is mode
+    assert pickle.loads(pickle.dumps(mode)) is mode
+    assert pickle.loads(pickle.dumps(BlockShuffledSubsetIterator)) is \
+        BlockShuffledSubsetIterator
+
+
+def test_finitedataset_reuse_buffers():
+    """
+    Check that reusing output buffers returns the right examples and
+    cycles through the expected number of buffers.
+    """
+    X = np.random.rand(23, 15).astype(theano.config.floatX)
+    y = np.random.rand(23, 5).astype(theano.config.floatX)
+    dataset = DenseDesignMatrix(X=X, y=y)
+    iterator = dataset.iterator(mode='shuffled_sequential',
+                                batch_size=5,
+                                data_specs=dataset.get_data_specs(),
+                                rng=42,
+                                reuse_buffers=2)
+    indices = ShuffledSequentialSubsetIterator(23, 5, None, rng=42)
+    first_X = None
+    for i, ((batch_X, batch_y), idxs) in enumerate(zip(iterator, indices)):
+        assert np.all(batch_X == X[idxs])
+        assert np.all(batch_y == y[idxs])
+        if i == 0:
+            first_X = batch_X
+        elif i == 2:
+            assert np.may_share_memory(first_X, batch_X)
+    assert_raises(ValueError, dataset.iterator, mode='shuffled_sequential',
+                  batch_size=5, data_specs=dataset.get_data_specs(),
+                  prefetch=2, reuse_buffers=3)
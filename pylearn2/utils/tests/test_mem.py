@@ -5,6 +5,8 @@ Tests for pylearn2.utils.mem functions and classes.
 
 from pylearn2.utils.mem import (
     TypicalMemoryError,
+    get_memory_usage,
+    get_peak_memory_usage,
     improve_memory_error_message
 )
 
@@ -35,3 +37,11 @@ def test_improve_memory_error_message():
         improve_memory_error_message(MemoryError("test"), "should not")
     except MemoryError as e:
         assert str(e) == "test"
+
+
+def test_peak_memory_usage():
+    """
+    Tests that the peak memory usage is at least the current one.
+    """
+    current = get_memory_usage()
+    assert get_peak_memory_usage() >= current > 0
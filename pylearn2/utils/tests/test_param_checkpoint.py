@@ -0,0 +1,170 @@
+"""
+Tests for pylearn2.utils.param_checkpoint
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pylearn2.config import yaml_parse
+from pylearn2.utils import serial
+from pylearn2.utils.param_checkpoint import (ParamCheckpoint, load_model,
+                                             params_path, save_params)
+
+
+MODEL_YAML = """
+!obj:pylearn2.models.mlp.MLP {
+    nvis: 5,
+    layers: [
+        !obj:pylearn2.models.mlp.Linear {
+            layer_name: 'h0',
+            dim: 4,
+            irange: .1,
+        },
+        !obj:pylearn2.models.mlp.Softmax {
+            layer_name: 'y',
+            n_classes: 3,
+            irange: .1,
+        },
+    ],
+}
+"""
+
+
+def perturb(model, layer_names, seed):
+    """
+    Sets the parameters of some layers of a model to random values.
+
+    Parameters
+    ----------
+    model : MLP
+        The model.
+    layer_names : list of str
+        The names of the layers whose parameters are set.
+    seed : int
+        Seed of the random values.
+    """
+    rng = np.random.RandomState(seed)
+    for layer in model.layers:
+        if layer.layer_name not in layer_names:
+            continue
+        for param in layer.get_params():
+            value = param.get_value()
+            param.set_value(rng.uniform(size=value.shape)
+                            .astype(value.dtype))
+
+
+def assert_same_params(a, b):
+    """
+    Asserts that two models have the same parameter values.
+
+    Parameters
+    ----------
+    a : Model
+        The first model.
+    b : Model
+        The second model.
+    """
+    for x, y in zip(a.get_param_values(), b.get_param_values()):
+        np.testing.assert_equal(x, y)
+
+
+def test_save_and_load():
+    """
+    Tests that a model is restored from its parameters and its YAML,
+    by load_model and serial.load.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        model = yaml_parse.load(MODEL_YAML)
+        perturb(model, ['h0', 'y'], 0)
+        filepath = params_path(os.path.join(path, 'model.pkl'))
+        assert filepath == os.path.join(path, 'model_params.npz')
+        save_params(filepath, model)
+
+        assert_same_params(load_model(filepath), model)
+        assert_same_params(load_model(filepath, mmap=False), model)
+        assert_same_params(serial.load(filepath), model)
+
+        # Only the parameters of the selected layers are loaded
+        partial = load_model(filepath, layers=['y'])
+        np.testing.assert_equal(partial.layers[1].get_param_values(),
+                                model.layers[1].get_param_values())
+        assert not np.array_equal(partial.layers[0].get_param_values()[0],
+                                  model.layers[0].get_param_values()[0])
+
+        # The structure of the model must match
+        other = MODEL_YAML.replace('dim: 4', 'dim: 6')
+        try:
+            load_model(filepath, yaml_src=other)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Loaded the parameters in a model with "
+                                 "different shapes.")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_memory_mapped():
+    """
+    Tests that serial.load gives the memory-mapped parameters to the
+    shared variables without copying them.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        model = yaml_parse.load(MODEL_YAML)
+        perturb(model, ['h0', 'y'], 0)
+        filepath = os.path.join(path, 'model_params.npz')
+        save_params(filepath, model)
+        loaded = serial.load(filepath)
+        assert_same_params(loaded, model)
+        for param in loaded.get_params():
+            value = param.get_value(borrow=True)
+            assert value.flags.aligned
+            assert not value.flags.owndata
+    finally:
+        shutil.rmtree(path)
+
+
+def test_delta():
+    """
+    Tests that the parameters that did not change since the base
+    checkpoint are referenced instead of stored.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        model = yaml_parse.load(MODEL_YAML)
+        first = os.path.join(path, 'first.npz')
+        second = os.path.join(path, 'second.npz')
+        third = os.path.join(path, 'third.npz')
+        save_params(first, model)
+        perturb(model, ['y'], 1)
+        save_params(second, model, base=first)
+        checkpoint = ParamCheckpoint(second)
+        sources = [checkpoint.source(i)[0]
+                   for i in range(len(model.get_params()))]
+        assert [source == os.path.abspath(first) for source in sources] == \
+            [layer_name == 'h0' for layer_name in checkpoint.layers]
+        assert os.path.getsize(second) < os.path.getsize(first)
+        assert_same_params(load_model(second), model)
+
+        # References are resolved to the file holding the values
+        perturb(model, ['y'], 2)
+        save_params(third, model, base=second)
+        assert_same_params(load_model(third), model)
+        checkpoint = ParamCheckpoint(third)
+        assert checkpoint.source(0)[0] == os.path.abspath(first)
+
+        # Overwriting a referenced checkpoint invalidates the references
+        save_params(first, model)
+        try:
+            load_model(third)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Loaded values from an overwritten base "
+                                 "checkpoint.")
+    finally:
+        shutil.rmtree(path)
@@ -1,10 +1,15 @@
 """
 Tests for the pylearn2.utils.serial module. Currently only tests
-read_bin_lush_matrix and load_train_file methods.
+read_bin_lush_matrix, load_train_file and CheckpointWriter.
 """
+import os
+import shutil
+import tempfile
+
 from theano.compat.six.moves import xrange
 import pylearn2
 from pylearn2.utils.serial import read_bin_lush_matrix, load_train_file
+from pylearn2.utils.serial import CheckpointWriter, load
 import numpy as np
 
 pylearn2_path = pylearn2.__path__[0]
@@ -135,3 +140,37 @@ def test_load_train_file():
     }
     load_train_file(yaml_path + 'test_model.yaml')
     load_train_file(yaml_path + 'test_model.yaml', environ=environ)
+
+
+def test_checkpoint_writer():
+    """
+    Checks that CheckpointWriter saves a snapshot of the object, and
+    raises the errors of the background writes.
+    """
+    save_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(save_dir, 'model.pkl')
+        obj = {'W': np.arange(5.)}
+        writer = CheckpointWriter()
+        writer.save(path, obj)
+        # Changes made after save are not in the checkpoint
+        obj['W'][:] = 0.
+        writer.flush()
+        assert np.all(load(path)['W'] == np.arange(5.))
+        assert os.listdir(save_dir) == ['model.pkl']
+
+        writer.save(path, obj)
+        writer.save(path, {'W': None})
+        writer.flush()
+        assert load(path)['W'] is None
+
+        writer.save(os.path.join(path, 'not_a_directory.pkl'), obj)
+        try:
+            writer.flush()
+        except (IOError, OSError):
+            pass
+        else:
+            raise AssertionError("The error of the write was not raised.")
+        writer.flush()
+    finally:
+        shutil.rmtree(save_dir)
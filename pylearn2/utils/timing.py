@@ -8,8 +8,14 @@ __maintainer__ = "David Warde-Farley"
 __email__ = "wardefar@iro"
 
 from contextlib import contextmanager
+import json
 import logging
 import datetime
+import os
+import threading
+from timeit import default_timer
+
+from pylearn2.compat import OrderedDict
 
 
 def total_seconds(delta):
@@ -82,3 +88,164 @@ def log_timing(logger, task, level=logging.INFO, final_msg=None,
     if callbacks is not None:
         for callback in callbacks:
             callback(total)
+
+
+class PhaseTimer(object):
+    """
+    Hierarchical timers for the phases of a computation, like the training
+    loop.
+
+    Phases are timed with the `phase` context manager, and may be nested:
+    the time of a phase started inside another one is recorded under a
+    path made of their names separated by slashes (e.g.
+    'train/sgd_update'). The timer keeps the total time spent in each
+    phase since the last call to `pop_totals`.
+
+    Parameters
+    ----------
+    trace_path : str, optional
+        If specified, each timed phase is also written to this file as an
+        event of the Chrome trace event format, which can be viewed with
+        chrome://tracing or Perfetto. The events are written as they
+        occur, so the trace of a job that died is still readable.
+    """
+
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self._stack = []
+        self._totals = OrderedDict()
+        self._t0 = default_timer()
+        self._trace_file = None
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager timing the code it encloses as one occurrence of
+        a phase.
+
+        Parameters
+        ----------
+        name : str
+            The name of the phase, relative to the enclosing phase.
+        """
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        start = default_timer()
+        try:
+            yield
+        finally:
+            end = default_timer()
+            self._stack.pop()
+            self._record(path, end - start, start)
+
+    def add(self, name, seconds):
+        """
+        Records time spent in a phase that was measured elsewhere, e.g. by
+        a background thread. It is added to the totals, but not to the
+        trace.
+
+        Parameters
+        ----------
+        name : str
+            The name of the phase, relative to the enclosing phase.
+        seconds : float
+            The time spent in the phase.
+        """
+        self._record('/'.join(self._stack + [name]), seconds)
+
+    def _record(self, path, seconds, start=None):
+        """
+        Adds an occurrence of a phase to the totals and to the trace.
+        """
+        self._totals[path] = self._totals.get(path, 0.) + seconds
+        if start is not None and self.trace_path is not None:
+            self._trace(path, start, seconds)
+
+    def _trace(self, path, start, seconds):
+        """
+        Writes one complete event to the trace file.
+        """
+        if self._trace_file is None:
+            self._trace_file = open(self.trace_path, 'w')
+            # The closing bracket of the array is optional in this format
+            self._trace_file.write('[\n')
+        event = OrderedDict([('name', path.rsplit('/', 1)[-1]),
+                             ('cat', path.split('/', 1)[0]),
+                             ('ph', 'X'),
+                             ('ts', (start - self._t0) * 1e6),
+                             ('dur', seconds * 1e6),
+                             ('pid', os.getpid()),
+                             ('tid', threading.current_thread().ident),
+                             ('args', {'path': path})])
+        self._trace_file.write(json.dumps(event) + ',\n')
+
+    def totals(self):
+        """
+        Returns the time spent in each phase since the last call to
+        `pop_totals`.
+
+        Returns
+        -------
+        totals : OrderedDict
+            Maps the paths of the phases, in the order they were first
+            recorded, to numbers of seconds.
+        """
+        return OrderedDict(self._totals)
+
+    def pop_totals(self):
+        """
+        Returns the time spent in each phase since the last call to
+        `pop_totals`, and starts counting again from zero.
+
+        Returns
+        -------
+        totals : OrderedDict
+            See `totals`.
+        """
+        totals = self._totals
+        self._totals = OrderedDict()
+        if self._trace_file is not None:
+            self._trace_file.flush()
+        return totals
+
+    def close(self):
+        """
+        Closes the trace file, if any.
+        """
+        if self._trace_file is not None:
+            self._trace_file.close()
+            self._trace_file = None
+
+
+class NullPhaseTimer(PhaseTimer):
+    """
+    A PhaseTimer that does not time anything, used when timing is
+    disabled so that the timed code does not need to check.
+    """
+
+    def __init__(self):
+        super(NullPhaseTimer, self).__init__()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Does not time the code it encloses.
+
+        Parameters
+        ----------
+        name : str
+            Ignored.
+        """
+        yield
+
+    def add(self, name, seconds):
+        """
+        Does not record anything.
+
+        Parameters
+        ----------
+        name : str
+            Ignored.
+        seconds : float
+            Ignored.
+        """